@@ -0,0 +1,131 @@
+"""
+压测用的 Kaggle 下载 API 替身，配合 KAGGLE_API_ENDPOINT 使用
+
+- /api/v1/datasets/download/<owner>/<slug> 与 /api/v1/models/.../download 302 跳转到 /blob/<名称>，
+  与真实 API 跳转到 GCS 签名地址的行为一致
+- /blob/ 支持 Range 与 x-goog-hash (md5)，数据集返回 zip，模型返回 tar
+- latency_ms 为每个请求的固定延迟；rate_limit_ratio 的概率返回 429；
+  disconnect_ratio 的概率只发送一半响应体后断开，用于验证分段续传
+探测请求 (Range: bytes=0-0) 不注入故障，否则下载器会直接回退到 kaggle cli / kagglehub
+"""
+import io
+import time
+import base64
+import random
+import hashlib
+import tarfile
+import zipfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _build_archive(kind, files, size):
+    """生成一个压缩包：files 个随机内容的文件，每个 size 字节 (随机内容使压缩后大小接近原始大小)"""
+    buf = io.BytesIO()
+    rng = random.Random(42)
+    if kind == "zip":
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+            for i in range(files):
+                zf.writestr(f"part_{i}.bin", rng.randbytes(size))
+    else:
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            for i in range(files):
+                data = rng.randbytes(size)
+                info = tarfile.TarInfo(f"weights_{i}.bin")
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+class FakeApi:
+    def __init__(self, config):
+        self.config = config
+        self.blobs = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "disconnected": 0}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def blob(self, kind):
+        with self.lock:
+            if kind not in self.blobs:
+                data = _build_archive(kind, self.config["files_per_item"], self.config["file_size"])
+                md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+                self.blobs[kind] = (data, md5)
+            return self.blobs[kind]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="fake-api").start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with api.lock:
+                    api.stats["requests"] += 1
+                time.sleep(api.config["latency_ms"] / 1000)
+
+                if self.path.startswith("/api/v1/"):
+                    kind = "tar" if self.path.startswith("/api/v1/models/") else "zip"
+                    self.send_response(302)
+                    self.send_header("Location", f"/blob/{kind}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                elif self.path.startswith("/blob/"):
+                    self._send_blob(self.path.rsplit("/", 1)[1])
+                else:
+                    self.send_error(404)
+
+            def _send_blob(self, kind):
+                data, md5 = api.blob(kind)
+                total = len(data)
+                range_header = self.headers.get("Range")
+                probe = range_header == "bytes=0-0"
+
+                if not probe and random.random() < api.config["rate_limit_ratio"]:
+                    with api.lock:
+                        api.stats["rate_limited"] += 1
+                    self.send_error(429, "Too Many Requests")
+                    return
+
+                start, end = 0, total - 1
+                if range_header and range_header.startswith("bytes="):
+                    first, _, last = range_header[6:].partition("-")
+                    start = int(first)
+                    end = min(int(last), total - 1) if last else total - 1
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{total}")
+                else:
+                    self.send_response(200)
+                body = data[start:end + 1]
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", f'"{kind}-{total}"')
+                self.send_header("x-goog-hash", f"crc32c=AAAAAA==,md5={md5}")
+                self.end_headers()
+
+                if not probe and random.random() < api.config["disconnect_ratio"]:
+                    with api.lock:
+                        api.stats["disconnected"] += 1
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,173 @@
+"""
+压测用的 kaggle 命令行替身，由 run_bench.py 以 `kaggle` 的名字放到 PATH 最前面
+
+行为由环境变量 BENCH_CONFIG 指向的 JSON 控制：
+    latency_ms        每次调用的固定延迟
+    rate_limit_ratio  以该概率返回 429 (写 stderr，退出码 1)
+    disconnect_ratio  以该概率在输出中带上 "Connection aborted."
+    pages / items_per_page / variations / files_per_item / file_size  合成数据的规模
+BENCH_FIXTURES 目录下存在 <子命令>.txt (如 datasets_list.txt) 时直接回放其内容，用于复现录制的真实响应
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+from pathlib import Path
+
+DEFAULTS = {
+    "latency_ms": 20,
+    "rate_limit_ratio": 0.0,
+    "disconnect_ratio": 0.0,
+    "pages": 2,
+    "items_per_page": 20,
+    "variations": 2,
+    "files_per_item": 2,
+    "file_size": 256 * 1024,
+}
+
+
+def load_config():
+    config = dict(DEFAULTS)
+    path = os.environ.get("BENCH_CONFIG")
+    if path and Path(path).exists():
+        with open(path, "r", encoding="utf-8") as f:
+            config.update(json.load(f))
+    return config
+
+
+def option(args, *flags, default=None):
+    for flag in flags:
+        if flag in args:
+            return args[args.index(flag) + 1]
+    return default
+
+
+def positional(args):
+    """去掉 --xxx value / -x value 形式的选项后剩下的位置参数"""
+    words, skip = [], False
+    for word in args:
+        if skip:
+            skip = False
+            continue
+        if word.startswith("-"):
+            # 无取值的开关
+            skip = word not in ("--csv", "-v", "-d", "-m", "--untar", "--unzip", "--force")
+            continue
+        words.append(word)
+    return words
+
+
+def fail(message):
+    sys.stderr.write(message + "\n")
+    sys.exit(1)
+
+
+def write_file(path, size):
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+
+
+def main():
+    config = load_config()
+    args = sys.argv[1:]
+    words = positional(args)
+    key = "_".join(words[:3] if words[:2] == ["models", "variations"] else words[:2])
+    # 条目 ref (owner/slug/...)；竞赛 slug 不带 /，取子命令后的第一个位置参数
+    ref = next((w for w in words if "/" in w), words[2] if len(words) > 2 else "")
+
+    time.sleep(config["latency_ms"] / 1000)
+    if random.random() < config["rate_limit_ratio"]:
+        fail("429 - Too Many Requests")
+    if random.random() < config["disconnect_ratio"]:
+        print("('Connection aborted.', RemoteDisconnected('Remote end closed connection without response'))")
+        sys.exit(1)
+
+    fixtures = os.environ.get("BENCH_FIXTURES")
+    if fixtures and (Path(fixtures) / f"{key}.txt").exists():
+        sys.stdout.write((Path(fixtures) / f"{key}.txt").read_text(encoding="utf-8"))
+        return
+
+    n = config["items_per_page"]
+    out_dir = Path(option(args, "-p", "--path", default="."))
+
+    # ---------- datasets ----------
+    if key == "datasets_list":
+        page = int(option(args, "--page", default="1"))
+        if page > config["pages"]:
+            print("No datasets found")
+            return
+        print("ref,title,size,lastUpdated,downloadCount,voteCount,usabilityRating")
+        for i in range(n):
+            print(f"bench/ds-{page}-{i},Dataset {page}-{i},{config['file_size'] * config['files_per_item']},"
+                  f"2024-01-01 00:00:00,10,5,1.0")
+    elif key == "datasets_metadata":
+        json.dump({"info": {"licenses": [{"name": "CC0-1.0"}], "keywords": ["bench"],
+                            "description": "bench dataset"}},
+                  open(out_dir / "dataset-metadata.json", "w"))
+    elif key == "datasets_files":
+        print("name,size,creationDate")
+        for i in range(config["files_per_item"]):
+            print(f"part_{i}.bin,{config['file_size']},2024-01-01 00:00:00")
+
+    # ---------- kernels ----------
+    elif key == "kernels_list":
+        page = int(option(args, "-p", "--page", default="1"))
+        if page > config["pages"]:
+            return
+        print("ref,title,author,lastRunTime,totalVotes")
+        for i in range(n):
+            print(f"bench/kernel-{page}-{i},Kernel {page}-{i},bench,2024-01-01 00:00:00,5")
+    elif key == "kernels_pull":
+        slug = ref.split("/")[-1]
+        json.dump({"id": ref, "title": slug, "language": "python", "kernel_type": "notebook"},
+                  open(out_dir / "kernel-metadata.json", "w"))
+        cell = {"cell_type": "code", "source": ["import numpy as np\n", "import pandas as pd\n"] * 200}
+        json.dump({"cells": [cell] * 20}, open(out_dir / f"{slug}.ipynb", "w"))
+    elif key == "kernels_output":
+        slug = ref.split("/")[-1]
+        (out_dir / f"{slug}.log").write_text("done\n" * 100)
+
+    # ---------- models ----------
+    elif key == "models_list":
+        token = option(args, "--page-token")
+        page = int(token[1:]) if token else 1
+        next_token = f"p{page + 1}" if page < config["pages"] else ""
+        print(f"Next Page Token = {next_token}")
+        print("ref,title")
+        for i in range(n):
+            print(f"bench/model-{page}-{i},Model {page}-{i}")
+    elif key == "models_get":
+        json.dump({"description": "bench model card"}, open(out_dir / "model-metadata.json", "w"))
+    elif key == "models_variations_list":
+        print("framework,instanceSlug")
+        for i in range(config["variations"]):
+            print(f"pytorch,v{i}")
+    elif key == "models_variations_get":
+        framework, instance = ref.split("/")[-2:]
+        json.dump({"framework": framework, "instanceSlug": instance, "usage": "bench", "versionNumber": 1},
+                  open(out_dir / f"{instance}.json", "w"))
+    elif key == "models_variations_versions":
+        for i in range(config["files_per_item"]):
+            write_file(out_dir / f"weights_{i}.bin", config["file_size"])
+
+    # ---------- competitions ----------
+    elif key == "competitions_leaderboard":
+        buf = io.StringIO()
+        buf.write("Rank,TeamName,Score,SubmissionCount\n")
+        for i in range(200):
+            buf.write(f"{i + 1},team-{i},{1 - i / 1000:.4f},{i % 7 + 1}\n")
+        with zipfile.ZipFile(out_dir / f"{ref}.zip", "w") as zf:
+            zf.writestr(f"{ref}-publicleaderboard.csv", buf.getvalue())
+    elif key == "competitions_files":
+        print("name,totalBytes,creationDate")
+        for i in range(config["files_per_item"]):
+            print(f"data/part_{i}.csv,{config['file_size']},2024-01-01 00:00:00")
+    else:
+        fail(f"404 - Not Found: fake kaggle does not implement {' '.join(args)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+入口脚本的导入耗时预算检查，超出预算或出现回退时以非零状态退出 (可直接放进 CI / cron 前的自检)
+
+对每个入口：
+- 在全新的子进程中测量 import 耗时，取 RUNS 次中的最小值，与该入口的预算比较
+- 导入后不允许已加载 HEAVY_MODULES 中的任何模块 (这些依赖应在首次使用时才导入)
+- 在空的临时目录中执行 import 与 --help，之后目录必须仍为空 (导入不能有文件系统副作用)
+
+用法:
+    python bench/import_budget.py
+    python bench/import_budget.py --runs 10 --verbose
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# (处理器目录, 入口模块, 导入耗时预算 ms)
+# 预算约为当前实测值的 2~3 倍，留出机器差异的余量；大幅变慢说明又有重依赖在导入时加载
+ENTRY_POINTS = [
+    ("kaggle_dataset_handler", "main", 250),
+    ("kaggle_kernel_handler", "main", 250),
+    ("kaggle_model_hanlder", "main", 250),
+    ("kaggle_competiton_hanlder", "fetch_leaderborad", 200),
+    ("kaggle_competiton_hanlder", "fetch_solutions", 200),
+    ("kaggle_competiton_hanlder", "meta_store", 150),
+]
+HEAVY_MODULES = ["pandas", "numpy", "boto3", "botocore", "kagglehub", "requests", "bs4"]
+RUNS = 5
+
+_PROBE = """
+import sys, time, json
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+__import__(sys.argv[2])
+elapsed = time.perf_counter() - start
+heavy = [m for m in json.loads(sys.argv[3]) if m in sys.modules]
+print(json.dumps({"ms": elapsed * 1000, "heavy": heavy}))
+"""
+
+
+def _clean_env():
+    env = dict(os.environ)
+    # 不受用户 PYTHONPATH 影响，保证测到的是仓库内的模块
+    env.pop("PYTHONPATH", None)
+    return env
+
+
+def measure(handler, module, runs):
+    """返回 (最小耗时 ms, 已加载的重依赖, 工作目录中新出现的文件)"""
+    handler_dir = str(REPO_DIR / handler)
+    best, heavy = None, []
+    with tempfile.TemporaryDirectory(prefix="import_budget_") as cwd:
+        for _ in range(runs):
+            proc = subprocess.run([sys.executable, "-c", _PROBE, handler_dir, module, json.dumps(HEAVY_MODULES)],
+                                  cwd=cwd, env=_clean_env(), capture_output=True, text=True)
+            if proc.returncode != 0:
+                raise RuntimeError(f"{handler}/{module} 导入失败:\n{proc.stderr.strip()}")
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            best = result["ms"] if best is None else min(best, result["ms"])
+            heavy = result["heavy"]
+
+        # --help 走完参数解析后退出，同样不应产生任何文件
+        subprocess.run([sys.executable, str(REPO_DIR / handler / f"{module}.py"), "--help"],
+                       cwd=cwd, env=_clean_env(), capture_output=True, text=True)
+        created = sorted(os.listdir(cwd))
+    return best, heavy, created
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入口脚本导入耗时预算检查")
+    parser.add_argument("--runs", type=int, default=RUNS, help="每个入口测量次数，取最小值")
+    parser.add_argument("--verbose", action="store_true", help="同时打印 -X importtime 中最慢的模块")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'入口':<48}{'耗时(ms)':>10}{'预算(ms)':>10}  结果")
+    for handler, module, budget in ENTRY_POINTS:
+        name = f"{handler}/{module}.py"
+        try:
+            ms, heavy, created = measure(handler, module, args.runs)
+        except RuntimeError as e:
+            failures.append(str(e))
+            print(f"{name:<48}{'-':>10}{budget:>10}  导入失败")
+            continue
+
+        problems = []
+        if ms > budget:
+            problems.append(f"超出预算 {ms - budget:.0f}ms")
+        if heavy:
+            problems.append(f"导入时加载了 {', '.join(heavy)}")
+        if created:
+            problems.append(f"导入 / --help 产生了文件: {', '.join(created)}")
+        print(f"{name:<48}{ms:>10.1f}{budget:>10}  {'; '.join(problems) or 'OK'}")
+        failures.extend(f"{name}: {p}" for p in problems)
+
+        if args.verbose:
+            proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                                   f"import sys; sys.path.insert(0, {str(REPO_DIR / handler)!r}); import {module}"],
+                                  cwd=tempfile.gettempdir(), env=_clean_env(), capture_output=True, text=True)
+            rows = [line.split("|") for line in proc.stderr.splitlines() if line.startswith("import time:")][1:]
+            rows = sorted(rows, key=lambda r: int(r[1]), reverse=True)[:8]
+            for r in rows:
+                print(f"    {int(r[1]) / 1000:>8.1f}ms  {r[2].strip()}")
+
+    if failures:
+        print("\n导入预算检查未通过:")
+        for f in failures:
+            print(f"  - {f}")
+        sys.exit(1)
+    print("\n导入预算检查通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+离线压测：不访问 Kaggle 与真实对象存储，端到端运行各处理器的主流程
+
+- fake_kaggle.py 以 `kaggle` 的名字放到 PATH 最前面，回放 / 合成 list、metadata、files 等命令的输出
+- fake_api.py 作为 KAGGLE_API_ENDPOINT，提供带 Range 与 md5 的下载
+- S3 使用 moto 的本地服务 (或 --s3-endpoint 指定的 MinIO)
+- 每个目标在独立的临时目录和子进程中运行，互不影响
+
+输出 items/s、bytes/s 与单条目 p50 / p99 耗时，并追加到 history.jsonl (带 git 版本)，
+与上一条相同配置的记录对比，方便发现版本之间的性能回退
+
+用法:
+    python bench/run_bench.py
+    python bench/run_bench.py --targets model upload --latency-ms 50 --rate-limit 0.05 --disconnect 0.02
+"""
+import os
+import sys
+import json
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+from fake_api import FakeApi
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+HANDLERS = {
+    "dataset": "kaggle_dataset_handler",
+    "model": "kaggle_model_hanlder",
+    "competition": "kaggle_competiton_hanlder",
+    "upload": "kaggle_dataset_handler",
+}
+BUCKET = "bench"
+# 与上一次结果相比下降超过该比例时标记为回退
+REGRESSION_THRESHOLD = 0.10
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_s3(endpoint=None):
+    """未指定 endpoint 时启动 moto 服务；返回 (endpoint, 停止函数)"""
+    if endpoint:
+        return endpoint, lambda: None
+    import logging
+    from moto.server import ThreadedMotoServer
+    # moto 基于 werkzeug，默认每个请求打印一行
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = _free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    return f"http://127.0.0.1:{port}", server.stop
+
+
+def ensure_bucket(endpoint, access_key, secret_key):
+    import boto3
+    s3 = boto3.client("s3", endpoint_url=endpoint, aws_access_key_id=access_key,
+                      aws_secret_access_key=secret_key, region_name="us-east-1")
+    if BUCKET not in [b["Name"] for b in s3.list_buckets().get("Buckets", [])]:
+        s3.create_bucket(Bucket=BUCKET)
+
+
+def make_bin_dir(root):
+    """生成名为 kaggle 的启动脚本，转发到 fake_kaggle.py"""
+    bin_dir = root / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "kaggle"
+    script.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{BENCH_DIR / "fake_kaggle.py"}" "$@"\n')
+    script.chmod(0o755)
+    return bin_dir
+
+
+def prepare_workspace(root, target, config, s3):
+    workspace = root / target
+    (workspace / "setting").mkdir(parents=True)
+    with open(workspace / "setting" / "cloud.json", "w", encoding="utf-8") as f:
+        json.dump({"ACCESS_KEY": s3["access_key"], "SECRET_KEY": s3["secret_key"],
+                   "ENDPOINT_URL": s3["endpoint"], "BUCKET_NAME": BUCKET, "OSS_PREFIX": f"bench/{target}"}, f)
+    if target == "upload":
+        # 与其他目标的单页产出规模相当：每页 items_per_page 个条目，每个条目 files_per_item 个文件
+        out = workspace / "local_workspace" / "output" / "datasets"
+        payload = os.urandom(config["file_size"])
+        for i in range(config["pages"] * config["items_per_page"]):
+            item_dir = out / f"bench_ds-{i}"
+            item_dir.mkdir(parents=True)
+            for j in range(config["files_per_item"]):
+                (item_dir / f"part_{j}.bin").write_bytes(payload)
+    return workspace
+
+
+def run_target(target, workspace, env, pages):
+    result_file = workspace / "bench_result.json"
+    cmd = [sys.executable, str(BENCH_DIR / "targets.py"), target,
+           str(REPO_DIR / HANDLERS[target]), str(pages), str(result_file)]
+    proc = subprocess.run(cmd, cwd=workspace, env=env, capture_output=True, text=True)
+    if not result_file.exists():
+        return {"error": f"exit {proc.returncode}: {proc.stderr.strip()[-500:]}"}
+    with open(result_file, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    return summarize(target, raw)
+
+
+def summarize(target, raw):
+    summary = raw["summary"]
+    stage_name = "upload" if target == "upload" else "item"
+    item_stage = summary["stages"].get(stage_name, {})
+    ok = item_stage.get("ok", {})
+    failed = item_stage.get("error", {}).get("count", 0)
+    elapsed = raw["elapsed_seconds"]
+
+    byte_total = sum(c["value"] for c in summary["counters"] if c["name"] == "kaggle_bytes_total")
+    retries = sum(c["value"] for c in summary["counters"] if c["name"] == "kaggle_retries_total")
+    items = ok.get("count", 0)
+    return {
+        "items": items,
+        "failed_items": failed,
+        "elapsed_seconds": round(elapsed, 3),
+        "items_per_sec": round(items / elapsed, 3) if elapsed else None,
+        "bytes": byte_total,
+        "bytes_per_sec": round(byte_total / elapsed, 1) if elapsed else None,
+        "p50_seconds": ok.get("p50_seconds"),
+        "p99_seconds": ok.get("p99_seconds"),
+        "retries": retries,
+        "error": raw["error"],
+    }
+
+
+def git_version():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return rev + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(history_file, config):
+    """history 中最后一条相同配置的记录"""
+    if not history_file.exists():
+        return None
+    previous = None
+    with open(history_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if entry.get("config") == config:
+                    previous = entry
+    return previous
+
+
+def report(results, previous):
+    print(f"\n{'目标':<12}{'items':>7}{'失败':>6}{'items/s':>10}{'MB/s':>9}{'p50(s)':>9}{'p99(s)':>9}{'重试':>6}  对比上次")
+    for target, r in results.items():
+        if "items" not in r:
+            print(f"{target:<12}  运行失败: {r['error']}")
+            continue
+        delta = ""
+        before = (previous or {}).get("results", {}).get(target, {}).get("items_per_sec")
+        if before and r["items_per_sec"] is not None:
+            change = r["items_per_sec"] / before - 1
+            delta = f"{change:+.1%}" + ("  <-- 回退" if change < -REGRESSION_THRESHOLD else "")
+        fmt = lambda v: "-" if v is None else f"{v:.3f}"
+        print(f"{target:<12}{r['items']:>7}{r['failed_items']:>6}{fmt(r['items_per_sec']):>10}"
+              f"{r['bytes_per_sec'] / 1e6 if r['bytes_per_sec'] else 0:>9.2f}"
+              f"{fmt(r['p50_seconds']):>9}{fmt(r['p99_seconds']):>9}{r['retries']:>6}  {delta}")
+        if r["error"]:
+            print(f"{'':<12}  异常: {r['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线压测各处理器")
+    parser.add_argument("--targets", nargs="+", choices=list(HANDLERS), default=list(HANDLERS))
+    parser.add_argument("--pages", type=int, default=2, help="每个目标处理的页数")
+    parser.add_argument("--items-per-page", type=int, default=20)
+    parser.add_argument("--files-per-item", type=int, default=2)
+    parser.add_argument("--file-size", type=int, default=256 * 1024, help="每个文件的字节数")
+    parser.add_argument("--latency-ms", type=int, default=20, help="每次 CLI 调用 / HTTP 请求的延迟")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--disconnect", type=float, default=0.0, help="连接中断的概率")
+    parser.add_argument("--fixtures", help="录制的 CLI 输出目录，存在 <子命令>.txt 时回放")
+    parser.add_argument("--s3-endpoint", help="使用已有的 S3 兼容服务 (如 MinIO)，默认启动 moto")
+    parser.add_argument("--s3-key", default="bench:bench-secret", help="S3 凭证 ACCESS:SECRET")
+    parser.add_argument("--history", default=str(BENCH_DIR / "history.jsonl"))
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录")
+    args = parser.parse_args()
+
+    config = {
+        "pages": args.pages,
+        "items_per_page": args.items_per_page,
+        "variations": 2,
+        "files_per_item": args.files_per_item,
+        "file_size": args.file_size,
+        "latency_ms": args.latency_ms,
+        "rate_limit_ratio": args.rate_limit,
+        "disconnect_ratio": args.disconnect,
+    }
+
+    root = Path(tempfile.mkdtemp(prefix="kaggle_bench_"))
+    with open(root / "config.json", "w", encoding="utf-8") as f:
+        json.dump(config, f)
+
+    access_key, secret_key = args.s3_key.split(":", 1)
+    endpoint, stop_s3 = start_s3(args.s3_endpoint)
+    api = FakeApi(config).start()
+    try:
+        ensure_bucket(endpoint, access_key, secret_key)
+        s3 = {"endpoint": endpoint, "access_key": access_key, "secret_key": secret_key}
+
+        env = dict(os.environ)
+        env.update({
+            "PATH": f"{make_bin_dir(root)}{os.pathsep}{env.get('PATH', '')}",
+            "BENCH_CONFIG": str(root / "config.json"),
+            "KAGGLE_API_ENDPOINT": api.endpoint,
+            "KAGGLE_USERNAME": "bench",
+            "KAGGLE_KEY": "bench",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        })
+        env.pop("KAGGLE_API_TOKEN", None)
+        if args.fixtures:
+            env["BENCH_FIXTURES"] = str(Path(args.fixtures).resolve())
+
+        results = {}
+        for target in args.targets:
+            print(f"[压测] {target} ...", flush=True)
+            workspace = prepare_workspace(root, target, config, s3)
+            results[target] = run_target(target, workspace, env, args.pages)
+    finally:
+        api.stop()
+        stop_s3()
+        if args.keep:
+            print(f"[压测] 工作目录: {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    history_file = Path(args.history)
+    previous = load_previous(history_file, config)
+    report(results, previous)
+    print(f"\nfake API: {api.stats}")
+
+    entry = {"time": datetime.now().isoformat(timespec="seconds"), "git": git_version(),
+             "python": sys.version.split()[0], "config": config, "results": results}
+    history_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(history_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    print(f"结果已追加到 {history_file}")
+
+
+if __name__ == "__main__":
+    main()
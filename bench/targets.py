@@ -0,0 +1,92 @@
+"""
+在单独的子进程中运行一个压测目标，由 run_bench.py 调用：
+    python targets.py <目标> <处理器目录> <页数> <结果文件>
+工作目录为 run_bench.py 准备的临时目录，各处理器模块的相对路径 (local_workspace、setting/cloud.json) 都落在其中
+每个条目的耗时记为 item 阶段 (上传目标直接使用 upload 阶段)，结果为 metrics.summary() 加上总耗时
+"""
+import sys
+import json
+import time
+import logging
+import functools
+from pathlib import Path
+
+
+def _timed_item(module, name):
+    """把 module.name 包装为 item 阶段，只在压测进程中生效"""
+    import metrics
+    func = getattr(module, name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with metrics.stage("item"):
+            return func(*args, **kwargs)
+
+    setattr(module, name, wrapper)
+
+
+def run_dataset(pages):
+    import get_data
+    _timed_item(get_data.KaggleProcessor, "process_single_item")
+    for page in range(1, pages + 1):
+        get_data.process_page(page)
+
+
+def run_model(pages):
+    import get_data
+    import variation_processor
+    _timed_item(variation_processor, "process_single_variation")
+    token = None
+    for _ in range(pages):
+        result = get_data.process_one_page(token)
+        if not result or not result["next_token"]:
+            break
+        token = result["next_token"]
+
+
+def run_competition(pages):
+    import fetch_leaderborad
+    _timed_item(fetch_leaderborad, "process_record")
+    with open("competitions_without_lrdbd.jsonl", "w", encoding="utf-8") as f:
+        for i in range(pages * 20):
+            f.write(json.dumps({"CompetitionID": i, "Slug": f"bench-comp-{i}", "HasLeaderboard": True,
+                                "DeadlineDate": "2024-01-01 00:00:00"}) + "\n")
+    # meta_dir 下没有 Teams / Submissions，排行榜全部走 kaggle-cli
+    Path("meta").mkdir(exist_ok=True)
+    fetch_leaderborad.fetch_leaderboards_from_jsonl("competitions_without_lrdbd.jsonl",
+                                                    "competitions_with_leaderboard.jsonl", meta_dir="meta")
+
+
+def run_upload(pages):
+    import upload
+    upload.upload_files_from_folder("local_workspace/output")
+
+
+RUNNERS = {
+    "dataset": run_dataset,
+    "model": run_model,
+    "competition": run_competition,
+    "upload": run_upload,
+}
+
+
+def main():
+    target, handler_dir, pages, result_file = sys.argv[1:5]
+    sys.path.insert(0, handler_dir)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    import metrics
+    metrics.configure(f"bench_{target}")
+    start = time.perf_counter()
+    error = None
+    try:
+        RUNNERS[target](int(pages))
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+    result = {"elapsed_seconds": time.perf_counter() - start, "error": error, "summary": metrics.summary()}
+    with open(result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
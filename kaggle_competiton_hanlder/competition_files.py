@@ -0,0 +1,171 @@
+import os
+import csv
+import json
+import time
+import random
+import subprocess
+from io import StringIO
+from datetime import datetime
+from pathlib import Path
+
+import metrics
+import errors
+import breaker
+import deadline
+
+MAX_RETRIES = 3
+BASE_SLEEP = 2
+PAGE_SIZE = 200
+# 文件列表缓存：截止后获取的列表在 DeadlineDate 不变时不会变化，一直有效；
+# 进行中 (或截止日期未知) 的竞赛仍可能新增、替换文件，缓存只在 ONGOING_TTL 秒内有效
+CACHE_DIR = Path("./cache/competition_files")
+ONGOING_TTL = 6 * 3600
+# Meta Kaggle 原始 CSV 与索引库 (meta_store.DATE_FORMAT) 中的日期格式
+DEADLINE_FORMATS = ["%Y-%m-%d %H:%M:%S", "%m/%d/%Y %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d", "%m/%d/%Y"]
+
+# 不同版本 kaggle-cli 输出的列名不同
+SIZE_COLUMNS = ["totalBytes", "total_bytes", "size"]
+DATE_COLUMNS = ["creationDate", "creation_date"]
+
+
+def _run_files_page(slug: str, page_token: str = None):
+    """
+    执行一页 kaggle competitions files，返回 stdout；竞赛不存在或无权限时返回 None 并记入负缓存
+    """
+    cmd = ["kaggle", "competitions", "files", slug, "--csv", "--page-size", str(PAGE_SIZE)]
+    if page_token:
+        cmd += ["--page-token", page_token]
+
+    key = errors.command_key(cmd)
+    if errors.known_failure(key):
+        return None
+    attempt = 0
+    while True:
+        breaker.wait()
+        attempt += 1
+        try:
+            result = deadline.run(cmd, check=True)
+            breaker.record_success()
+            return result.stdout
+        except (subprocess.CalledProcessError, deadline.DeadlineExceeded) as e:
+            detail = (getattr(e, "stderr", None) or str(e)).strip()
+            kind = errors.classify(e)
+            # Kaggle 中断期间挂起，本次失败不计入重试次数
+            if breaker.record_failure(kind, e):
+                attempt -= 1
+                continue
+            limit, _ = errors.resolve_policy(kind, MAX_RETRIES - 1, BASE_SLEEP)
+            if limit == 0:
+                print(f"[跳过] {slug} 无法获取文件列表 ({errors.LABELS[kind]}): {detail}")
+                errors.record_fast_fail("competitions files", kind)
+                errors.remember(key, e)
+                return None
+            if attempt <= limit:
+                metrics.record_retry("competitions files", detail)
+                if kind == errors.RATE_LIMITED:
+                    sleep_time = errors.backoff(kind, attempt - 1, BASE_SLEEP)
+                else:
+                    sleep_time = BASE_SLEEP * attempt + random.uniform(1, 3)
+                print(f"[重试] {slug} 文件列表第 {attempt} 次失败，等待 {sleep_time:.1f} 秒...")
+                time.sleep(sleep_time)
+            else:
+                print(f"[失败] {slug} 文件列表已达到最大重试次数: {detail}")
+                return None
+
+
+def _parse_files_page(output: str):
+    """
+    解析一页输出：可能以 Next Page Token 开头，之后是 CSV
+    返回 (文件列表, 下一页 token)
+    """
+    lines = [l for l in output.strip().split("\n") if l.strip()]
+    next_token = None
+    if lines and lines[0].strip().startswith("Next Page Token"):
+        next_token = lines[0].split("=", 1)[1].strip() or None
+        lines = lines[1:]
+
+    files = []
+    for row in csv.DictReader(StringIO("\n".join(lines))):
+        name = (row.get("name") or "").strip()
+        if not name:
+            continue
+        size = next((row[c] for c in SIZE_COLUMNS if row.get(c)), None)
+        files.append({
+            "name": name,
+            "size": int(size) if size and size.isdigit() else size,
+            "creationDate": next((row[c] for c in DATE_COLUMNS if row.get(c)), None),
+        })
+    return files, next_token
+
+
+def _cache_file(slug: str) -> Path:
+    return CACHE_DIR / f"{slug}.json"
+
+
+def _parse_deadline(text):
+    """DeadlineDate 转为时间戳，为空或无法解析时返回 None"""
+    if not text:
+        return None
+    for fmt in DEADLINE_FORMATS:
+        try:
+            return datetime.strptime(str(text).strip(), fmt).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def _load_cache(slug: str, cache_key):
+    """
+    缓存的 key 与 cache_key 一致，且获取时竞赛已截止 (列表不再变化) 或获取后不超过 ONGOING_TTL 秒时返回缓存
+    """
+    path = _cache_file(slug)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("key") != cache_key:
+        return None
+    fetched_at = cached.get("fetched_at") or 0
+    deadline_ts = _parse_deadline(cache_key)
+    if (deadline_ts is None or fetched_at <= deadline_ts) and time.time() - fetched_at > ONGOING_TTL:
+        return None
+    return cached["files"]
+
+
+def _save_cache(slug: str, cache_key, files):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = _cache_file(slug)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"key": cache_key, "fetched_at": time.time(), "files": files}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+@metrics.timed("files")
+def list_competition_files(slug: str, cache_key=None):
+    """
+    获取竞赛的全部数据文件 (name / size / creationDate)，自动翻页
+    cache_key 一般为竞赛的 DeadlineDate，与缓存中的一致且缓存仍有效 (见 _load_cache) 时直接返回缓存
+    获取失败返回 None (不写缓存，下次重试)
+    """
+    cached = _load_cache(slug, cache_key)
+    if cached is not None:
+        return cached
+
+    files = []
+    token = None
+    while True:
+        output = _run_files_page(slug, token)
+        if output is None:
+            return None
+        page, token = _parse_files_page(output)
+        files.extend(page)
+        if not token or not page:
+            break
+
+    _save_cache(slug, cache_key, files)
+    print(f"[文件] {slug} 共 {len(files)} 个文件")
+    return files
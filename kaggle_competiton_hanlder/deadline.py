@@ -0,0 +1,199 @@
+"""
+Kaggle 调用的超时控制与看门狗
+
+- run(): 代替 subprocess.run，子进程放在独立的进程组中，超过该操作的时限后整组终止并抛出 DeadlineExceeded
+- call(): 在后台线程中执行无法中断的调用 (kagglehub 下载)，超时后放弃等待并抛出 DeadlineExceeded，
+  工作线程可以继续处理其他条目；被放弃的线程在后台自行结束
+- 看门狗线程每 CHECK_INTERVAL 秒检查一次进行中的操作：超过时限一半的记为慢操作 (日志与指标)，
+  超过时限仍未结束的子进程 (例如 communicate 被孙进程持有的管道卡住) 直接终止
+
+DeadlineExceeded 属于 errors.TransientError，会按网络错误重试；处理器在页末把超时失败的条目重新排队一次
+下载超时只说明单个文件太大或太慢，不计入熔断器的连续失败 (见 breaker.record_failure)
+时限按操作区分 (DEADLINES)，可通过 configure 或 main.py 的 --api-timeout / --download-timeout 修改
+"""
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+
+import errors
+import metrics
+
+logger = logging.getLogger("main.deadline")
+
+# 操作 -> 时限 (秒)
+DEADLINES = {
+    "api": 300,             # list / metadata / files / get / pull 等元数据请求
+    "download": 6 * 3600,   # 下载数据集、模型文件、kernel output
+}
+# 子命令中出现这些词的视为下载
+DOWNLOAD_VERBS = ("download", "output")
+CHECK_INTERVAL = 5
+SLOW_FRACTION = 0.5         # 超过时限的这一比例即记为慢操作
+KILL_GRACE = 5              # SIGTERM 之后等待多久再 SIGKILL
+
+_lock = threading.Lock()
+_deadlines = dict(DEADLINES)
+_inflight = {}              # id -> 进行中的操作
+_next_id = 0
+_thread = None
+
+
+class DeadlineExceeded(errors.TransientError):
+    def __init__(self, message, op=None):
+        super().__init__(message)
+        self.op = op            # 超时的操作类别 ("api" / "download")
+
+
+def configure(**deadlines):
+    """修改各操作的时限，如 configure(api=120, download=3600)；值为 None 的保持不变"""
+    with _lock:
+        for op, seconds in deadlines.items():
+            if seconds is not None:
+                _deadlines[op] = seconds
+
+
+def deadline_for(op):
+    return _deadlines.get(op, _deadlines["api"])
+
+
+def op_for(cmd):
+    """按 kaggle 子命令判断操作类别"""
+    words = cmd.split() if isinstance(cmd, str) else [str(w) for w in cmd]
+    verbs = words[1:6]
+    return "download" if any(v in DOWNLOAD_VERBS for v in verbs) else "api"
+
+
+# ================= 进行中的操作 =================
+
+def _register(op, label, proc=None):
+    global _next_id, _thread
+    deadline = deadline_for(op)
+    with _lock:
+        _next_id += 1
+        op_id = _next_id
+        _inflight[op_id] = {"op": op, "label": label, "proc": proc, "started": time.time(),
+                            "deadline": deadline, "slow": False}
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_watch, daemon=True, name="deadline-watchdog")
+            _thread.start()
+    return op_id, deadline
+
+
+def _unregister(op_id):
+    with _lock:
+        _inflight.pop(op_id, None)
+
+
+def in_flight():
+    """进行中的操作快照：[(操作, 描述, 已运行秒数)]，按运行时间从长到短"""
+    now = time.time()
+    with _lock:
+        items = [(e["op"], e["label"], now - e["started"]) for e in _inflight.values()]
+    return sorted(items, key=lambda x: x[2], reverse=True)
+
+
+def _kill(proc):
+    """终止子进程所在的整个进程组 (kaggle cli 可能再启动子进程)"""
+    if proc.poll() is not None:
+        return
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, signal.SIGTERM)
+            try:
+                proc.wait(timeout=KILL_GRACE)
+                return
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _watch():
+    while True:
+        time.sleep(CHECK_INTERVAL)
+        now = time.time()
+        with _lock:
+            entries = list(_inflight.values())
+        for entry in entries:
+            elapsed = now - entry["started"]
+            if not entry["slow"] and elapsed > entry["deadline"] * SLOW_FRACTION:
+                entry["slow"] = True
+                metrics.inc("kaggle_slow_operations_total", op=entry["op"])
+                logger.warning(f"[看门狗] {entry['label']} 已运行 {elapsed:.0f} 秒 (时限 {entry['deadline']} 秒)")
+            if entry["proc"] is not None and elapsed > entry["deadline"] + KILL_GRACE:
+                logger.warning(f"[看门狗] {entry['label']} 超时未退出，终止进程组")
+                _kill(entry["proc"])
+
+
+def _timeout(op, label, deadline, what):
+    metrics.inc("kaggle_deadline_exceeded_total", op=op)
+    logger.error(f"[看门狗] {label} 超过 {deadline} 秒未完成，{what}")
+    return DeadlineExceeded(f"{label} 超过 {deadline} 秒未完成，{what}", op=op)
+
+
+# ================= 对外接口 =================
+
+def run(cmd, op=None, check=False, shell=False, **kwargs):
+    """
+    与 subprocess.run(capture_output=True, text=True) 相同，增加按操作的时限
+    超时后终止整个进程组并抛出 DeadlineExceeded；check=True 时非零退出码抛出 CalledProcessError
+    """
+    op = op or op_for(cmd)
+    label = cmd if isinstance(cmd, str) else " ".join(str(c) for c in cmd)
+    kwargs.setdefault("text", True)
+    proc = subprocess.Popen(cmd, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            start_new_session=True, **kwargs)
+    op_id, deadline = _register(op, label, proc)
+    try:
+        stdout, stderr = proc.communicate(timeout=deadline)
+    except subprocess.TimeoutExpired:
+        _kill(proc)
+        try:
+            proc.communicate(timeout=KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            pass
+        raise _timeout(op, label, deadline, "已终止")
+    except BaseException:
+        # KeyboardInterrupt 等：不留下孤儿进程
+        _kill(proc)
+        raise
+    finally:
+        _unregister(op_id)
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def call(func, *args, op="download", label=None, **kwargs):
+    """
+    在后台线程中执行 func，超过时限后放弃等待并抛出 DeadlineExceeded
+    用于 kagglehub 等没有超时参数、也无法从外部中断的调用
+    """
+    label = label or getattr(func, "__name__", "call")
+    result = {}
+    done = threading.Event()
+
+    def target():
+        try:
+            result["value"] = func(*args, **kwargs)
+        except BaseException as e:
+            result["error"] = e
+        finally:
+            done.set()
+
+    op_id, deadline = _register(op, label)
+    try:
+        threading.Thread(target=target, daemon=True, name=f"deadline-{op}").start()
+        if not done.wait(deadline):
+            metrics.inc("kaggle_abandoned_total", op=op)
+            raise _timeout(op, label, deadline, "放弃等待")
+    finally:
+        _unregister(op_id)
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
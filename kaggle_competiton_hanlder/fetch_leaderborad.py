@@ -1,55 +1,89 @@
 import json
+import argparse
 import subprocess
 import tempfile
 import os
-import pandas as pd
 import time
 import random
 import zipfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import local_leaderboard
+import competition_files
+import metrics
+import errors
+import breaker
+import deadline
 
 MAX_RETRIES = 3
 BASE_SLEEP = 2 
+# 同时处理的竞赛数，kaggle-cli 调用过多容易触发 429
+MAX_WORKERS = 4
+# 确定无法获取的排行榜 / 文件列表 (404、403 等) 记录在这里，之后的运行不再请求
+NEGATIVE_CACHE_FILE = Path("./cache/negative_cache.jsonl")
 
+@metrics.timed("download")
 def download_leaderboard(slug: str, out_dir: str) -> bool:
     """
     下载排行榜 CSV，并捕获 stderr 以便调试。
     """
-    for attempt in range(1, MAX_RETRIES + 1):
+    cmd = ["kaggle", "competitions", "leaderboard", slug, "-d", "-p", out_dir]
+    key = errors.command_key(cmd)
+    if errors.known_failure(key):
+        print(f"[跳过] {slug} 负缓存中记录为无法获取排行榜。")
+        return False
+    attempt = 0
+    while True:
+        breaker.wait()
+        attempt += 1
         try:
             # 使用 capture_output=True 来获取报错内容
-            result = subprocess.run(
-                ["kaggle", "competitions", "leaderboard", slug, "-d", "-p", out_dir],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            result = deadline.run(cmd, check=True)
+            breaker.record_success()
             print(f"[成功] 已下载: {slug}")
             return True
         
-        except subprocess.CalledProcessError as e:
-            stderr = e.stderr.lower()
+        except (subprocess.CalledProcessError, deadline.DeadlineExceeded) as e:
+            detail = (getattr(e, "stderr", None) or str(e)).strip()
+            kind = errors.classify(e)
+            # Kaggle 中断期间挂起，本次失败不计入重试次数
+            if breaker.record_failure(kind, e):
+                print(f"[熔断] {slug} Kaggle 暂不可用，挂起后重试。")
+                attempt -= 1
+                continue
             # 打印详细错误信息，方便你看到是 401(没登录) 还是 404(没榜)
-            print(f"[调试] {slug} 第 {attempt} 次尝试失败。")
-            print(f"[错误详情]: {e.stderr.strip()}")
+            print(f"[调试] {slug} 第 {attempt} 次尝试失败 ({errors.LABELS[kind]})。")
+            print(f"[错误详情]: {detail}")
 
-            # 如果是 404 或明确找不到，直接跳过
-            if "404" in stderr or "not found" in stderr:
-                print(f"[跳过] {slug} 确定没有排行榜 (404)。")
+            # 404 / 403 等重试也不会成功，直接跳过并记入负缓存
+            limit, _ = errors.resolve_policy(kind, MAX_RETRIES - 1, BASE_SLEEP)
+            if limit == 0:
+                print(f"[跳过] {slug} 无法获取排行榜: {errors.LABELS[kind]}。")
+                errors.record_fast_fail("competitions leaderboard", kind)
+                errors.remember(key, e)
                 return False
             
             # 其他网络错误进行重试
-            if attempt < MAX_RETRIES:
-                sleep_time = BASE_SLEEP * attempt + random.uniform(1, 3)
+            if attempt <= limit:
+                metrics.record_retry("competitions leaderboard", detail)
+                if kind == errors.RATE_LIMITED:
+                    sleep_time = errors.backoff(kind, attempt - 1, BASE_SLEEP)
+                else:
+                    sleep_time = BASE_SLEEP * attempt + random.uniform(1, 3)
                 print(f"[重试] 等待 {sleep_time:.1f} 秒...")
                 time.sleep(sleep_time)
             else:
                 print(f"[失败] {slug} 已达到最大重试次数。")
-    return False
+                return False
 
+@metrics.timed("parse")
 def parse_leaderboard_csv(tmpdir: str, top_k: int = 100):
     """
     自动寻找并解压 tmpdir 下的 zip 文件，并解析其中的 CSV。
     """
+    # pandas 只在需要解析 kaggle-cli 下载的排行榜时导入
+    import pandas as pd
     try:
         # 1. 查找 zip 文件
         zip_files = [f for f in os.listdir(tmpdir) if f.endswith(".zip")]
@@ -115,43 +149,72 @@ def parse_leaderboard_csv(tmpdir: str, top_k: int = 100):
         return []
     
 
-def fetch_leaderboards_from_jsonl(input_jsonl: str, output_jsonl: str, top_k: int = 100):
+def fetch_leaderboard(record: dict, local_boards: dict, top_k: int = 100) -> list:
+    """单个竞赛的排行榜：本地结果优先，否则调用 kaggle-cli"""
+    slug = record["Slug"]
+    if record.get("HasLeaderboard", False) is False:
+        print(f"[信息] {slug} 标记为没有排行榜，跳过下载。")
+        return []
+    if record.get("CompetitionID") in local_boards:
+        return local_boards[record["CompetitionID"]]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if download_leaderboard(slug, tmpdir):
+            # 查找解压后的 CSV 文件
+            return parse_leaderboard_csv(tmpdir, top_k)
+    return []
+
+
+def process_record(record: dict, local_boards: dict, top_k: int = 100) -> dict:
+    """同一竞赛的排行榜与文件列表在同一个任务中获取"""
+    slug = record["Slug"]
+    print(f"\n>>> 正在处理比赛: {slug}")
+    record["LeaderboardTop100"] = fetch_leaderboard(record, local_boards, top_k)
+    files = competition_files.list_competition_files(slug, cache_key=record.get("DeadlineDate"))
+    record["Files"] = files if files is not None else []
+    return record
+
+
+def fetch_leaderboards_from_jsonl(input_jsonl: str, output_jsonl: str, top_k: int = 100, meta_dir: str = ".",
+                                  max_workers: int = MAX_WORKERS):
+    """
+    优先使用 meta_dir 下 Teams / Submissions 在本地算出的排行榜，
+    Meta Kaggle 中没有排名数据的竞赛再调用 kaggle-cli 下载；
+    每个竞赛的排行榜和文件列表在同一个任务中获取，最多 max_workers 个竞赛并发，
+    输出顺序与输入一致
+    """
     if not os.path.exists(input_jsonl):
         print(f"[错误] 输入文件 {input_jsonl} 不存在！")
         return
 
-    with open(input_jsonl, "r", encoding="utf-8") as fin, \
-         open(output_jsonl, "w", encoding="utf-8") as fout:
+    with open(input_jsonl, "r", encoding="utf-8") as fin:
+        records = [json.loads(line) for line in fin if line.strip()]
+    records = [r for r in records if r.get("Slug")]
+    errors.configure(NEGATIVE_CACHE_FILE)
 
-        for line in fin:
-            if not line.strip(): continue
-            record = json.loads(line)
-            slug = record.get("Slug")
-            
-            if not slug:
-                continue
-
-            print(f"\n>>> 正在处理比赛: {slug}")
-            if record.get("HasLeaderboard", False) is False:
-                print(f"[信息] {slug} 标记为没有排行榜，跳过下载。")
-                record["LeaderboardTop100"] = []
-                fout.write(json.dumps(record, ensure_ascii=False) + "\n")
-                fout.flush()
-                continue
-            with tempfile.TemporaryDirectory() as tmpdir:
-                if download_leaderboard(slug, tmpdir):
-                    # 查找解压后的 CSV 文件
-                    record["LeaderboardTop100"] = parse_leaderboard_csv(tmpdir, top_k)
-                else:
-                    record["LeaderboardTop100"] = []
+    local_boards = local_leaderboard.compute_leaderboards(meta_dir, [r.get("CompetitionID") for r in records], top_k)
+    print(f"[信息] 本地计算出 {len(local_boards)} 个竞赛的排行榜，其余使用 kaggle-cli")
 
+    with open(output_jsonl, "w", encoding="utf-8") as fout, \
+         ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # map 按输入顺序返回，前面的竞赛完成后即可写出
+        for record in executor.map(lambda r: process_record(r, local_boards, top_k), records):
             # 写入结果并强制刷新到磁盘
             fout.write(json.dumps(record, ensure_ascii=False) + "\n")
-            fout.flush() 
+            fout.flush()
 
 if __name__ == "__main__":
-    fetch_leaderboards_from_jsonl(
-        "competitions_without_lrdbd.jsonl",
-        "competitions_with_leaderboard.jsonl",
-        top_k=100
-    )
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="为竞赛记录补充排行榜前 k 名与数据文件列表")
+    parser.add_argument("--input", default="competitions_without_lrdbd.jsonl", help="get_data_excp_ldrborad.py 的输出")
+    parser.add_argument("--output", default="competitions_with_leaderboard.jsonl")
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--meta-dir", default=".", help="Teams / Submissions 所在目录 (或索引库)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="同时处理的竞赛数")
+    args = parser.parse_args()
+
+    metrics.configure("competition", textfile="metrics_competition.prom",
+                      summary_file=str(Path(args.output).with_suffix("")) + "_metrics.json")
+    try:
+        fetch_leaderboards_from_jsonl(args.input, args.output, top_k=args.top_k, meta_dir=args.meta_dir,
+                                      max_workers=args.workers)
+    finally:
+        metrics.shutdown()
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""
+从 Meta Kaggle 的论坛数据中提取各竞赛的获奖方案 / 方案分享帖
+
+ForumMessages.csv 有数 GB 的 HTML，不能整表读入，处理分三步：
+1. 用 Competitions.ForumId 与 Forums 建立 论坛 -> 竞赛 的映射，筛出候选主题：
+   - Teams.WriteUpForumTopicId 指向的方案帖
+   - 标题包含 solution / write-up 的主题
+   - 排行榜前 top_k 队伍的队长发起的主题
+2. 分块流式读取 ForumMessages，只保留候选主题的消息，HTML 在进程池中转为 MD 语义文本，
+   按竞赛追加写入临时文件
+3. 逐个竞赛读取临时文件，按回复关系组织成主题树，写出 solutions/<slug>.jsonl (每行一个主题)
+内存占用只与分块大小和单个竞赛的方案帖数量有关，与导出文件大小无关
+"""
+import os
+import re
+import json
+import shutil
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import meta_store
+
+# pandas 与 HTML 转换 (bs4) 在用到的函数内导入，--help 与参数错误时不必加载
+
+SOLUTION_TITLE = re.compile(r"solution|write-?up", re.IGNORECASE)
+# ForumMessages 单行较大，分块行数比其他表小
+MESSAGE_CHUNK_SIZE = 50_000
+
+
+def build_forum_map(meta_dir):
+    """返回 ({ForumId: CompetitionId}, {CompetitionId: Slug})，子论坛归属到其父论坛的竞赛"""
+    comps = meta_store.read_table(meta_dir, "Competitions", columns=["Id", "Slug", "ForumId"])
+    comps = comps[comps["ForumId"].notna()]
+    forum_to_comp = dict(zip(comps["ForumId"].astype("int64"), comps["Id"].astype("int64")))
+
+    if meta_store.has_source(meta_dir, "Forums"):
+        forums = meta_store.read_table(meta_dir, "Forums", columns=["Id", "ParentForumId"])
+        forums = forums[forums["ParentForumId"].isin(forum_to_comp.keys())]
+        for forum_id, parent_id in zip(forums["Id"].astype("int64"), forums["ParentForumId"].astype("int64")):
+            forum_to_comp.setdefault(forum_id, forum_to_comp[parent_id])
+
+    slugs = dict(zip(comps["Id"].astype("int64"), comps["Slug"]))
+    return forum_to_comp, slugs
+
+
+def select_topics(meta_dir, forum_to_comp, top_k=10):
+    """
+    返回候选主题 DataFrame：TopicId、CompetitionId、Title、Reasons、TeamRank
+    """
+    import pandas as pd
+    topic_cols = ["Id", "ForumId", "Title", "FirstForumMessageId"]
+    topics = meta_store.read_table(meta_dir, "ForumTopics", columns=topic_cols)
+    topics = topics[topics["ForumId"].isin(forum_to_comp.keys())]
+    topics = topics.assign(CompetitionId=topics["ForumId"].astype("int64").map(forum_to_comp))
+
+    team_cols = ["CompetitionId", "TeamLeaderId", "WriteUpForumTopicId",
+                 "PublicLeaderboardRank", "PrivateLeaderboardRank"]
+    columns = set(meta_store.table_columns(meta_dir, "Teams"))
+    teams = meta_store.read_table(meta_dir, "Teams", columns=[c for c in team_cols if c in columns])
+    teams = teams.assign(Rank=teams["PrivateLeaderboardRank"].fillna(teams["PublicLeaderboardRank"]))
+
+    # 1. 队伍登记的方案帖 (同一主题可能被多支队伍登记，取最好名次，保证索引唯一)
+    writeups = pd.Series(dtype="float64")
+    if "WriteUpForumTopicId" in teams.columns:
+        writeups = teams.dropna(subset=["WriteUpForumTopicId"]).groupby("WriteUpForumTopicId")["Rank"].min()
+    by_writeup = topics["Id"].isin(writeups.index)
+
+    # 2. 标题匹配
+    by_title = topics["Title"].fillna("").str.contains(SOLUTION_TITLE)
+
+    # 3. 前 top_k 队伍队长发起的主题：只需读取各主题首条消息的作者
+    leaders = teams[teams["Rank"] <= top_k].dropna(subset=["TeamLeaderId"])
+    # 用户 id 统一为浮点，避免整数列与含空值的浮点列对不上
+    leader_rank = leaders.assign(TeamLeaderId=leaders["TeamLeaderId"].astype("float64")) \
+                         .groupby(["CompetitionId", "TeamLeaderId"])["Rank"].min()
+    first = meta_store.read_rows_by_ids(meta_dir, "ForumMessages", ["Id", "PostUserId"], "Id",
+                                        topics["FirstForumMessageId"])
+    author = topics["FirstForumMessageId"].map(first.set_index("Id")["PostUserId"]).astype("float64")
+    author_rank = pd.Series(
+        leader_rank.reindex(pd.MultiIndex.from_arrays([topics["CompetitionId"], author])).to_numpy(),
+        index=topics.index,
+    )
+    by_leader = author_rank.notna()
+
+    selected = topics[by_writeup | by_title | by_leader].copy()
+    reasons = pd.DataFrame({"writeup": by_writeup, "title": by_title, "top_team": by_leader}).loc[selected.index]
+    selected["Reasons"] = reasons.apply(lambda r: [k for k, v in r.items() if v], axis=1)
+    selected["TeamRank"] = selected["Id"].map(writeups).fillna(author_rank.loc[selected.index])
+    selected = selected.rename(columns={"Id": "TopicId"})
+    print(f"[信息] 候选方案主题 {len(selected)} 个，涉及 {selected['CompetitionId'].nunique()} 个竞赛")
+    return selected[["TopicId", "CompetitionId", "Title", "Reasons", "TeamRank"]]
+
+
+def stream_messages(meta_dir, topic_to_comp, tmp_dir, workers=None, chunksize=MESSAGE_CHUNK_SIZE):
+    """分块扫描 ForumMessages，候选主题的消息转换后按竞赛追加到 tmp_dir/<CompetitionId>.jsonl"""
+    import pandas as pd
+    from get_data_excp_ldrborad import clean_html_to_md_like
+    columns = set(meta_store.table_columns(meta_dir, "ForumMessages"))
+    wanted = ["Id", "ForumTopicId", "PostUserId", "PostDate", "ReplyToForumMessageId", "Message", "Medal"]
+    usecols = [c for c in wanted if c in columns]
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    kept = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in meta_store.iter_table_chunks(meta_dir, "ForumMessages", columns=usecols, chunksize=chunksize):
+            chunk = chunk[chunk["ForumTopicId"].isin(topic_to_comp.keys())]
+            if chunk.empty:
+                continue
+            texts = list(pool.map(clean_html_to_md_like, chunk["Message"].tolist(), chunksize=64))
+            chunk = chunk.drop(columns="Message").assign(
+                Text=texts, CompetitionId=chunk["ForumTopicId"].map(topic_to_comp)
+            )
+            # 与索引库一致：id 类列为整数，日期为可排序的 ISO 格式
+            for col in ["PostUserId", "ReplyToForumMessageId", "Medal"]:
+                if col in chunk.columns:
+                    chunk[col] = pd.to_numeric(chunk[col], errors="coerce").astype("Int64")
+            chunk["PostDate"] = pd.to_datetime(chunk["PostDate"], errors="coerce", format="mixed") \
+                                  .dt.strftime(meta_store.DATE_FORMAT)
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for comp_id, group in chunk.groupby("CompetitionId"):
+                with open(tmp_dir / f"{int(comp_id)}.jsonl", "a", encoding="utf-8") as f:
+                    for row in group.drop(columns="CompetitionId").to_dict(orient="records"):
+                        f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+            kept += len(chunk)
+            print(f"[进度] 已保留 {kept} 条消息")
+    return kept
+
+
+def _build_thread(messages):
+    """按回复关系组织为树，同层按发帖时间排序"""
+    messages = sorted(messages, key=lambda m: str(m.get("PostDate") or ""))
+    nodes = {}
+    for m in messages:
+        nodes[m["Id"]] = {
+            "MessageId": m["Id"],
+            "PostUserId": m.get("PostUserId"),
+            "PostDate": m.get("PostDate"),
+            "Medal": m.get("Medal"),
+            "Text": m["Text"],
+            "Replies": [],
+        }
+    roots = []
+    for m in messages:
+        parent = nodes.get(m.get("ReplyToForumMessageId"))
+        (parent["Replies"] if parent else roots).append(nodes[m["Id"]])
+    return roots
+
+
+def write_threads(selected, slugs, tmp_dir, out_dir):
+    """逐个竞赛读取临时文件，写出 <slug>.jsonl"""
+    import pandas as pd
+    topics = selected.set_index("TopicId")
+    written = 0
+    for tmp_file in sorted(tmp_dir.glob("*.jsonl")):
+        comp_id = int(tmp_file.stem)
+        by_topic = {}
+        with open(tmp_file, "r", encoding="utf-8") as f:
+            for line in f:
+                msg = json.loads(line)
+                by_topic.setdefault(msg["ForumTopicId"], []).append(msg)
+
+        out_file = out_dir / f"{slugs.get(comp_id, comp_id)}.jsonl"
+        with open(out_file, "w", encoding="utf-8") as fout:
+            for topic_id, messages in by_topic.items():
+                topic = topics.loc[topic_id]
+                record = {
+                    "CompetitionId": comp_id,
+                    "Slug": slugs.get(comp_id),
+                    "TopicId": int(topic_id),
+                    "Title": topic["Title"],
+                    "Reasons": topic["Reasons"],
+                    "TeamRank": None if pd.isna(topic["TeamRank"]) else int(topic["TeamRank"]),
+                    "Thread": _build_thread(messages),
+                }
+                fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+                written += 1
+    return written
+
+
+def fetch_solutions(meta_dir=".", out_dir="solutions", top_k=10, workers=None, chunksize=MESSAGE_CHUNK_SIZE):
+    out_dir = Path(out_dir)
+    tmp_dir = out_dir / ".tmp"
+    # 上次中断留下的临时文件会导致重复，重新开始
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    forum_to_comp, slugs = build_forum_map(meta_dir)
+    selected = select_topics(meta_dir, forum_to_comp, top_k)
+    if selected.empty:
+        print("[信息] 没有找到方案主题")
+        return 0
+
+    topic_to_comp = dict(zip(selected["TopicId"].astype("int64"), selected["CompetitionId"]))
+    kept = stream_messages(meta_dir, topic_to_comp, tmp_dir, workers, chunksize)
+    written = write_threads(selected, slugs, tmp_dir, out_dir)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(f"[完成] 共 {kept} 条消息，{written} 个主题 -> {out_dir}")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从 Meta Kaggle 论坛数据提取竞赛方案帖")
+    parser.add_argument("--meta-dir", default=".", help="Meta Kaggle CSV (或索引库) 所在目录")
+    parser.add_argument("--out-dir", default="solutions", help="输出目录，每个竞赛一个 jsonl")
+    parser.add_argument("--top-k", type=int, default=10, help="收录排行榜前 k 名队长发起的主题")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="HTML 转换进程数")
+    parser.add_argument("--chunksize", type=int, default=MESSAGE_CHUNK_SIZE, help="ForumMessages 分块行数")
+    args = parser.parse_args()
+
+    fetch_solutions(args.meta_dir, args.out_dir, args.top_k, args.workers, args.chunksize)
@@ -1,6 +1,14 @@
 import pandas as pd
 
+import meta_store
+
 if __name__ == "__main__":
-    df = pd.read_csv("Competitions.csv")
+    conn = meta_store.open_store(".")
+    if conn is not None and meta_store.has_table(conn, "Competitions"):
+        # 有索引库时只取前 10 行，不解析整张表
+        df = pd.read_sql_query('SELECT * FROM "Competitions" ORDER BY "Id" LIMIT 10', conn)
+        conn.close()
+    else:
+        df = pd.read_csv("Competitions.csv", nrows=10)
     test_def = df.head(10)
     test_def.to_csv("test_competitions.csv", index=False)
\ No newline at end of file
@@ -3,6 +3,8 @@ import re
 import json
 import pandas as pd
 
+import meta_store
+
 def clean_html_to_md_like(text: str) -> str:
     """
     将 HTML + MD 混合文本，清洗为 MD 语义文本
@@ -68,6 +70,8 @@ def competitions_df_to_jsonl_v2(df, output_path):
                 "SubTitle": row["Subtitle"],
                 "Slug": row["Slug"],
                 "HasLeaderboard": row["HasLeaderboard"],
+                # 用作文件列表缓存的版本标识
+                "DeadlineDate": None if pd.isna(row.get("DeadlineDate")) else str(row.get("DeadlineDate")),
                 "DatasetDescription": process_dataset_description(
                     row["DatasetDescription"]
                 ),
@@ -83,5 +87,8 @@ def competitions_df_to_jsonl_v2(df, output_path):
 
 if __name__ == "__main__":
     
-    df = pd.read_csv("Competitions.csv")
+    # 有 meta_store.py 生成的索引库时直接查库，否则读取 Competitions.csv
+    df = meta_store.read_table(".", "Competitions")
+    # 索引库中的布尔列以 0/1 存储，统一还原为布尔值
+    df["HasLeaderboard"] = df["HasLeaderboard"].fillna(False).astype(bool)
     competitions_df_to_jsonl_v2(df, "competitions_without_lrdbd.jsonl")
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+基于 Meta Kaggle 的 Teams / Submissions 在本地计算各竞赛的排行榜前 k 名，
+一次扫描得到全部竞赛的结果，替代逐个竞赛调用 kaggle competitions leaderboard
+
+排名取 PrivateLeaderboardRank，没有私榜 (进行中或只有公榜) 的队伍取 PublicLeaderboardRank；
+分数取对应榜单的入榜提交，提交次数为该队伍的全部提交数
+"""
+import meta_store
+
+TEAM_COLUMNS = ["Id", "CompetitionId", "TeamName", "IsBenchmark",
+                "PublicLeaderboardSubmissionId", "PrivateLeaderboardSubmissionId",
+                "PublicLeaderboardRank", "PrivateLeaderboardRank"]
+
+
+def _score_columns(meta_dir):
+    """不同时期的导出中分数列名不同，优先取榜单展示值"""
+    columns = set(meta_store.table_columns(meta_dir, "Submissions"))
+    public = next((c for c in ["PublicScoreLeaderboardDisplay", "PublicScoreFullPrecision"] if c in columns), None)
+    private = next((c for c in ["PrivateScoreLeaderboardDisplay", "PrivateScoreFullPrecision"] if c in columns), None)
+    return public, private
+
+
+def compute_leaderboards(meta_dir=".", competition_ids=None, top_k=100):
+    """
+    返回 {CompetitionId: [{'Rank', 'Team', 'Score', 'SubmissionCount'}, ...]}
+    只包含在 Teams 中有排名的竞赛，其余竞赛需调用方另行处理
+    """
+    if not (meta_store.has_source(meta_dir, "Teams") and meta_store.has_source(meta_dir, "Submissions")):
+        print("[信息] 缺少 Teams / Submissions，无法在本地计算排行榜")
+        return {}
+    # 有数据时才导入 pandas，只走 kaggle-cli 的运行不必加载
+    import pandas as pd
+
+    columns = set(meta_store.table_columns(meta_dir, "Teams"))
+    teams = meta_store.read_table(meta_dir, "Teams", columns=[c for c in TEAM_COLUMNS if c in columns])
+    if competition_ids is not None:
+        teams = teams[teams["CompetitionId"].isin(set(competition_ids))]
+    if "IsBenchmark" in teams.columns:
+        teams = teams[~teams["IsBenchmark"].fillna(False).astype(bool)]
+
+    # 1. 排名：私榜优先，记录排名来自哪个榜单以便取对应分数
+    private = teams["PrivateLeaderboardRank"].notna()
+    teams = teams.assign(
+        Rank=teams["PrivateLeaderboardRank"].where(private, teams["PublicLeaderboardRank"]),
+        SubmissionId=teams["PrivateLeaderboardSubmissionId"].where(private, teams["PublicLeaderboardSubmissionId"]),
+        FromPrivate=private,
+    )
+    teams = teams[teams["Rank"].notna()]
+
+    # 2. 所有竞赛一起按 (竞赛, 排名) 排序后分组取前 k
+    top = (teams.sort_values(["CompetitionId", "Rank"], kind="stable")
+                .groupby("CompetitionId", sort=False)
+                .head(top_k))
+    if top.empty:
+        return {}
+
+    # 3. 只读取入榜队伍的提交：既用于计数，也包含入榜提交本身的分数
+    public_col, private_col = _score_columns(meta_dir)
+    sub_cols = ["Id", "TeamId"] + [c for c in [public_col, private_col] if c]
+    subs = meta_store.read_rows_by_ids(meta_dir, "Submissions", sub_cols, "TeamId", top["Id"])
+
+    counts = subs["TeamId"].value_counts()
+    subs = subs.set_index("Id")
+    public_score = top["SubmissionId"].map(subs[public_col]) if public_col else pd.Series(pd.NA, index=top.index)
+    private_score = top["SubmissionId"].map(subs[private_col]) if private_col else pd.Series(pd.NA, index=top.index)
+    score = private_score.where(top["FromPrivate"], public_score)
+
+    board = pd.DataFrame({
+        "CompetitionId": top["CompetitionId"].astype("int64"),
+        "Rank": top["Rank"].astype("int64"),
+        "Team": top["TeamName"],
+        "Score": pd.to_numeric(score, errors="coerce"),
+        "SubmissionCount": top["Id"].map(counts).fillna(0).astype("int64"),
+    })
+    # NaN 不是合法 JSON，缺失的分数写为 None
+    board["Score"] = board["Score"].astype(object).where(board["Score"].notna(), None)
+
+    return {
+        int(cid): group.drop(columns="CompetitionId").to_dict(orient="records")
+        for cid, group in board.groupby("CompetitionId", sort=False)
+    }
@@ -0,0 +1,293 @@
+"""
+运行指标：各阶段 (list / metadata / files / download / parse / upload) 的耗时直方图、条目数、
+传输字节数、按原因统计的重试次数与 429 次数
+
+- configure 之后后台线程定期重写 Prometheus textfile (供 node_exporter textfile collector 采集)
+- shutdown 时写出本次运行的 JSON 汇总 (各阶段次数、总耗时、p50/p99 与全部计数器)
+- 未调用 configure 时只在内存中累计，不写任何文件
+进程池中的子进程各自累计，不会汇总到主进程
+"""
+import os
+import json
+import math
+import time
+import random
+import threading
+import functools
+import logging
+from pathlib import Path
+from contextlib import contextmanager
+
+logger = logging.getLogger("main.metrics")
+
+STAGES = ("list", "metadata", "files", "download", "parse", "upload")
+# 直方图桶 (秒)：覆盖从一次 API 调用到数小时的大文件下载
+BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, math.inf)
+# 每个直方图保留的样本数，用于估算分位数
+RESERVOIR_SIZE = 1024
+EXPORT_INTERVAL = 15
+
+_lock = threading.Lock()
+_histograms = {}     # (stage, status) -> _Histogram
+_counters = {}       # (指标名, ((标签, 值), ...)) -> 数值
+_state = {"handler": "unknown", "textfile": None, "summary_file": None, "started": time.time()}
+_exporter = None
+_stage_hooks = []    # hook(阶段名, 是否进入)，例如内存剖析按阶段统计
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = []
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        # 蓄水池抽样：样本数固定，长时间运行内存不增长
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(value)
+        else:
+            j = random.randrange(self.count)
+            if j < RESERVOIR_SIZE:
+                self.samples[j] = value
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# ================= 记录 =================
+
+def inc(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def total(name, **labels):
+    """名为 name、且包含给定标签的计数器之和"""
+    wanted = set(labels.items())
+    with _lock:
+        return sum(v for (n, ls), v in _counters.items() if n == name and wanted <= set(ls))
+
+
+def observe(stage_name, seconds, status="ok"):
+    with _lock:
+        hist = _histograms.get((stage_name, status))
+        if hist is None:
+            hist = _histograms[(stage_name, status)] = _Histogram()
+        hist.observe(seconds)
+
+
+def add_bytes(stage_name, n, direction="down"):
+    if n:
+        inc("kaggle_bytes_total", n, stage=stage_name, direction=direction)
+
+
+def add_dir_bytes(stage_name, path, direction="down"):
+    """统计目录下全部文件的大小，用于无法逐块计数的下载方式 (kaggle cli / kagglehub)"""
+    path = Path(path)
+    if path.exists():
+        add_bytes(stage_name, sum(f.stat().st_size for f in path.rglob("*") if f.is_file()), direction)
+
+
+# errors 的类别 -> 重试原因；transient 再按错误文本细分为 timeout / connection / other
+_CAUSES = {"rate_limited": "rate_limit", "not_found": "not_found", "forbidden": "auth",
+           "bad_input": "bad_input", "bug": "bug"}
+
+
+def classify_error(error):
+    """根据异常或错误输出判断重试原因；状态码的分类统一由 errors.classify 完成，两处不会不一致"""
+    # errors 导入了本模块，在函数内导入避免循环导入
+    import errors
+    cause = _CAUSES.get(errors.classify(error))
+    if cause:
+        return cause
+    text = errors._error_text(error).lower()
+    if "timed out" in text or "timeout" in text:
+        return "timeout"
+    if any(k in text for k in ("connection", "remotedisconnected", "brokenpipe", "reset by peer")):
+        return "connection"
+    return "other"
+
+
+def record_retry(op, error):
+    """记录一次重试；op 为操作名 (命令或函数名)"""
+    cause = classify_error(error)
+    inc("kaggle_retries_total", op=op, cause=cause)
+    if cause == "rate_limit":
+        inc("kaggle_rate_limited_total", op=op)
+    return cause
+
+
+def add_stage_hook(hook):
+    """注册阶段进入 / 退出时的回调 hook(stage_name, entering)"""
+    if hook not in _stage_hooks:
+        _stage_hooks.append(hook)
+
+
+def remove_stage_hook(hook):
+    if hook in _stage_hooks:
+        _stage_hooks.remove(hook)
+
+
+@contextmanager
+def stage(stage_name, items=1):
+    """统计一个阶段的耗时与条目数，异常时记为 error 并继续向上抛出"""
+    for hook in _stage_hooks:
+        hook(stage_name, True)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        observe(stage_name, time.perf_counter() - start, status)
+        inc("kaggle_items_total", items, stage=stage_name, status=status)
+        for hook in _stage_hooks:
+            hook(stage_name, False)
+
+
+def timed(stage_name):
+    """装饰器形式的 stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ================= 导出 =================
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in labels) + "}"
+
+
+def render_prometheus():
+    handler = _state["handler"]
+    lines = []
+    with _lock:
+        histograms = {k: (list(h.buckets), h.count, h.sum) for k, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines.append("# HELP kaggle_stage_duration_seconds 各阶段耗时")
+    lines.append("# TYPE kaggle_stage_duration_seconds histogram")
+    for (stage_name, status), (buckets, count, total) in sorted(histograms.items()):
+        base = (("handler", handler), ("stage", stage_name), ("status", status))
+        cumulative = 0
+        for bound, n in zip(BUCKETS, buckets):
+            cumulative += n
+            le = "+Inf" if bound == math.inf else repr(float(bound))
+            lines.append(f"kaggle_stage_duration_seconds_bucket{_format_labels(base + (('le', le),))} {cumulative}")
+        lines.append(f"kaggle_stage_duration_seconds_sum{_format_labels(base)} {total}")
+        lines.append(f"kaggle_stage_duration_seconds_count{_format_labels(base)} {count}")
+
+    names = sorted({name for name, _ in counters})
+    for name in names:
+        lines.append(f"# TYPE {name} counter")
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{name}{_format_labels((('handler', handler),) + labels)} {value}")
+
+    lines.append("# TYPE kaggle_run_start_time_seconds gauge")
+    lines.append(f"kaggle_run_start_time_seconds{_format_labels((('handler', handler),))} {_state['started']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path=None):
+    path = Path(path or _state["textfile"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 先写临时文件再替换，采集方不会读到写了一半的文件
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp, path)
+
+
+def summary():
+    """本次运行的汇总：各阶段次数、总耗时、p50/p99，以及全部计数器"""
+    with _lock:
+        stages = {}
+        for (stage_name, status), hist in sorted(_histograms.items()):
+            stages.setdefault(stage_name, {})[status] = {
+                "count": hist.count,
+                "total_seconds": round(hist.sum, 3),
+                "p50_seconds": hist.quantile(0.5),
+                "p99_seconds": hist.quantile(0.99),
+            }
+        counters = [{"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(_counters.items())]
+    return {
+        "handler": _state["handler"],
+        "started": _state["started"],
+        "elapsed_seconds": round(time.time() - _state["started"], 3),
+        "stages": stages,
+        "counters": counters,
+    }
+
+
+def write_summary(path=None):
+    path = Path(path or _state["summary_file"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = summary()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return data
+
+
+class _Exporter(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(daemon=True, name="metrics-exporter")
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                write_textfile()
+            except Exception as e:
+                logger.warning(f"写出指标文件失败: {e}")
+
+
+def configure(handler, textfile=None, summary_file=None, interval=EXPORT_INTERVAL):
+    """
+    开始本次运行的指标导出
+    textfile 不为空时每 interval 秒重写一次；summary_file 在 shutdown 时写出
+    """
+    global _exporter
+    _state.update(handler=handler, textfile=textfile, summary_file=summary_file, started=time.time())
+    if textfile and _exporter is None:
+        _exporter = _Exporter(interval)
+        _exporter.start()
+
+
+def shutdown():
+    """停止导出线程，写出最终的 textfile 与 JSON 汇总"""
+    global _exporter
+    if _exporter is not None:
+        _exporter.stopped.set()
+        _exporter = None
+    if _state["textfile"]:
+        write_textfile()
+    if _state["summary_file"]:
+        data = write_summary()
+        for stage_name, by_status in data["stages"].items():
+            ok = by_status.get("ok", {})
+            logger.info(f"[指标] {stage_name}: 成功 {ok.get('count', 0)} 次，"
+                        f"失败 {by_status.get('error', {}).get('count', 0)} 次，"
+                        f"总耗时 {ok.get('total_seconds', 0)}s，p50 {ok.get('p50_seconds')}s，p99 {ok.get('p99_seconds')}s")
+        logger.info(f"[指标] 运行汇总已写入: {_state['summary_file']}")
@@ -0,0 +1,169 @@
+"""
+Kaggle API 的全局熔断器，进程内所有线程共用
+
+- 连续 FAILURE_THRESHOLD 次网络错误 / 限流 (errors.TRANSIENT / RATE_LIMITED) 后打开
+- 打开期间所有调用在 wait() 中挂起，不再各自重试；挂起前的那次失败不计入调用方的重试次数
+- 由一个挂起的线程按 PROBE_INTERVAL 起、每次翻倍 (上限 MAX_PROBE_INTERVAL) 的间隔执行探测命令，
+  探测成功后关闭熔断，唤醒全部挂起的线程继续处理
+- 404 / 403 等说明 API 本身可用，与成功一样清零连续失败计数
+- 下载超过时限 (deadline.DeadlineExceeded, op="download") 只说明单个条目太大或太慢，
+  不计入也不清零连续失败，单独记在 kaggle_breaker_ignored_total 中
+
+各处理器的重试循环按以下方式接入:
+    breaker.wait()                      # 每次请求前
+    breaker.record_success()            # 请求成功
+    if breaker.record_failure(kind, e): # 请求失败；返回 True 表示熔断已打开，本次不计入重试
+        continue
+"""
+import time
+import logging
+import threading
+import subprocess
+
+import errors
+import metrics
+import deadline
+
+logger = logging.getLogger("main.breaker")
+
+FAILURE_THRESHOLD = 5
+PROBE_INTERVAL = 30
+MAX_PROBE_INTERVAL = 600
+PROBE_TIMEOUT = 60
+# 探测用的轻量请求，只需要 API 能正常应答
+PROBE_CMD = ["kaggle", "datasets", "list", "--csv"]
+
+CLOSED = "closed"
+OPEN = "open"
+
+_cond = threading.Condition()
+_state = {
+    "state": CLOSED,
+    "failures": 0,          # 连续失败次数
+    "opened_at": None,
+    "interval": PROBE_INTERVAL,
+    "next_probe": 0.0,
+    "probing": False,
+}
+_probe_cmd = PROBE_CMD
+_threshold = FAILURE_THRESHOLD
+
+
+def configure(probe_cmd=None, threshold=None):
+    """修改探测命令与打开熔断所需的连续失败次数"""
+    global _probe_cmd, _threshold
+    if probe_cmd is not None:
+        _probe_cmd = list(probe_cmd)
+    if threshold is not None:
+        _threshold = threshold
+
+
+def is_open():
+    with _cond:
+        return _state["state"] == OPEN
+
+
+def _open():
+    # 调用方持有 _cond
+    _state.update(state=OPEN, opened_at=time.time(), interval=PROBE_INTERVAL,
+                  next_probe=time.time() + PROBE_INTERVAL)
+    metrics.inc("kaggle_breaker_open_total")
+    logger.warning(f"[熔断] 连续 {_state['failures']} 次网络错误，暂停所有 Kaggle 请求，"
+                   f"{PROBE_INTERVAL} 秒后开始探测")
+
+
+def _close():
+    # 调用方持有 _cond
+    if _state["state"] == OPEN:
+        logger.warning(f"[熔断] Kaggle API 已恢复 (中断 {time.time() - _state['opened_at']:.0f} 秒)，继续处理")
+    _state.update(state=CLOSED, failures=0, opened_at=None)
+    _cond.notify_all()
+
+
+def record_success():
+    """请求成功：清零连续失败；熔断打开期间有请求成功时直接关闭"""
+    with _cond:
+        _state["failures"] = 0
+        if _state["state"] == OPEN:
+            _close()
+
+
+# 这些操作超时不代表 API 不可用
+_IGNORED_DEADLINE_OPS = ("download",)
+
+
+def record_failure(kind, error=None):
+    """
+    记录一次失败，kind 为 errors.classify 的结果，error 为原始异常
+    返回 True 表示熔断已经 (或因本次失败) 打开，调用方不应把本次失败计入重试次数，应回到 wait() 挂起
+    """
+    if isinstance(error, deadline.DeadlineExceeded) and error.op in _IGNORED_DEADLINE_OPS:
+        # 大文件下载慢但连接正常，不能据此暂停所有线程
+        metrics.inc("kaggle_breaker_ignored_total", reason=f"{error.op}_deadline")
+        return False
+    if kind not in (errors.TRANSIENT, errors.RATE_LIMITED):
+        # API 有应答 (404 / 403 等) 或本地错误，与 API 是否可用无关
+        if kind != errors.BUG:
+            with _cond:
+                _state["failures"] = 0
+        return False
+    with _cond:
+        if _state["state"] == OPEN:
+            return True
+        _state["failures"] += 1
+        if _state["failures"] >= _threshold:
+            _open()
+            return True
+        return False
+
+
+def _probe():
+    """执行探测命令，API 能应答即视为恢复"""
+    try:
+        result = subprocess.run(_probe_cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return False
+    except OSError as e:
+        # kaggle 命令不存在等本地问题，熔断无法判断，交给调用方报错
+        logger.error(f"[熔断] 探测命令无法执行: {e}")
+        return True
+    if result.returncode == 0:
+        return True
+    kind = errors.classify_text(result.stdout + result.stderr) or errors.TRANSIENT
+    return kind not in (errors.TRANSIENT, errors.RATE_LIMITED)
+
+
+def wait():
+    """熔断打开时挂起直到恢复；返回挂起的秒数"""
+    with _cond:
+        if _state["state"] == CLOSED:
+            return 0.0
+    start = time.time()
+    while True:
+        with _cond:
+            if _state["state"] == CLOSED:
+                break
+            now = time.time()
+            if _state["probing"] or now < _state["next_probe"]:
+                # 探测由其他线程负责，或尚未到探测时间
+                _cond.wait(timeout=max(1.0, _state["next_probe"] - now))
+                continue
+            _state["probing"] = True
+
+        # 探测命令在锁外执行，其他线程继续挂起
+        ok = _probe()
+        metrics.inc("kaggle_breaker_probes_total", result="ok" if ok else "failed")
+        with _cond:
+            _state["probing"] = False
+            if ok:
+                _close()
+            else:
+                _state["interval"] = min(_state["interval"] * 2, MAX_PROBE_INTERVAL)
+                _state["next_probe"] = time.time() + _state["interval"]
+                logger.warning(f"[熔断] 探测失败，{_state['interval']} 秒后再次探测 "
+                               f"(已中断 {time.time() - _state['opened_at']:.0f} 秒)")
+                _cond.notify_all()
+
+    waited = time.time() - start
+    metrics.inc("kaggle_breaker_parked_seconds_total", round(waited, 3))
+    return waited
@@ -1,18 +1,27 @@
 import os
 import json
 import csv
+import shlex
 import shutil
 import logging
-import subprocess
 import argparse
-import kagglehub
+import staging
+import range_download
+import meta_listing
+import metrics
+import tracing
+import errors
+import breaker
+import deadline
+import concurrency
+import scheduler
+import sampler
 from pathlib import Path
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
-import random
 import functools
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 
 # ================= 模块 1: 基础配置与工具 =================
 # 配置区域
@@ -24,63 +33,90 @@ JSONL_DIR = UPLOAD_DIR / "meta_data"        # 存放生成的 jsonl 记录
 
 
 METADATA_DIR = BASE_DIR / "metadata_temp"    # 临时存放元数据
-# 确保目录存在
-for p in [DATASET_DIR, METADATA_DIR, JSONL_DIR]:
-    p.mkdir(parents=True, exist_ok=True)
+
+
+def ensure_dirs():
+    """创建工作目录；在开始处理时调用，导入本模块 (包括 main.py --help) 不产生任何文件"""
+    for p in [DATASET_DIR, METADATA_DIR, JSONL_DIR]:
+        p.mkdir(parents=True, exist_ok=True)
 
 # 日志配置
 logger = logging.getLogger("main.downloader")
 
 def run_cmd(cmd):
-    try:
-        # 使用 check=True 配合捕获
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, encoding='utf-8')
-        
+    # 负缓存中确定失败的请求 (404 / 403 等) 直接抛出，不再调用 Kaggle
+    key = errors.command_key(cmd)
+    errors.check(key)
+    # Kaggle 中断期间挂起，不发出请求
+    breaker.wait()
+    # 并发名额按命令类别 (元数据请求 / 下载) 自适应调整，429 等错误在名额内抛出以便限流器感知
+    with concurrency.for_cmd(cmd).slot():
+        # 按操作 (元数据请求 / 下载) 设置时限，超时后终止整个进程组
+        with tracing.span(tracing.cmd_name(cmd), cat="cmd", cmd=tracing.short(cmd)):
+            result = deadline.run(cmd, shell=True, encoding='utf-8')
+
         # 核心改进：识别网络中止的关键词
         error_keywords = ["Connection aborted.", "RemoteDisconnected", "BrokenPipeError", "connection reset"]
         output = result.stdout + result.stderr
-        
+
         if any(key in output for key in error_keywords):
             logger.error(f"检测到网络链接中止: {output}")
             raise ConnectionError(f"Kaggle 链接已断开: {output}") # 抛出异常触发装饰器
-            
+
         if result.returncode != 0:
-            raise RuntimeError(f"命令执行失败 (Code {result.returncode}): {output}")
-            
-        return result.stdout
-    except Exception as e:
-        # 让异常向上传递给 @retry_on_failure
-        raise e
+            # 按输出中的状态码 / 关键词区分类别，决定是否值得重试
+            error = errors.from_output(output, f"命令执行失败 (Code {result.returncode}): {output}")
+            errors.remember(key, error)
+            raise error
+
+    return result.stdout
 # ================= 模块 2: Kaggle 核心逻辑 (获取信息与下载) =================
 
 def retry_on_failure(max_retries=3, base_delay=5, backoff_factor=2):
     """
-    重试装饰器
-    :param max_retries: 最大重试次数
+    重试装饰器，按 errors.classify 的类别决定是否重试
+    :param max_retries: 网络错误的最大重试次数 (限流另有更多次数与更长等待)
     :param base_delay: 基础等待秒数
     :param backoff_factor: 指数倍数 (例如 5, 10, 20...)
+    404 / 403 / 参数错误与本地代码错误不重试，直接抛出；超时 (DeadlineExceeded) 也直接抛出，由调用方重新排队
+    熔断打开期间的失败不计入重试次数，挂起到 Kaggle 恢复后继续
     """
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             retries = 0
-            while retries <= max_retries:
+            while True:
+                breaker.wait()
                 try:
-                    return func(*args, **kwargs)
+                    result = func(*args, **kwargs)
+                    breaker.record_success()
+                    return result
                 except Exception as e:
+                    kind = errors.classify(e)
+                    if breaker.record_failure(kind, e):
+                        logger.warning(f"[{func.__name__}] Kaggle 熔断中，挂起后重试 (不计入重试次数): {e}")
+                        continue
+                    if isinstance(e, deadline.DeadlineExceeded):
+                        # 超时不在原地重试，由 process_page 放到页末重新排队
+                        raise
+                    limit, _ = errors.resolve_policy(kind, max_retries, base_delay)
+                    if limit == 0:
+                        errors.record_fast_fail(func.__name__, kind)
+                        logger.warning(f"[{func.__name__}] {errors.LABELS[kind]}，不再重试: {e}")
+                        raise
                     # 如果重试次数耗尽，抛出异常
-                    if retries == max_retries:
-                        logger.error(f"方法 {func.__name__} 在重试 {max_retries} 次后依然失败: {e}")
-                        raise e
+                    if retries >= limit:
+                        logger.error(f"方法 {func.__name__} 在重试 {limit} 次后依然失败: {e}")
+                        raise
+                    metrics.record_retry(func.__name__, e)
                     
-                    # 计算等待时间：base_delay * (backoff_factor ^ retries) + 随机抖动
-                    wait_time = (base_delay * (backoff_factor ** retries)) + random.uniform(1, 3)
-                    logger.warning(f"[{func.__name__}] 触发限流或错误: {e}。 "
+                    # 计算等待时间：base_delay * (backoff_factor ^ retries) + 随机抖动，限流时基础等待更长
+                    wait_time = errors.backoff(kind, retries, base_delay, backoff_factor)
+                    logger.warning(f"[{func.__name__}] {errors.LABELS[kind]}: {e}。 "
                                    f"{wait_time:.1f}秒后进行第 {retries + 1} 次重试...")
                     
                     time.sleep(wait_time)
                     retries += 1
-            return None
         return wrapper
     return decorator
 
@@ -93,10 +129,11 @@ class KaggleProcessor:
     
     
     @retry_on_failure(max_retries=3, base_delay=3)
+    @metrics.timed("metadata")
     def get_metadata(self, ref):
         """获取数据集的 Licenses 和 Tags"""
         temp_path = METADATA_DIR / ref.replace("/", "_")
-        temp_path.mkdir(exist_ok=True)
+        temp_path.mkdir(parents=True, exist_ok=True)
         
         # 调用 Kaggle CLI 下载元数据
         run_cmd(f"kaggle datasets metadata {ref} -p {temp_path}")
@@ -106,7 +143,8 @@ class KaggleProcessor:
         
         if meta_file.exists():
             try:
-                with open(meta_file, 'r', encoding='utf-8') as f:
+                with tracing.span("parse dataset-metadata.json", cat="parse"), \
+                     open(meta_file, 'r', encoding='utf-8') as f:
                     content = json.load(f)
                     info = content.get("info", {})  # 取 info 层
                     licenses = info.get("licenses", [])
@@ -128,11 +166,14 @@ class KaggleProcessor:
     
     
     @retry_on_failure(max_retries=3, base_delay=3)
+    @metrics.timed("files")
     def get_file_explorer(self, ref):
         """获取数据集的文件列表"""
         csv_out = run_cmd(f"kaggle datasets files {ref} --csv")
-        if not csv_out or "429 - Too Many Requests" in csv_out:
-            raise RuntimeError(f"Kaggle API 拒绝请求或返回为空: {ref}")
+        if csv_out and "429 - Too Many Requests" in csv_out:
+            raise errors.RateLimitedError(f"Kaggle API 拒绝请求 (429 - Too Many Requests): {ref}")
+        if not csv_out:
+            raise RuntimeError(f"Kaggle API 返回为空: {ref}")
         files = []
         if csv_out:
             reader = csv.DictReader(csv_out.splitlines())
@@ -144,30 +185,107 @@ class KaggleProcessor:
         return files
 
     @retry_on_failure(max_retries=3, base_delay=3)
-    def download_dataset(self, ref):
-        """下载数据集文件到本地指定目录"""
-        target_dir = DATASET_DIR / ref.repalace("/", "_")
+    @metrics.timed("download")
+    def download_dataset(self, ref, large=False):
+        """下载数据集文件到本地指定目录；large 为 True 时由大文件通道的字节预算限制，不占用下载名额"""
+        target_dir = DATASET_DIR / ref.replace("/", "_")
         
-        if target_dir.exists():
+        # 之前只采样过的数据集需要重新完整下载
+        if staging.is_complete(target_dir) and (staging.load_sentinel(target_dir) or {}).get("content") != "sample":
             logger.info(f"[{ref}] 本地已存在，跳过下载")
             return str(target_dir)
 
+        # 下载不经过 run_cmd，单独按 ref 记入负缓存
+        cache_key = f"datasets download {ref}"
+        errors.check(cache_key)
         logger.info(f"[{ref}] 开始下载...")
         
-        # 使用 kagglehub 下载到缓存
-        cached_path = kagglehub.dataset_download(ref)
-        if not cached_path:
-            raise RuntimeError(f"kagglehub 下载返回路径为空: {ref}")
-        # 将文件从缓存移动到我们的测试目录，方便查看
-        shutil.copytree(cached_path, target_dir, dirs_exist_ok=True)
+        try:
+            with nullcontext() if large else concurrency.DOWNLOADS.slot():
+                self._download_to(ref, target_dir)
+        except Exception as e:
+            errors.remember(cache_key, e)
+            raise
         logger.info(f"[{ref}] 下载并移动完成 -> {target_dir}")
         return str(target_dir)
 
+    def _download_to(self, ref, target_dir):
+        """先写入 .partial 暂存目录，全部成功后才原子落位"""
+        with staging.staged_dir(target_dir, extra={"ref": ref}) as work_dir:
+            try:
+                # 优先使用可续传的分段下载器，断线只需补齐缺失的字节
+                range_download.download_and_extract(
+                    range_download.dataset_url(ref), ref.replace("/", "_") + ".zip", work_dir
+                )
+            except range_download.ResolveError as e:
+                logger.warning(f"[{ref}] 无法使用断点续传下载，回退到 kagglehub: {e}")
+                # kagglehub 导入很慢，只在回退时导入
+                import kagglehub
+                # 使用 kagglehub 下载到缓存
+                with tracing.span("kagglehub.dataset_download", cat="download"):
+                    # kagglehub 没有超时参数，卡住时放弃等待，交给重试 / 页末重新排队
+                    cached_path = deadline.call(kagglehub.dataset_download, ref,
+                                                label=f"kagglehub.dataset_download {ref}")
+                if not cached_path:
+                    raise RuntimeError(f"kagglehub 下载返回路径为空: {ref}")
+                # 将文件从缓存移动到我们的测试目录，方便查看
+                shutil.copytree(cached_path, work_dir, dirs_exist_ok=True)
+                metrics.add_dir_bytes("download", work_dir)
+
+    def sample_dataset(self, ref, files):
+        """采样模式：只读取部分文件 (或其开头)，结果写入数据集目录下的 sampler.SAMPLE_FILE"""
+        target_dir = DATASET_DIR / ref.replace("/", "_")
+        if staging.is_complete(target_dir):
+            logger.info(f"[{ref}] 本地已存在，跳过采样")
+            return str(target_dir)
 
-    def process_single_item(self, row):
-        """处理单条数据的完整流程"""
+        with staging.staged_dir(target_dir, extra={"ref": ref, "content": "sample"}) as work_dir:
+            with tracing.span("sample", cat="download"):
+                sample = sampler.sample_dataset(ref, files, functools.partial(self.fetch_file, ref))
+            with open(work_dir / sampler.SAMPLE_FILE, 'w', encoding='utf-8') as f:
+                json.dump(sample, f, ensure_ascii=False, indent=2)
+        logger.info(f"[{ref}] 采样完成 -> {target_dir}")
+        return str(target_dir)
+
+    @retry_on_failure(max_retries=3, base_delay=3)
+    @metrics.timed("download")
+    def fetch_file(self, ref, file_name, max_bytes, size=None):
+        """
+        读取数据集中单个文件开头的 max_bytes 字节，返回 (数据, 文件总大小)
+        无法使用 Range 时，不超过 sampler.WHOLE_FILE_MAX 的文件回退到 kaggle datasets download -f 整文件下载
+        """
+        try:
+            with concurrency.API.slot():
+                return range_download.fetch_head(range_download.dataset_file_url(ref, file_name), max_bytes)
+        except range_download.ResolveError as e:
+            if errors.classify(e) in errors.PERMANENT:
+                raise
+            if size is None or size > sampler.WHOLE_FILE_MAX:
+                raise errors.BadInputError(f"无法只读取开头，文件过大不回退到 kaggle cli: {e}")
+            logger.warning(f"[{ref}] 无法使用 Range 读取 {file_name}，回退到 kaggle cli: {e}")
+
+        temp_path = METADATA_DIR / (ref.replace("/", "_") + "_files")
+        temp_path.mkdir(parents=True, exist_ok=True)
+        try:
+            run_cmd(f"kaggle datasets download {ref} -f {shlex.quote(file_name)} -p {temp_path} --quiet")
+            # 较大的文件会以 <文件名>.zip 保存，由 sampler 解压
+            path = next(p for p in temp_path.iterdir() if p.is_file())
+            with open(path, 'rb') as f:
+                return f.read(max_bytes), path.stat().st_size
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+
+    def process_single_item(self, row, queued_at=None, large=False):
+        """处理单条数据的完整流程；queued_at 为提交到线程池的时间，用于追踪排队耗时；large 表示在大文件通道中处理"""
         ref = row['ref']
-        
+        tracing.record_wait("large_lane_wait" if large else "pool_wait", queued_at, ref=ref)
+        with tracing.bind(ref), tracing.span("dataset", cat="item"):
+            return self._process_single_item(row, large)
+
+    def _process_single_item(self, row, large=False):
+        ref = row['ref']
+
         # 1. 基础字段重命名
         item = {
             "Ref": row['ref'],
@@ -185,8 +303,12 @@ class KaggleProcessor:
         files = self.get_file_explorer(ref)
         item["File Explorer"] = files
 
-        # 4. 执行下载
-        local_path = self.download_dataset(ref)
+        # 4. 执行下载；采样模式下大数据集只读取部分文件的开头
+        if sampler.wants_sample(row):
+            item["ContentMode"] = "sample"
+            local_path = self.sample_dataset(ref, files)
+        else:
+            local_path = self.download_dataset(ref, large)
         
         if local_path:
             return item
@@ -195,39 +317,109 @@ class KaggleProcessor:
 
 # ================= 模块 3: 流程控制 (按页处理) =================
 
-def process_page(page_num, max_workers=4) -> bool :
+def list_page(page_num, queue_file=None):
+    """
+    获取一页待处理的数据集 (已按可用性评分筛选)，没有数据时返回空列表
+    queue_file 不为空时从 Meta Kaggle 生成的本地队列中按页取数据 (已完成过滤)，不再调用列表接口
+    """
+    if queue_file:
+        # 1. 从本地队列取本页
+        with metrics.stage("list"):
+            targets = meta_listing.read_queue_page(queue_file, page_num)
+        if not targets:
+            logger.warning("本地队列已处理完毕。")
+            return []
+        logger.info(f"本页来自 Meta Kaggle 队列: {len(targets)} 条")
+    else:
+        # 1. 获取列表
+        with metrics.stage("list"):
+            csv_data = run_cmd(f"kaggle datasets list --page {page_num} --csv")
+        if not csv_data:
+            logger.warning("未获取到数据，可能已到达末尾。")
+            return []
+
+        rows = list(csv.DictReader(csv_data.splitlines()))
+        
+        # 2. 筛选
+        targets = [r for r in rows if float(r.get('usabilityRating', 0)) >= 0.8]
+        logger.info(f"本页原始数据: {len(rows)} 条，筛选后(>=0.8): {len(targets)} 条")
+
+    return targets
+
+def process_page(page_num, max_workers=None, queue_file=None, drain=True) -> bool :
+    """
+    处理一页数据集
+    max_workers 为空时线程池取 concurrency.pool_size()，实际同时进行的请求与下载数由自适应限流器控制
+    大数据集交给 scheduler.LARGE 在后台下载；drain 为 False 时本页只等快速通道完成，
+    未完成的大数据集的记录并入之后某一页的 JSONL，drain 为 True 时等待所有大数据集 (含之前页的) 完成再写出
+    queue_file 的含义见 list_page
+    """
+    ensure_dirs()
     processor = KaggleProcessor()
     logger.info(f"========== 正在获取第 {page_num} 页列表 ==========")
-    
-    # 1. 获取列表
-    csv_data = run_cmd(f"kaggle datasets list --page {page_num} --csv")
-    if not csv_data:
-        logger.warning("未获取到数据，可能已到达末尾。")
-        return False
-
-    rows = list(csv.DictReader(csv_data.splitlines()))
-    
-    # 2. 筛选
-    targets = [r for r in rows if float(r.get('usabilityRating', 0)) >= 0.8]
-    logger.info(f"本页原始数据: {len(rows)} 条，筛选后(>=0.8): {len(targets)} 条")
+    targets = list_page(page_num, queue_file)
+    if not targets:
+        return _finish_page(page_num, [], drain)
 
     processed_results = []
 
-    # 3. 并发处理
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(processor.process_single_item, row): row['ref'] for row in targets}
-        
-        for future in as_completed(futures):
-            ref = futures[future]
-            try:
-                result = future.result()
-                if result:
-                    processed_results.append(result)
+    # 3. 按大小分流：大数据集进入大文件通道，小数据集在本页线程池中从小到大处理
+    small, large = scheduler.split(targets)
+    if sampler.MODE == "sample":
+        # 只采样的大数据集不需要大文件通道
+        small += [row for row in large if sampler.wants_sample(row)]
+        large = [row for row in large if not sampler.wants_sample(row)]
+    if large:
+        logger.info(f"本页 {len(large)} 个大数据集 (> {scheduler.LARGE_SIZE / scheduler.GB:.1f}GB) 进入大文件通道")
+        task = functools.partial(processor.process_single_item, large=True)
+        for row in large:
+            scheduler.LARGE.submit(page_num, row, task)
 
-            except Exception as e:
-                logger.error(f"处理 {ref} 时发生未知错误: {e}")
+    # 并发处理；超时的条目不占着线程重试，放到页末重新排队一次
+    with ThreadPoolExecutor(max_workers=max_workers or concurrency.pool_size()) as executor:
+        pending = small
+        for requeued in (False, True):
+            futures = {executor.submit(processor.process_single_item, row, tracing.now()): row for row in pending}
+            pending = []
+
+            for future in as_completed(futures):
+                ref = futures[future]['ref']
+                try:
+                    result = future.result()
+                    if result:
+                        processed_results.append(result)
+
+                except deadline.DeadlineExceeded as e:
+                    if requeued:
+                        logger.error(f"{ref} 重新排队后仍然超时: {e}")
+                    else:
+                        logger.warning(f"{ref} 超时，页末重新排队: {e}")
+                        pending.append(futures[future])
+                except Exception as e:
+                    kind = errors.classify(e)
+                    if kind in errors.PERMANENT:
+                        logger.warning(f"跳过 {ref}: {errors.LABELS[kind]} ({e})")
+                    else:
+                        logger.error(f"处理 {ref} 时发生未知错误: {e}")
+
+            if not pending:
+                break
+            metrics.inc("kaggle_requeued_total", len(pending), reason="deadline")
+
+    return _finish_page(page_num, processed_results, drain)
 
-    # 4. 保存本页的 JSONL 结果
+def _finish_page(page_num, processed_results, drain):
+    """并入大文件通道中已完成的记录并写出本页 JSONL；没有可写的记录且本页没有条目仍在下载时返回 False"""
+    # 4. 并入大文件通道中已完成的记录
+    if drain:
+        scheduler.LARGE.wait_all()
+    carried = scheduler.LARGE.collect()
+    if carried:
+        logger.info(f"并入大文件通道完成的 {len(carried)} 条记录 (来自第 {', '.join(str(p) for p in sorted({p for p, _ in carried}))} 页)")
+        processed_results.extend(record for _, record in carried)
+    still_running = page_num in scheduler.LARGE.outstanding_pages()
+
+    # 5. 保存本页的 JSONL 结果
     if processed_results:
         output_file = JSONL_DIR / f"page_{page_num}.jsonl"
         with open(output_file, 'w', encoding='utf-8') as f:
@@ -236,10 +428,17 @@ def process_page(page_num, max_workers=4) -> bool :
         logger.info(f"第 {page_num} 页处理完成！JSONL 已保存至: {output_file}")
         logger.info(f"文件已下载至: {DATASET_DIR}")
         return True
+    elif still_running:
+        logger.info(f"第 {page_num} 页的数据集仍在大文件通道中下载，记录将在之后写出。")
+        return True
     else:
         logger.info(f"第 {page_num} 页没有成功处理的数据。")
         return False
 
+def settled_page(page_num):
+    """page_num 及之前的页中仍有大数据集未完成时，返回可以记为已完成的最后一页"""
+    return min([page_num] + [p - 1 for p in scheduler.LARGE.outstanding_pages()])
+
 # ================= 主程序入口 =================
 
 if __name__ == "__main__":
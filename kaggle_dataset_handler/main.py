@@ -4,10 +4,21 @@ import logging
 import json
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # 导入模块
 import get_data
 import upload
+import meta_listing
+import metrics
+import tracing
+import memprof
+import deadline
+import concurrency
+import scheduler
+import planner
+import staging
+import sampler
 
 # 配置路径
 SETTING_DIR = Path("setting")
@@ -16,7 +27,7 @@ CLOUD_CONFIG_FILE = SETTING_DIR / "cloud.json"
 LOG_DIR = Path("logs")
 DATASET_INFO_DIR = Path("./local_workspace/output") # 对应 get_data 中的下载路径
 
-def setup_logging(page_info):
+def setup_logging(page_info, profile_memory=None):
     """
     配置日志：包含时间戳和页码信息
     同时捕获 upload.py 和 get_data.py 的日志
@@ -47,6 +58,13 @@ def setup_logging(page_info):
     root_logger.addHandler(console_handler)
 
     print(f"日志已初始化: {log_path}")
+
+    # 指标：textfile 定期重写，运行汇总与日志同名放在一起
+    metrics.configure("dataset", textfile=LOG_DIR / "metrics_dataset.prom",
+                      summary_file=log_path.with_name(log_path.stem + "_metrics.json"))
+    # 内存剖析：汇总与超过阈值时的分配位置快照同样放在日志旁边
+    if profile_memory:
+        memprof.enable(log_path.with_name(log_path.stem + "_memory.json"), threshold_mb=profile_memory)
     return root_logger
 
 def load_page_record():
@@ -104,39 +122,101 @@ def get_target_pages(args, mode):
         print("错误：参数数量不正确，请输入 1 个数字(指定页) 或 2 个数字(区间)")
         sys.exit(1)
 
-def run_workflow(pages, do_upload):
+def prepare_meta_queue(args):
+    """
+    使用 --meta-kaggle 时，基于本地 Meta Kaggle CSV 生成队列文件
+    队列只生成一次，之后的运行 (包括 -c 接续) 复用同一份，保证页码稳定；--rebuild-list 强制重建
+    """
+    if not args.meta_kaggle:
+        return None
+    queue_file = meta_listing.QUEUE_FILE
+    if args.rebuild_list or not queue_file.exists():
+        meta_listing.build_dataset_queue(
+            args.meta_kaggle, queue_file,
+            min_usability=args.min_usability, medal_only=args.medal_only,
+            since=args.since, until=args.until
+        )
+    return queue_file
+
+def run_workflow(pages, do_upload, queue_file=None, dedup=False, chunked=False):
     logger = logging.getLogger("main")
     
     for page in pages:
-        logger.info(f" >>>>>> 开始处理第 {page} 页 <<<<<<")
+        with memprof.page(page):
+            logger.info(f" >>>>>> 开始处理第 {page} 页 <<<<<<")
         
-        # 1. 爬取数据
-        success = get_data.process_page(page)
+            # 1. 爬取数据；大数据集在后台继续下载，最后一页等待全部完成
+            success = get_data.process_page(page, queue_file=queue_file, drain=page == pages[-1])
         
-        if success:
-            # 2. 如果需要上传
-            if do_upload:
-                logger.info(f"开始上传第 {page} 页的数据...")
-                # 从 get_data 的输出目录上传
-                # 注意：get_data 把所有下载内容放在 output/datasets 下
-                # 理想情况下，我们应该只上传当前页下载的文件夹
-                # 但由于 upload.py 逻辑是扫全文件夹，这里直接调用
+            if success:
+                # 2. 如果需要上传
+                if do_upload:
+                    logger.info(f"开始上传第 {page} 页的数据...")
+                    # 从 get_data 的输出目录上传
+                    # 注意：get_data 把所有下载内容放在 output/datasets 下
+                    # 理想情况下，我们应该只上传当前页下载的文件夹
+                    # 但由于 upload.py 逻辑是扫全文件夹，这里直接调用
                 
-                # 读取云配置
-                try:
-                    upload.upload_files_from_folder(str(DATASET_INFO_DIR))
+                    # 读取云配置
+                    try:
+                        upload.upload_files_from_folder(str(DATASET_INFO_DIR), dedup=dedup, chunked=chunked)
                     
-                    # 3. 更新进度 (仅在 -c 模式或连续上传模式下有意义，这里每次成功都更新以防中断)
-                    # 为了简单起见，如果当前页大于记录页，则更新
-                    current_record = load_page_record()
-                    if page > current_record:
-                        update_page_record(page)
-                        logger.info(f"进度已更新: last_page = {page}")
+                        # 3. 更新进度 (仅在 -c 模式或连续上传模式下有意义，这里每次成功都更新以防中断)
+                        # 为了简单起见，如果当前页大于记录页，则更新
+                        # 仍有大数据集在下载的页不记为完成，中断后从该页重新开始
+                        settled = get_data.settled_page(page)
+                        current_record = load_page_record()
+                        if settled > current_record:
+                            update_page_record(settled)
+                            logger.info(f"进度已更新: last_page = {settled}")
                         
-                except Exception as e:
-                    logger.error(f"上传第 {page} 页时发生错误: {e}")
-        else:
-            logger.warning(f"第 {page} 页爬取失败或无数据，跳过上传。")
+                    except Exception as e:
+                        logger.error(f"上传第 {page} 页时发生错误: {e}")
+            else:
+                logger.warning(f"第 {page} 页爬取失败或无数据，跳过上传。")
+
+def run_plan(pages, page_info, queue_file, byte_budget=None, time_budget=None):
+    """
+    --plan：只获取列表 (或读取 Meta Kaggle 队列)，估算条目数、API 调用、下载量与耗时，不下载任何内容
+    给出预算时按投票数 (没有投票数时按可用性评分) 选择放得下的数据集
+    """
+    # 列表请求受 concurrency.API 限制，多页并发获取
+    with ThreadPoolExecutor(max_workers=concurrency.API.ceiling) as executor:
+        listed = list(executor.map(lambda page: get_data.list_page(page, queue_file), pages))
+
+    items, done = [], 0
+    for rows in listed:
+        for row in rows:
+            # 已完整下载的数据集运行时直接跳过，不计入
+            if staging.is_complete(get_data.DATASET_DIR / row['ref'].replace("/", "_")):
+                done += 1
+                continue
+            votes = row.get('totalVotes') or row.get('voteCount')
+            value = float(votes) if votes else float(row.get('usabilityRating') or 0)
+            # 每个数据集: metadata、files、download 各一次
+            calls, size = 3, scheduler.size_of(row)
+            if sampler.wants_sample(row):
+                # 采样时按上限估算：每个文件一次请求，读取开头 HEAD_BYTES 字节
+                cap = sampler.MAX_FILES * sampler.HEAD_BYTES
+                calls, size = 2 + sampler.MAX_FILES, cap if size is None else min(size, cap)
+            items.append(planner.make_item(row['ref'], calls=calls, size=size, value=value))
+
+    logger = logging.getLogger("main")
+    if done:
+        logger.info(f"已完成的 {done} 个数据集不计入预估")
+    rates = planner.measured_rates("dataset")
+    list_calls = 0 if queue_file else len(pages)
+    calls_note = f"列表 {list_calls} 次 + 每个数据集 metadata / files / download 各 1 次"
+    if sampler.MODE == "sample":
+        calls_note += f"，采样的数据集按每个文件 1 次、最多 {sampler.MAX_FILES} 个文件计"
+    planner.report(f"数据集第 {page_info} 页", planner.estimate(items, list_calls, rates), rates, calls_note)
+
+    if byte_budget is not None or time_budget is not None:
+        items = planner.select(items, rates, byte_budget=byte_budget, time_budget=time_budget)
+        planner.report("预算内选中的数据集", planner.estimate(items, list_calls, rates), rates, calls_note)
+    else:
+        items = sorted(items, key=lambda it: it["value"], reverse=True)
+    planner.write_selection(planner.PLAN_DIR / f"plan_dataset_{page_info}.csv", items, rates)
 
 def main():
     parser = argparse.ArgumentParser(description="Kaggle 数据爬取与上传工具")
@@ -153,12 +233,60 @@ def main():
     parser.add_argument('-c', type=int, nargs=1,
                         help='接续模式 (仅配合 --upload)。用法: --upload -c 5 (从记录页开始往后爬5页)')
 
+    # Meta Kaggle 列表来源
+    parser.add_argument('--meta-kaggle', metavar='DIR',
+                        help='使用本地 Meta Kaggle CSV 目录生成待处理队列，代替 kaggle datasets list')
+    parser.add_argument('--rebuild-list', action='store_true',
+                        help='配合 --meta-kaggle：忽略已有的 list/meta_datasets.csv，重新生成队列')
+    parser.add_argument('--min-usability', type=float, default=0.8,
+                        help='配合 --meta-kaggle：可用性评分下限，默认 0.8')
+    parser.add_argument('--medal-only', action='store_true',
+                        help='配合 --meta-kaggle：只保留获得勋章的数据集')
+    parser.add_argument('--since', help='配合 --meta-kaggle：最后更新时间下限，如 2023-01-01')
+    parser.add_argument('--until', help='配合 --meta-kaggle：最后更新时间上限')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='记录每次 Kaggle 调用、下载、上传的 span，输出 Chrome trace 格式 (可用 Perfetto 打开)')
+    parser.add_argument('--profile-memory', type=int, nargs='?', const=memprof.DEFAULT_THRESHOLD_MB, metavar='MB',
+                        help='内存剖析：按页和阶段记录 RSS 与 tracemalloc 峰值，RSS 超过阈值 (默认 2048MB) 时写出分配位置')
+    parser.add_argument('--api-timeout', type=int, metavar='SECONDS',
+                        help=f'单次元数据请求 (list / metadata / files 等) 的时限，默认 {deadline.DEADLINES["api"]} 秒')
+    parser.add_argument('--download-timeout', type=int, metavar='SECONDS',
+                        help=f'单次下载的时限，默认 {deadline.DEADLINES["download"]} 秒；超时的条目在页末重新排队')
+    parser.add_argument('--api-concurrency', type=concurrency.parse_bounds, metavar='MIN:MAX',
+                        help=f'同时进行的元数据请求数范围，按吞吐、延迟与 429 自动调整，默认 {concurrency.API.floor}:{concurrency.API.ceiling}')
+    parser.add_argument('--download-concurrency', type=concurrency.parse_bounds, metavar='MIN:MAX',
+                        help=f'同时进行的下载数范围，按下载速度与错误自动调整，默认 {concurrency.DOWNLOADS.floor}:{concurrency.DOWNLOADS.ceiling}')
+    parser.add_argument('--large-size', type=scheduler.parse_size, metavar='SIZE',
+                        help='超过该大小的数据集走大文件通道，不阻塞本页写出与上传，如 2GB，默认 1GB')
+    parser.add_argument('--large-budget', type=scheduler.parse_size, metavar='SIZE',
+                        help='大文件通道同时下载的总大小上限，如 50GB，默认 20GB')
+    parser.add_argument('--content', choices=['full', 'sample'], default='full',
+                        help='full：下载完整数据集 (默认)；sample：大数据集只读取部分文件的开头，保存表头、样本行、列类型与行数')
+    parser.add_argument('--sample-rows', type=int, metavar='N',
+                        help=f'配合 --content sample：每个文件保存的样本行数，默认 {sampler.SAMPLE_ROWS}')
+    parser.add_argument('--full-under', type=scheduler.parse_size, metavar='SIZE',
+                        help='配合 --content sample：不超过该大小的数据集仍完整下载，如 50MB，默认 100MB')
+    parser.add_argument('--plan', action='store_true',
+                        help='只获取列表，预估条目数、API 调用次数、下载量与耗时，不下载；选中的条目写入 list/plan_dataset_*.csv')
+    parser.add_argument('--budget-bytes', type=planner.parse_size, metavar='SIZE',
+                        help='配合 --plan：下载量预算，如 2TB，按投票数选择放得下的数据集')
+    parser.add_argument('--budget-hours', type=float, metavar='HOURS',
+                        help='配合 --plan：耗时预算 (小时)，按当前实测速率选择放得下的数据集')
+    parser.add_argument('--dedup', action='store_true',
+                        help='配合 --upload：数据集文件按内容去重上传到 blobs/<摘要>，每个数据集另传一份清单 (manifests/)')
+    parser.add_argument('--chunked', action='store_true',
+                        help='配合 --dedup：不小于 64MB 的文件按内容分块，新版本只上传改动的块')
+
     # 解析参数
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
         sys.exit(1)
 
     args = parser.parse_args()
+    deadline.configure(api=args.api_timeout, download=args.download_timeout)
+    concurrency.configure(api=args.api_concurrency, download=args.download_concurrency)
+    scheduler.configure(large_size=args.large_size, byte_budget=args.large_budget)
+    sampler.configure(mode=args.content, rows=args.sample_rows, full_under=args.full_under)
 
     # 逻辑验证
     mode = 'local' if args.local else 'upload'
@@ -168,6 +296,14 @@ def main():
         print("错误：参数 -c 只能配合 --upload 使用")
         sys.exit(1)
 
+    if args.dedup and mode == 'local':
+        print("错误：参数 --dedup 只能配合 --upload 使用")
+        sys.exit(1)
+
+    if args.chunked and not args.dedup:
+        print("错误：参数 --chunked 只能配合 --dedup 使用")
+        sys.exit(1)
+
     # 验证 --upload 如果没有 -c，必须有参数
     if mode == 'upload' and not args.c and not args.upload:
         print("错误：--upload 模式下，如果不使用 -c，必须指定页码或区间")
@@ -181,10 +317,23 @@ def main():
         return
 
     # 初始化日志
-    setup_logging(page_info_str)
+    setup_logging(page_info_str, profile_memory=args.profile_memory)
     
     # 执行主流程
-    run_workflow(target_pages, do_upload=(mode == 'upload'))
+    if args.trace:
+        tracing.enable(args.trace)
+    try:
+        queue_file = prepare_meta_queue(args)
+        if args.plan:
+            run_plan(target_pages, page_info_str, queue_file, byte_budget=args.budget_bytes,
+                     time_budget=args.budget_hours * 3600 if args.budget_hours else None)
+        else:
+            run_workflow(target_pages, do_upload=(mode == 'upload'), queue_file=queue_file,
+                         dedup=args.dedup, chunked=args.chunked)
+    finally:
+        metrics.shutdown()
+        tracing.close()
+        memprof.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,103 @@
+import csv
+import logging
+from pathlib import Path
+
+# pandas 只在生成队列时导入，按页读取队列只用 csv 模块
+import meta_store
+
+logger = logging.getLogger("main.meta_listing")
+
+# 与 kaggle datasets list 每页条数一致，页码含义保持不变
+PAGE_SIZE = 20
+QUEUE_FILE = Path("./list/meta_datasets.csv")
+# 写出的队列字段与 kaggle datasets list --csv 的列名一致，下游处理不需要区分来源
+QUEUE_COLUMNS = ["ref", "title", "lastUpdated", "size", "usabilityRating", "totalVotes", "medal"]
+
+
+def _usecols(meta_dir, table, wanted):
+    """只读取实际存在的列，兼容不同时期的 Meta Kaggle"""
+    header = set(meta_store.table_columns(meta_dir, table))
+    return [c for c in wanted if c in header]
+
+
+def build_dataset_queue(meta_dir, out_file=QUEUE_FILE, min_usability=0.8, medal_only=False,
+                        since=None, until=None):
+    """
+    基于本地 Meta Kaggle CSV 生成待处理的数据集队列，替代逐页调用 kaggle datasets list
+    需要 Datasets.csv、DatasetVersions.csv、Users.csv，Organizations.csv 可选
+    目录下有 meta_store.py 生成的索引库时直接查库
+    过滤条件全部向量化执行；按 TotalVotes 降序写出，返回条目数
+    """
+    import pandas as pd
+    meta_dir = Path(meta_dir)
+
+    wanted = ["Id", "OwnerUserId", "OwnerOrganizationId", "CreatorUserId", "CurrentDatasetVersionId",
+              "LastActivityDate", "TotalVotes", "Medal", "UsabilityRating"]
+    ds = meta_store.read_table(meta_dir, "Datasets", columns=_usecols(meta_dir, "Datasets", wanted))
+    logger.info(f"Meta Kaggle 数据集总数: {len(ds)}")
+
+    # 1. 过滤：勋章、日期
+    if medal_only and "Medal" in ds.columns:
+        ds = ds[ds["Medal"].notna()]
+    ds["LastActivityDate"] = pd.to_datetime(ds["LastActivityDate"], errors="coerce", format="mixed")
+    if since:
+        ds = ds[ds["LastActivityDate"] >= pd.Timestamp(since)]
+    if until:
+        ds = ds[ds["LastActivityDate"] <= pd.Timestamp(until)]
+
+    # 2. 当前版本：标题、slug、大小
+    version_cols = _usecols(meta_dir, "DatasetVersions", ["Id", "Title", "Slug", "TotalCompressedBytes",
+                                                          "TotalUncompressedBytes", "UsabilityRating"])
+    versions = meta_store.read_rows_by_ids(meta_dir, "DatasetVersions", version_cols, "Id",
+                                           ds["CurrentDatasetVersionId"].dropna())
+    versions = versions.rename(columns={"Id": "CurrentDatasetVersionId", "UsabilityRating": "VersionUsability"})
+    ds = ds.merge(versions, on="CurrentDatasetVersionId", how="inner")
+
+    # 3. 可用性评分：不同时期的导出里所在的表不同，两处都没有时不做过滤
+    if "UsabilityRating" not in ds.columns and "VersionUsability" in ds.columns:
+        ds["UsabilityRating"] = ds["VersionUsability"]
+    if "UsabilityRating" in ds.columns:
+        ds = ds[ds["UsabilityRating"].fillna(0) >= min_usability]
+    else:
+        logger.warning("Meta Kaggle 中没有 UsabilityRating 列，跳过可用性过滤")
+        ds["UsabilityRating"] = None
+
+    # 4. 拼出 ref = 所有者/slug，所有者可能是用户或组织
+    users = meta_store.read_rows_by_ids(meta_dir, "Users", ["Id", "UserName"], "Id",
+                                        set(ds["OwnerUserId"].dropna()) | set(ds["CreatorUserId"].dropna()))
+    owner = ds["OwnerUserId"].fillna(ds["CreatorUserId"]).map(users.set_index("Id")["UserName"])
+
+    if meta_store.has_source(meta_dir, "Organizations") and "OwnerOrganizationId" in ds.columns:
+        orgs = meta_store.read_table(meta_dir, "Organizations", columns=["Id", "Slug"]).set_index("Id")["Slug"]
+        owner = ds["OwnerOrganizationId"].map(orgs).fillna(owner)
+
+    size_col = "TotalCompressedBytes" if "TotalCompressedBytes" in ds.columns else "TotalUncompressedBytes"
+    queue = pd.DataFrame({
+        "ref": owner + "/" + ds["Slug"],
+        "title": ds["Title"],
+        "lastUpdated": ds["LastActivityDate"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+        "size": ds[size_col].fillna(0).astype("int64"),
+        "usabilityRating": ds["UsabilityRating"],
+        "totalVotes": ds["TotalVotes"].fillna(0).astype("int64"),
+        "medal": ds["Medal"].astype("Int64") if "Medal" in ds.columns else None,
+    })
+    queue = queue[queue["ref"].notna()].sort_values("totalVotes", ascending=False, kind="stable")
+
+    out_file = Path(out_file)
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    queue[QUEUE_COLUMNS].to_csv(out_file, index=False)
+    logger.info(f"Meta Kaggle 队列生成完成: {len(queue)} 条 -> {out_file}")
+    return len(queue)
+
+
+def read_queue_page(queue_file, page_num, page_size=PAGE_SIZE):
+    """按页读取队列文件，返回与 kaggle datasets list --csv 相同结构的行"""
+    start = (page_num - 1) * page_size
+    rows = []
+    with open(queue_file, 'r', encoding='utf-8') as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            if i >= start + page_size:
+                break
+            if i >= start:
+                rows.append(row)
+    return rows
@@ -0,0 +1,356 @@
+"""
+Meta Kaggle 本地索引库
+
+将 Meta Kaggle 的 CSV 一次性导入 SQLite (meta_kaggle.db，放在 CSV 同目录)，并在各处理器关联用到的
+id 列上建索引；之后的每日导出中，只追加新行的表按 Id 水位增量导入，会原地更新旧行的表整表重新导入。
+各处理器通过 read_table /
+read_rows_by_ids / iter_table_chunks 读取数据：索引库存在时查库，否则回退到直接读 CSV。
+
+用法:
+    python meta_store.py --meta-dir ./meta-kaggle                 # 导入 (只导入有变化的表)
+    python meta_store.py --meta-dir ./meta-kaggle --full          # 重建全部表
+    python meta_store.py --meta-dir ./meta-kaggle --tables Teams Submissions
+"""
+import os
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+from pathlib import Path
+
+# pandas 导入需要数百毫秒，在用到的函数内按需导入；只调用 has_source 等函数的入口不必加载
+logger = logging.getLogger("main.meta_store")
+
+DB_NAME = "meta_kaggle.db"
+CHUNK_SIZE = 200_000
+
+# 表名: (主键列, 是否只追加新行, 需要建索引的列)
+# 只追加的表 (提交、版本、论坛消息) 已有的行不再变化，增量导入时只追加 Id 大于水位的行；
+# 其余表的行会原地更新 (Teams 的 PrivateLeaderboardRank / WriteUpForumTopicId、Kernels 的投票数等)，
+# 且没有可靠的更新时间列，源文件变化时整表重新导入
+TABLES = {
+    "Competitions": ("Id", False, ["Slug", "ForumId"]),
+    "Teams": ("Id", False, ["CompetitionId", "WriteUpForumTopicId"]),
+    "Submissions": ("Id", True, ["TeamId"]),
+    "Datasets": ("Id", False, ["CurrentDatasetVersionId", "OwnerUserId", "ForumId"]),
+    "DatasetVersions": ("Id", True, ["DatasetId"]),
+    "Kernels": ("Id", False, ["CurrentKernelVersionId", "AuthorUserId", "ForumTopicId"]),
+    "KernelVersions": ("Id", True, ["ScriptId"]),
+    "KernelLanguages": ("Id", False, []),
+    "Users": ("Id", False, ["UserName"]),
+    "Organizations": ("Id", False, ["Slug"]),
+    "Forums": ("Id", False, ["ParentForumId"]),
+    "ForumTopics": ("Id", False, ["ForumId"]),
+    "ForumMessages": ("Id", True, ["ForumTopicId", "PostUserId"]),
+}
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def store_path(meta_dir):
+    return Path(meta_dir) / DB_NAME
+
+
+def open_store(meta_dir, must_exist=True):
+    """打开索引库；must_exist 为 True 且库不存在时返回 None"""
+    path = store_path(meta_dir)
+    if must_exist and not path.exists():
+        return None
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def has_table(conn, table):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    return row is not None
+
+
+def _table_columns(conn, table):
+    return [r[1] for r in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+# ================= 导入 =================
+
+def _normalize_chunk(chunk):
+    """
+    Id 类列统一为可空整数，日期列统一为可排序的 ISO 格式 (原始格式为 MM/DD/YYYY)
+    """
+    import pandas as pd
+    for col in chunk.columns:
+        if col == "Id" or col.endswith("Id"):
+            numeric = pd.to_numeric(chunk[col], errors="coerce")
+            if numeric.notna().sum() == chunk[col].notna().sum():
+                chunk[col] = numeric.astype("Int64")
+        elif col.endswith("Date"):
+            chunk[col] = pd.to_datetime(chunk[col], errors="coerce", format="mixed").dt.strftime(DATE_FORMAT)
+    return chunk
+
+
+def _ensure_state_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS _ingest_state (
+            table_name TEXT PRIMARY KEY,
+            max_id INTEGER,
+            row_count INTEGER,
+            source_size INTEGER,
+            source_mtime REAL,
+            ingested_at TEXT
+        )
+    """)
+
+
+def _load_state(conn, table):
+    row = conn.execute(
+        "SELECT max_id, source_size, source_mtime FROM _ingest_state WHERE table_name=?", (table,)
+    ).fetchone()
+    return row if row else (None, None, None)
+
+
+def _save_state(conn, table, max_id, stat):
+    # 按列名写入，兼容旧版索引库中多一列 max_date 的状态表
+    conn.execute(
+        "INSERT OR REPLACE INTO _ingest_state (table_name, max_id, row_count, source_size, source_mtime, ingested_at) "
+        f"VALUES (?, ?, (SELECT COUNT(*) FROM \"{table}\"), ?, ?, datetime('now'))",
+        (table, max_id, stat.st_size, stat.st_mtime)
+    )
+
+
+def _add_missing_columns(conn, table, columns):
+    existing = set(_table_columns(conn, table))
+    for col in columns:
+        if col not in existing:
+            logger.info(f"{table} 新增列: {col}")
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{col}"')
+
+
+def _chunk_max_id(chunk, id_col, max_id):
+    import pandas as pd
+    if id_col in chunk.columns:
+        chunk_max = chunk[id_col].max()
+        if pd.notna(chunk_max):
+            return int(chunk_max) if max_id is None else max(max_id, int(chunk_max))
+    return max_id
+
+
+def _append_rows(conn, csv_path, table, id_col, max_id, chunksize):
+    """只追加的表：追加 Id 大于水位的行，返回 (追加行数, 新水位)"""
+    import pandas as pd
+    # 上次追加到一半中断时留下的行，按唯一索引删除后重新追加
+    conn.execute(f'DELETE FROM "{table}" WHERE "{id_col}" > ?', (max_id,))
+    conn.commit()
+    rows = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize, low_memory=False):
+        chunk = _normalize_chunk(chunk)
+        chunk = chunk[(chunk[id_col] > max_id).fillna(False)]
+        if chunk.empty:
+            continue
+        _add_missing_columns(conn, table, chunk.columns)
+        chunk.to_sql(table, conn, if_exists="append", index=False)
+        rows += len(chunk)
+        max_id = _chunk_max_id(chunk, id_col, max_id)
+    return rows, max_id
+
+
+def _rebuild_table(conn, csv_path, table, id_col, index_cols, stat, chunksize):
+    """
+    整表重新导入：新数据先写入临时表，导入完成后在同一事务中替换旧表并建索引，返回行数
+    WAL 模式下读者在提交前看到的仍是旧表
+    """
+    import pandas as pd
+    staging_table = f"_new_{table}"
+    conn.execute(f'DROP TABLE IF EXISTS "{staging_table}"')
+    rows = 0
+    max_id = None
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize, low_memory=False):
+        chunk = _normalize_chunk(chunk)
+        # 后续分块可能出现前面没有的列 (全空的列按 float 推断，不影响)
+        if rows:
+            _add_missing_columns(conn, staging_table, chunk.columns)
+        chunk.to_sql(staging_table, conn, if_exists="append", index=False)
+        rows += len(chunk)
+        max_id = _chunk_max_id(chunk, id_col, max_id)
+
+    if not rows:
+        conn.execute(f'DROP TABLE IF EXISTS "{staging_table}"')
+        conn.commit()
+        return 0
+
+    conn.execute("BEGIN")
+    try:
+        conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.execute(f'ALTER TABLE "{staging_table}" RENAME TO "{table}"')
+        # 索引：主键唯一索引 + 关联列索引
+        columns = set(_table_columns(conn, table))
+        if id_col in columns:
+            conn.execute(f'CREATE UNIQUE INDEX "ix_{table}_{id_col}" ON "{table}" ("{id_col}")')
+        for col in index_cols:
+            if col in columns:
+                conn.execute(f'CREATE INDEX "ix_{table}_{col}" ON "{table}" ("{col}")')
+        _save_state(conn, table, max_id, stat)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rows
+
+
+def ingest_table(conn, csv_path, table, full=False, chunksize=CHUNK_SIZE):
+    """
+    导入单张表：
+    - 源文件大小与修改时间都未变化时直接跳过
+    - 只追加的表 (见 TABLES)：追加 Id 大于水位的行；源文件变小 (导出重建或删除了行) 时整表重建
+    - 其余表，以及首次导入或 full=True：整表重新导入
+    返回导入的行数
+    """
+    id_col, append_only, index_cols = TABLES.get(table, ("Id", False, []))
+    stat = csv_path.stat()
+    _ensure_state_table(conn)
+
+    max_id, last_size, last_mtime = _load_state(conn, table)
+    exists = has_table(conn, table)
+    if not full and exists and last_size == stat.st_size and last_mtime == stat.st_mtime:
+        logger.info(f"{table} 源文件未变化，跳过")
+        return 0
+
+    start = time.time()
+    if (not full and exists and append_only and max_id is not None
+            and last_size is not None and stat.st_size >= last_size):
+        rows, max_id = _append_rows(conn, csv_path, table, id_col, max_id, chunksize)
+        _save_state(conn, table, max_id, stat)
+        conn.commit()
+        logger.info(f"{table} 增量导入完成: 新增 {rows} 行，Id 水位 {max_id}，用时 {time.time() - start:.1f}s")
+        return rows
+
+    rows = _rebuild_table(conn, csv_path, table, id_col, index_cols, stat, chunksize)
+    if not rows:
+        logger.warning(f"{table} 为空表，跳过")
+        return 0
+    logger.info(f"{table} 导入完成: 共 {rows} 行，用时 {time.time() - start:.1f}s")
+    return rows
+
+
+def ingest(meta_dir, tables=None, full=False):
+    """导入 meta_dir 下存在的全部 (或指定) 表，返回索引库路径"""
+    meta_dir = Path(meta_dir)
+    conn = open_store(meta_dir, must_exist=False)
+    # 导入期间关闭同步写，崩溃时重跑即可
+    conn.execute("PRAGMA synchronous=OFF")
+    try:
+        for table in tables or TABLES:
+            csv_path = meta_dir / f"{table}.csv"
+            if not csv_path.exists():
+                logger.info(f"{csv_path.name} 不存在，跳过")
+                continue
+            ingest_table(conn, csv_path, table, full=full)
+        # 更新查询规划器的统计信息
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    return store_path(meta_dir)
+
+
+# ================= 查询 (索引库优先，CSV 兜底) =================
+
+def _select(columns):
+    return ", ".join(f'"{c}"' for c in columns) if columns else "*"
+
+
+def read_table(meta_dir, table, columns=None, where=None, params=()):
+    """
+    读取整张表 (可选列、可选 SQL 过滤条件)
+    没有索引库时读取 CSV；此时 where 不可用，需调用方自行过滤
+    """
+    import pandas as pd
+    conn = open_store(meta_dir)
+    if conn is not None and has_table(conn, table):
+        try:
+            sql = f'SELECT {_select(columns)} FROM "{table}"'
+            if where:
+                sql += f" WHERE {where}"
+            return pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+    if where:
+        raise ValueError(f"{table} 没有索引库，无法执行条件查询: {where}")
+    return pd.read_csv(Path(meta_dir) / f"{table}.csv", usecols=columns, low_memory=False)
+
+
+def iter_table_chunks(meta_dir, table, columns=None, chunksize=CHUNK_SIZE):
+    """分块迭代整张表，内存占用与表大小无关"""
+    import pandas as pd
+    conn = open_store(meta_dir)
+    if conn is not None and has_table(conn, table):
+        try:
+            yield from pd.read_sql_query(f'SELECT {_select(columns)} FROM "{table}"', conn, chunksize=chunksize)
+        finally:
+            conn.close()
+        return
+    yield from pd.read_csv(Path(meta_dir) / f"{table}.csv", usecols=columns,
+                           chunksize=chunksize, low_memory=False)
+
+
+def read_rows_by_ids(meta_dir, table, columns, id_col, ids, chunksize=CHUNK_SIZE):
+    """
+    读取 id_col 在 ids 中的行
+    索引库：ids 写入临时表后走索引关联；CSV：分块扫描过滤
+    """
+    import pandas as pd
+    ids = [int(i) for i in set(ids) if pd.notna(i)]
+    conn = open_store(meta_dir)
+    if conn is not None and has_table(conn, table):
+        try:
+            conn.execute("CREATE TEMP TABLE _wanted (id INTEGER PRIMARY KEY)")
+            conn.executemany("INSERT OR IGNORE INTO _wanted VALUES (?)", [(i,) for i in ids])
+            cols = ", ".join(f't."{c}"' for c in columns)
+            return pd.read_sql_query(
+                f'SELECT {cols} FROM "{table}" t JOIN _wanted w ON t."{id_col}" = w.id', conn
+            )
+        finally:
+            conn.close()
+
+    wanted = set(ids)
+    parts = []
+    for chunk in pd.read_csv(Path(meta_dir) / f"{table}.csv", usecols=columns,
+                             chunksize=chunksize, low_memory=False):
+        parts.append(chunk[chunk[id_col].isin(wanted)])
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=columns)
+
+
+def has_source(meta_dir, table):
+    """索引库中有该表，或目录下有对应 CSV"""
+    conn = open_store(meta_dir)
+    if conn is not None:
+        try:
+            if has_table(conn, table):
+                return True
+        finally:
+            conn.close()
+    return (Path(meta_dir) / f"{table}.csv").exists()
+
+
+def table_columns(meta_dir, table):
+    """表中实际存在的列，兼容不同时期的 Meta Kaggle"""
+    conn = open_store(meta_dir)
+    if conn is not None and has_table(conn, table):
+        try:
+            return _table_columns(conn, table)
+        finally:
+            conn.close()
+    import pandas as pd
+    return list(pd.read_csv(Path(meta_dir) / f"{table}.csv", nrows=0).columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将 Meta Kaggle CSV 导入本地 SQLite 索引库")
+    parser.add_argument("--meta-dir", default=".", help="Meta Kaggle CSV 所在目录，索引库也写在这里")
+    parser.add_argument("--tables", nargs="+", help="只导入指定表，默认导入目录下存在的全部已知表")
+    parser.add_argument("--full", action="store_true", help="忽略水位，整表重建 (源文件未变化的表也重新导入)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    path = ingest(args.meta_dir, args.tables, args.full)
+    logger.info(f"索引库: {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
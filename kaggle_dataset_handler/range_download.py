@@ -0,0 +1,390 @@
+import os
+import json
+import math
+import time
+import base64
+import random
+import hashlib
+import logging
+import tarfile
+import zipfile
+import threading
+from pathlib import Path
+from urllib.parse import urljoin, quote
+
+import metrics
+import tracing
+
+logger = logging.getLogger("main.range_download")
+
+# 默认指向官方 API，可通过环境变量替换为本地替身服务 (测试 / 压测)
+API_ENDPOINT = os.environ.get("KAGGLE_API_ENDPOINT", "https://www.kaggle.com").rstrip("/") + "/api/v1"
+# 未完成的压缩包保存在这里，跨运行保留以便续传 (不能放在会被清理的 .partial 目录里)
+DOWNLOAD_CACHE_DIR = Path("./local_workspace/downloads")
+
+CHUNK_SIZE = 64 * 1024                  # 每次读取 64KB，断线时最多丢失这么多
+SEGMENT_THRESHOLD = 256 * 1024 * 1024   # 大于该大小的文件才分段并发
+MIN_SEGMENT_SIZE = 64 * 1024 * 1024
+MAX_SEGMENTS = 8
+CONNECT_TIMEOUT = 30
+STALL_TIMEOUT = 60                      # 单段超过该秒数没有收到任何数据即视为卡死
+MAX_RETRIES = 5                         # 单段连续无进展的重试次数
+PERSIST_INTERVAL = 2                    # 进度文件最短落盘间隔 (秒)
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+class ResolveError(DownloadError):
+    """凭证缺失或无法解析下载地址，此时尚未传输任何数据，调用方可以改用其他方式下载"""
+    pass
+
+
+def _kaggle_credentials():
+    """读取 Kaggle 凭证：优先环境变量，其次 kaggle.json"""
+    token = os.environ.get("KAGGLE_API_TOKEN")
+    if token:
+        return {"Authorization": f"Bearer {token}"}, None
+
+    username = os.environ.get("KAGGLE_USERNAME")
+    key = os.environ.get("KAGGLE_KEY")
+    if not (username and key):
+        config_dir = Path(os.environ.get("KAGGLE_CONFIG_DIR", Path.home() / ".kaggle"))
+        config_file = config_dir / "kaggle.json"
+        if config_file.exists():
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            username, key = config.get("username"), config.get("key")
+
+    if not (username and key):
+        raise ResolveError("未找到 Kaggle 凭证 (KAGGLE_USERNAME/KAGGLE_KEY 或 kaggle.json)")
+    return {}, (username, key)
+
+
+def model_version_url(model_ref, variation_ref, version_number):
+    """model_ref: owner/model，variation_ref: framework/instanceSlug"""
+    return f"{API_ENDPOINT}/models/{model_ref}/{variation_ref}/{version_number}/download"
+
+
+def dataset_url(ref):
+    return f"{API_ENDPOINT}/datasets/download/{ref}"
+
+
+def dataset_file_url(ref, file_name):
+    """数据集中的单个文件，与 kaggle datasets download -f 相同"""
+    return f"{API_ENDPOINT}/datasets/download/{ref}/{quote(file_name)}"
+
+
+def _locate(session, url):
+    """跟随 Kaggle API 的重定向，返回 (真实下载地址, 请求头, 认证)；跳转到存储服务后不再携带凭证"""
+    import requests
+    headers, auth = _kaggle_credentials()
+    try:
+        resp = session.get(url, headers=headers, auth=auth, allow_redirects=False,
+                           timeout=(CONNECT_TIMEOUT, STALL_TIMEOUT))
+        resp.close()
+    except requests.RequestException as e:
+        raise ResolveError(f"请求下载地址失败: {e}")
+    if resp.status_code in (301, 302, 303, 307, 308):
+        return urljoin(url, resp.headers["Location"]), {}, None
+    if resp.status_code == 200:
+        return url, headers, auth
+    error = ResolveError(f"解析下载地址失败 ({resp.status_code}): {url}")
+    # 带上响应，errors.classify 可以按状态码区分 404 / 403 与临时错误
+    error.response = resp
+    raise error
+
+
+def _resolve(session, url):
+    """
+    跟随 Kaggle API 的重定向拿到真实下载地址，并用 1 字节的 Range 请求探测
+    返回 (下载地址, 总大小, 是否支持 Range, etag, md5, (请求头, 认证))
+    """
+    target, headers, auth = _locate(session, url)
+
+    probe = session.get(target, headers={**headers, "Range": "bytes=0-0"}, auth=auth,
+                        stream=True, timeout=(CONNECT_TIMEOUT, STALL_TIMEOUT))
+    probe.close()
+    if probe.status_code == 206:
+        # Content-Range: bytes 0-0/12345
+        total = int(probe.headers["Content-Range"].rsplit("/", 1)[1])
+        ranged = True
+    elif probe.status_code == 200:
+        total = int(probe.headers.get("Content-Length", 0)) or None
+        ranged = False
+    else:
+        raise ResolveError(f"探测下载地址失败 ({probe.status_code}): {target}")
+
+    # GCS 会在 x-goog-hash 中给出 md5 (base64)
+    md5 = None
+    for part in probe.headers.get("x-goog-hash", "").split(","):
+        part = part.strip()
+        if part.startswith("md5="):
+            md5 = base64.b64decode(part[4:]).hex()
+
+    return target, total, ranged, probe.headers.get("ETag"), md5, (headers, auth)
+
+
+class _Progress:
+    """分段进度，定期持久化到 <文件>.progress.json"""
+
+    def __init__(self, state_file, state):
+        self.state_file = state_file
+        self.state = state
+        self.lock = threading.Lock()
+        self.last_persist = 0.0
+
+    def advance(self, index, offset):
+        with self.lock:
+            metrics.add_bytes("download", offset - self.state["segments"][index][2])
+            self.state["segments"][index][2] = offset
+            if time.monotonic() - self.last_persist >= PERSIST_INTERVAL:
+                self._persist()
+
+    def flush(self):
+        with self.lock:
+            self._persist()
+
+    def _persist(self):
+        tmp = self.state_file.with_name(self.state_file.name + ".tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_file)
+        self.last_persist = time.monotonic()
+
+
+def _plan_segments(total, ranged):
+    if not ranged or not total or total < SEGMENT_THRESHOLD:
+        return [[0, (total or 0) - 1, 0]]
+    count = min(MAX_SEGMENTS, math.ceil(total / MIN_SEGMENT_SIZE))
+    size = math.ceil(total / count)
+    # 每段: [起始字节, 结束字节(含), 下一个待写入的字节]
+    return [[start, min(start + size, total) - 1, start] for start in range(0, total, size)]
+
+
+def _fetch_segment(session, source, dest, index, progress, resolve_again):
+    """下载单个分段，断开或卡住时从已写入的位置续传"""
+    import requests
+    failures = 0
+    while True:
+        start, end, offset = progress.state["segments"][index]
+        if end >= 0 and offset > end:
+            return
+
+        url, (headers, auth) = source["url"], source["auth"]
+        req_headers = dict(headers)
+        if source["ranged"]:
+            req_headers["Range"] = f"bytes={offset}-{end}"
+
+        try:
+            with session.get(url, headers=req_headers, auth=auth, stream=True,
+                             timeout=(CONNECT_TIMEOUT, STALL_TIMEOUT)) as resp:
+                if resp.status_code in (401, 403):
+                    # 签名地址过期，重新解析后继续
+                    resolve_again()
+                    raise DownloadError(f"下载地址失效 ({resp.status_code})，已重新解析")
+                if resp.status_code not in (200, 206):
+                    raise DownloadError(f"分段 {index} 请求失败 ({resp.status_code})")
+                if source["ranged"] and resp.status_code != 206:
+                    raise DownloadError(f"分段 {index} 服务端未返回 206，无法续传")
+
+                with open(dest, 'r+b') as f:
+                    f.seek(offset)
+                    for chunk in resp.iter_content(CHUNK_SIZE):
+                        if not chunk:
+                            continue
+                        if end >= 0:
+                            chunk = chunk[:end - offset + 1]
+                        f.write(chunk)
+                        offset += len(chunk)
+                        progress.advance(index, offset)
+                        failures = 0
+                        if end >= 0 and offset > end:
+                            break
+
+            # 不支持 Range 的单流下载，读完即结束
+            if end < 0:
+                progress.state["segments"][index][1] = offset - 1
+                progress.advance(index, offset)
+                return
+            if offset <= end:
+                raise DownloadError(f"分段 {index} 连接提前结束于 {offset}/{end + 1}")
+
+        except (requests.RequestException, DownloadError, OSError) as e:
+            failures += 1
+            metrics.record_retry("segment", e)
+            if failures > MAX_RETRIES:
+                raise DownloadError(f"分段 {index} 连续 {MAX_RETRIES} 次无进展: {e}")
+            if not source["ranged"]:
+                # 无法续传，只能从头开始
+                progress.state["segments"][index][2] = 0
+            wait_time = min(30, 2 ** failures) + random.uniform(0, 1)
+            logger.warning(f"分段 {index} 中断 ({e})，{wait_time:.1f}秒后从 {progress.state['segments'][index][2]} 字节续传")
+            time.sleep(wait_time)
+
+
+def _file_digest(path, algorithm):
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(16 * 1024 * 1024)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def download_file(url, dest, expected_sha256=None, session=None):
+    """
+    可续传的下载：
+    - 支持 Range 时按持久化的字节偏移续传，大文件分段并发
+    - 每段在 STALL_TIMEOUT 秒内无数据即断开重连
+    - 完成后校验 md5 (x-goog-hash) 或调用方给定的 sha256，不一致则删除重下
+    """
+    # requests 在首次下载时才导入，不拖慢入口脚本的启动
+    import requests
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with tracing.span("range_download", cat="download", file=dest.name) as sp:
+        _download_file(url, dest, expected_sha256, session or requests.Session(), sp)
+    return dest
+
+
+def _download_file(url, dest, expected_sha256, session, sp):
+    state_file = dest.with_name(dest.name + ".progress.json")
+
+    with tracing.span("resolve", cat="http"):
+        target, total, ranged, etag, md5, auth = _resolve(session, url)
+    sp.set(bytes=total, ranged=ranged)
+    source = {"url": target, "auth": auth, "ranged": ranged}
+
+    def resolve_again():
+        source["url"], _, _, _, _, source["auth"] = _resolve(session, url)
+
+    state = None
+    if state_file.exists() and dest.exists():
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception:
+            state = None
+        # 远端文件变化 (大小或 etag 不同) 时不能续传
+        if state and (state.get("size") != total or state.get("etag") != etag or not ranged):
+            logger.info(f"远端文件已变化，重新下载: {dest.name}")
+            state = None
+
+    if state is None:
+        state = {"url": url, "size": total, "etag": etag, "md5": md5,
+                 "segments": _plan_segments(total, ranged)}
+        with open(dest, 'wb') as f:
+            if total:
+                f.truncate(total)
+    else:
+        done = sum(s[2] - s[0] for s in state["segments"])
+        logger.info(f"续传 {dest.name}: 已完成 {done}/{total} 字节")
+
+    progress = _Progress(state_file, state)
+    progress.flush()
+
+    segments = state["segments"]
+    logger.info(f"开始下载 {dest.name}: {total} 字节，{len(segments)} 段，Range={'是' if ranged else '否'}")
+    errors = []
+    parent_ref = tracing.current_ref()
+
+    def worker(index):
+        try:
+            start, end, _ = segments[index]
+            with tracing.bind(parent_ref), \
+                 tracing.span(f"segment {index}", cat="http", range=f"{start}-{end}"):
+                _fetch_segment(session, source, dest, index, progress, resolve_again)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(len(segments))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    progress.flush()
+
+    if errors:
+        # 保留文件和进度，下次调用从断点续传
+        raise DownloadError(f"{dest.name} 下载未完成: {errors[0]}")
+
+    # 完整性校验
+    expected = [("sha256", expected_sha256), ("md5", state.get("md5"))]
+    for algorithm, value in expected:
+        if value:
+            with tracing.span(f"verify {algorithm}", cat="parse"):
+                actual = _file_digest(dest, algorithm)
+            if actual != value:
+                dest.unlink()
+                state_file.unlink()
+                raise DownloadError(f"{dest.name} {algorithm} 校验失败: {actual} != {value}")
+            logger.info(f"{dest.name} {algorithm} 校验通过")
+            break
+
+    state_file.unlink()
+
+
+def fetch_head(url, max_bytes, session=None):
+    """
+    只读取文件开头的 max_bytes 字节，返回 (数据, 文件总大小)；总大小未知时为 None
+    支持 Range 时只请求这一段，否则读够 max_bytes 后断开连接
+    """
+    import requests
+    session = session or requests.Session()
+    with tracing.span("fetch_head", cat="download", bytes=max_bytes):
+        target, headers, auth = _locate(session, url)
+        resp = session.get(target, headers={**headers, "Range": f"bytes=0-{max_bytes - 1}"}, auth=auth,
+                           stream=True, timeout=(CONNECT_TIMEOUT, STALL_TIMEOUT))
+        try:
+            # 4xx / 5xx 抛出 HTTPError，由 errors.classify 按状态码分类
+            resp.raise_for_status()
+            if resp.status_code not in (200, 206):
+                raise DownloadError(f"读取文件开头失败 ({resp.status_code}): {target}")
+            if resp.status_code == 206:
+                total = int(resp.headers["Content-Range"].rsplit("/", 1)[1])
+            else:
+                total = int(resp.headers.get("Content-Length", 0)) or None
+            data = bytearray()
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                data += chunk
+                if len(data) >= max_bytes:
+                    break
+        finally:
+            resp.close()
+    metrics.add_bytes("download", len(data))
+    return bytes(data[:max_bytes]), total
+
+
+def extract_archive(archive, target_dir):
+    """解压 tar / zip，与 kaggle cli 的 --untar --unzip 一致，解压后删除压缩包"""
+    archive, target_dir = Path(archive), Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    with tracing.span("extract", cat="parse", file=archive.name):
+        _extract(archive, target_dir)
+
+
+def _extract(archive, target_dir):
+    if tarfile.is_tarfile(archive):
+        with tarfile.open(archive) as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(target_dir, filter="data")
+            else:
+                tar.extractall(target_dir)
+    elif zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            zf.extractall(target_dir)
+    else:
+        # 非压缩文件，原样放入目标目录
+        os.replace(archive, target_dir / archive.name)
+        return
+    archive.unlink()
+
+
+def download_and_extract(url, cache_name, target_dir, expected_sha256=None):
+    archive = download_file(url, DOWNLOAD_CACHE_DIR / cache_name, expected_sha256)
+    extract_archive(archive, target_dir)
+    return target_dir
@@ -0,0 +1,264 @@
+"""
+数据集采样模式 (--content sample)：只取文件结构与内容样本，不下载完整压缩包
+
+下游需要的是文件结构、字段与内容示例 (见 data_request.md)，而不一定是完整数据。采样模式下:
+- 不超过 FULL_UNDER 的数据集仍完整下载 (与 --content full 相同)
+- 更大的 (或大小未知的) 数据集按 get_file_explorer 的文件列表，按类型和大小选出最多 MAX_FILES 个文件:
+  - CSV / TSV / JSONL：只读取开头 HEAD_BYTES 字节 (支持 Range 时只请求这一段)，
+    解析出表头、前 SAMPLE_ROWS 行与各列类型，行数按已读部分的平均行长估算
+  - JSON / SQLite / Parquet：开头无法单独解析，不超过 WHOLE_FILE_MAX 时整文件下载，行数为精确值
+  - 其他类型 (图片、音频等) 只保留文件列表
+- 结果写入数据集目录下的 SAMPLE_FILE，与完整下载一样带完成哨兵 (content=sample)、按原流程上传
+
+单个文件较大时 Kaggle 会返回压缩后的 zip：完整时按 zip 读取，只有开头时按本地文件头解压开头的数据
+pandas 只在解析时导入
+"""
+import io
+import json
+import zlib
+import struct
+import sqlite3
+import logging
+import zipfile
+import tempfile
+from pathlib import Path
+
+import errors
+import scheduler
+
+logger = logging.getLogger("main.sampler")
+
+MODE = "full"                       # full / sample
+SAMPLE_ROWS = 100
+FULL_UNDER = 100 * 1024 ** 2        # 不超过该大小的数据集仍完整下载
+HEAD_BYTES = 1024 ** 2              # CSV / JSONL 读取的开头字节数
+WHOLE_FILE_MAX = 20 * 1024 ** 2     # JSON / SQLite / Parquet 整文件下载的大小上限
+MAX_FILES = 20                      # 每个数据集最多采样的文件数
+SAMPLE_FILE = "_SAMPLE.json"
+
+KINDS = {".csv": "csv", ".tsv": "tsv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "json",
+         ".sqlite": "sqlite", ".sqlite3": "sqlite", ".db": "sqlite", ".parquet": "parquet"}
+HEAD_KINDS = ("csv", "tsv", "jsonl")    # 开头的若干行即可解析
+SEPARATORS = {"csv": ",", "tsv": "\t"}
+
+
+def configure(mode=None, rows=None, full_under=None):
+    """修改采样模式、样本行数与完整下载的大小上限 (字节数)，为空时保持默认"""
+    global MODE, SAMPLE_ROWS, FULL_UNDER
+    if mode is not None:
+        MODE = mode
+    if rows is not None:
+        SAMPLE_ROWS = rows
+    if full_under is not None:
+        FULL_UNDER = full_under
+
+
+def wants_sample(row):
+    """列表行对应的数据集是否采样；大小未知时按大数据集处理"""
+    if MODE != "sample":
+        return False
+    size = scheduler.size_of(row)
+    return size is None or size > FULL_UNDER
+
+
+def _file_size(text):
+    try:
+        return scheduler.parse_size(text)
+    except ValueError:
+        return None
+
+
+def pick_files(files):
+    """
+    从 get_file_explorer 的结果中选出要采样的文件 [(文件名, 类型, 大小), ...]
+    可以只读开头的类型优先，同类中大文件优先 (通常是主表)；整文件类型只选大小已知且不超过 WHOLE_FILE_MAX 的
+    """
+    picked = []
+    for f in files:
+        name = f.get("FileName") or ""
+        kind = KINDS.get(Path(name).suffix.lower())
+        if not kind:
+            continue
+        size = _file_size(f.get("Size"))
+        if kind not in HEAD_KINDS and (size is None or size > WHOLE_FILE_MAX):
+            continue
+        picked.append((kind not in HEAD_KINDS, -(size or 0), name, kind, size))
+    picked.sort()
+    return [(name, kind, size) for _, _, name, kind, size in picked[:MAX_FILES]]
+
+
+# ================= 读取 =================
+
+def _unzip(data, complete, limit):
+    """Kaggle 返回 zip 时取出其中第一个文件的内容；返回 (数据, 是否完整)"""
+    if not data.startswith(b"PK\x03\x04"):
+        return data, complete
+    if complete:
+        with zipfile.ZipFile(io.BytesIO(data)) as zf, zf.open(zf.namelist()[0]) as f:
+            out = f.read(limit + 1)
+        return out[:limit], len(out) <= limit
+    # 只有开头时没有中央目录，按第一个条目的本地文件头解压
+    fields = struct.unpack("<IHHHHHIIIHH", data[:30])
+    method, name_len, extra_len = fields[3], fields[9], fields[10]
+    payload = data[30 + name_len + extra_len:]
+    if method == zipfile.ZIP_STORED:
+        return payload[:limit], False
+    if method == zipfile.ZIP_DEFLATED:
+        return zlib.decompressobj(-15).decompress(payload, limit), False
+    raise ValueError(f"不支持的 zip 压缩方式: {method}")
+
+
+def _complete_lines(data, complete):
+    """解码为文本；不完整时丢弃被截断的最后一行"""
+    text = data.decode("utf-8", errors="replace")
+    if not complete:
+        text = text[:text.rfind("\n") + 1]
+    return text
+
+
+def _row_count(rows, used_bytes, header_bytes, size, complete):
+    """完整读取时为精确行数，否则按已读部分的平均行长估算"""
+    if complete or not rows or not size:
+        return {"RowCount": rows if complete else None, "RowCountEstimated": not complete}
+    per_row = (used_bytes - header_bytes) / rows
+    return {"RowCount": int((size - header_bytes) / per_row), "RowCountEstimated": True}
+
+
+def _frame_summary(df):
+    return {
+        "Columns": [str(c) for c in df.columns],
+        "Dtypes": {str(c): str(t) for c, t in df.dtypes.items()},
+        "Rows": json.loads(df.head(SAMPLE_ROWS).to_json(orient="values", date_format="iso",
+                                                          default_handler=str)),
+    }
+
+
+def _parse_delimited(data, kind, complete, size):
+    import pandas as pd
+    text = _complete_lines(data, complete)
+    # 引号内的换行可能让截断处落在字段中间，逐行回退后重试
+    for _ in range(3):
+        try:
+            df = pd.read_csv(io.StringIO(text), sep=SEPARATORS[kind], low_memory=False)
+            break
+        except pd.errors.ParserError:
+            if complete or "\n" not in text.rstrip("\n"):
+                raise
+            text = text[:text.rstrip("\n").rfind("\n") + 1]
+    else:
+        raise ValueError("开头的数据无法解析为表格")
+    summary = _frame_summary(df)
+    header_bytes = len(text.split("\n", 1)[0].encode("utf-8")) + 1
+    summary.update(_row_count(len(df), len(text.encode("utf-8")), header_bytes, size, complete))
+    return summary
+
+
+def _parse_jsonl(data, complete, size):
+    import pandas as pd
+    text = _complete_lines(data, complete)
+    records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    summary = _frame_summary(pd.DataFrame(records))
+    summary.update(_row_count(len(records), len(text.encode("utf-8")), 0, size, complete))
+    return summary
+
+
+def _parse_json(data):
+    import pandas as pd
+    obj = json.loads(data.decode("utf-8"))
+    if isinstance(obj, list) and obj and all(isinstance(x, dict) for x in obj[:SAMPLE_ROWS]):
+        summary = _frame_summary(pd.DataFrame(obj[:SAMPLE_ROWS]))
+        summary.update(RowCount=len(obj), RowCountEstimated=False)
+        return summary
+    # 非表格结构只记录顶层类型与键
+    summary = {"Structure": type(obj).__name__}
+    if isinstance(obj, dict):
+        summary["Keys"] = list(obj)[:SAMPLE_ROWS]
+    elif isinstance(obj, list):
+        summary.update(RowCount=len(obj), Rows=obj[:SAMPLE_ROWS])
+    return summary
+
+
+def _parse_sqlite(data):
+    tables = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "sample.sqlite"
+        path.write_bytes(data)
+        conn = sqlite3.connect(path)
+        try:
+            names = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            for name in names:
+                quoted = '"' + name.replace('"', '""') + '"'
+                columns = conn.execute(f"PRAGMA table_info({quoted})").fetchall()
+                rows = conn.execute(f"SELECT * FROM {quoted} LIMIT ?", (SAMPLE_ROWS,)).fetchall()
+                tables[name] = {
+                    "Columns": [c[1] for c in columns],
+                    "Dtypes": {c[1]: c[2] for c in columns},
+                    "Rows": [[v if not isinstance(v, bytes) else f"<{len(v)} bytes>" for v in r] for r in rows],
+                    "RowCount": conn.execute(f"SELECT COUNT(*) FROM {quoted}").fetchone()[0],
+                    "RowCountEstimated": False,
+                }
+        finally:
+            conn.close()
+    return {"Tables": tables}
+
+
+def _parse_parquet(data):
+    import pandas as pd
+    # 需要 pyarrow 或 fastparquet，未安装时抛出 ImportError，记录在该文件的 Error 中
+    df = pd.read_parquet(io.BytesIO(data))
+    summary = _frame_summary(df)
+    summary.update(RowCount=len(df), RowCountEstimated=False)
+    return summary
+
+
+def parse_file(name, kind, size, data, total):
+    """解析 fetch 读到的数据 (完整文件或开头)，返回该文件的样本；total 为 fetch 返回的文件总大小"""
+    limit = HEAD_BYTES if kind in HEAD_KINDS else WHOLE_FILE_MAX
+    entry = {"FileName": name, "Size": size or total, "Type": kind, "BytesRead": len(data)}
+    complete = len(data) < limit or (total is not None and len(data) >= total)
+    data, complete = _unzip(data, complete, limit)
+    if kind in SEPARATORS:
+        entry.update(_parse_delimited(data, kind, complete, entry["Size"]))
+    elif kind == "jsonl":
+        entry.update(_parse_jsonl(data, complete, entry["Size"]))
+    elif not complete:
+        raise ValueError(f"超过 {WHOLE_FILE_MAX} 字节，无法整文件解析")
+    elif kind == "json":
+        entry.update(_parse_json(data))
+    elif kind == "sqlite":
+        entry.update(_parse_sqlite(data))
+    else:
+        entry.update(_parse_parquet(data))
+    return entry
+
+
+def sample_dataset(ref, files, fetch):
+    """
+    采样一个数据集，返回写入 SAMPLE_FILE 的内容
+    fetch(文件名, 最多字节数, 列表中的大小) 返回 (数据, 文件总大小)，由 get_data 负责下载与重试
+    单个文件不存在或解析失败时记录在该文件的 Error 中，继续其他文件；网络错误与限流向上抛出，由重试 / 重新排队处理
+    """
+    picked = pick_files(files)
+    samples = []
+    for name, kind, size in picked:
+        try:
+            data, total = fetch(name, HEAD_BYTES if kind in HEAD_KINDS else WHOLE_FILE_MAX, size)
+        except Exception as e:
+            if errors.classify(e) not in errors.PERMANENT:
+                raise
+            logger.warning(f"[{ref}] 无法读取 {name}: {e}")
+            samples.append({"FileName": name, "Size": size, "Type": kind, "Error": str(e)})
+            continue
+        try:
+            samples.append(parse_file(name, kind, size, data, total))
+        except Exception as e:
+            logger.warning(f"[{ref}] 解析 {name} 失败: {e}")
+            samples.append({"FileName": name, "Size": size, "Type": kind, "BytesRead": len(data), "Error": str(e)})
+    picked_names = {name for name, _, _ in picked}
+    logger.info(f"[{ref}] 采样 {len(picked)}/{len(files)} 个文件，读取 {sum(s.get('BytesRead', 0) for s in samples)} 字节")
+    return {
+        "Ref": ref,
+        "SampleRows": SAMPLE_ROWS,
+        "Files": samples,
+        "Unsampled": [f.get("FileName") for f in files if f.get("FileName") not in picked_names],
+    }
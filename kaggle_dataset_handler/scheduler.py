@@ -0,0 +1,179 @@
+"""
+按数据集大小调度下载，避免一个大数据集拖住整页 (队头阻塞)
+
+列表中已经给出每个数据集的 size:
+- 不超过 LARGE_SIZE 的条目走快速通道：在本页线程池中从小到大提交，下载受 concurrency.DOWNLOADS 限制
+- 更大的条目走大文件通道：LARGE_WORKERS 个独立的工作线程，跨页从小到大取任务，
+  同时下载的总字节数不超过 BYTE_BUDGET (单个超过预算的条目在通道空闲时单独下载)；不占用快速通道的下载名额
+- 大小未知 (缺失、0 或无法解析) 的条目按小条目处理，排在本页最后
+
+页面在快速通道完成后就写出 JSONL；仍在下载的大条目继续进行，完成后的记录并入之后的写出 (collect)
+"""
+import re
+import heapq
+import logging
+import threading
+import itertools
+
+import errors
+import metrics
+import tracing
+import deadline
+
+logger = logging.getLogger("main.scheduler")
+
+GB = 1024 ** 3
+LARGE_SIZE = 1 * GB         # 超过该大小的条目走大文件通道
+BYTE_BUDGET = 20 * GB       # 大文件通道同时下载的总字节数上限
+LARGE_WORKERS = 2
+
+_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": GB, "TB": 1024 ** 4}
+_SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?B?)\s*$", re.IGNORECASE)
+
+
+def parse_size(text):
+    """解析 "5MB"、"1.2 GB"、"123456" 等写法 (kaggle-cli 按 1024 进位)，返回字节数；无法解析时抛出 ValueError"""
+    match = _SIZE_RE.match(str(text))
+    if not match:
+        raise ValueError(f"无法解析的大小: {text}")
+    unit = match.group(2).upper()
+    if unit and not unit.endswith("B"):
+        unit += "B"
+    return int(float(match.group(1)) * _UNITS[unit])
+
+
+def size_of(row):
+    """列表行的字节数；新版 kaggle-cli 另有 totalBytes 列，Meta Kaggle 队列为整数字节；未知时返回 None"""
+    for column in ("totalBytes", "size"):
+        try:
+            size = parse_size(row.get(column, ""))
+        except ValueError:
+            continue
+        if size > 0:
+            return size
+    return None
+
+
+def split(rows):
+    """按大小分为 (快速通道, 大文件通道) 两组，各自从小到大排序，大小未知的排在快速通道最后"""
+    small, large = [], []
+    for row in rows:
+        size = size_of(row)
+        if size is not None and size > LARGE_SIZE:
+            large.append((size, row))
+        else:
+            small.append((float("inf") if size is None else size, row))
+    small.sort(key=lambda pair: pair[0])
+    large.sort(key=lambda pair: pair[0])
+    return [row for _, row in small], [row for _, row in large]
+
+
+class LargeLane:
+    """大文件通道：跨页共用的工作线程，按 (大小, 提交顺序) 取任务，受字节预算约束"""
+
+    def __init__(self, workers, byte_budget):
+        self.workers = workers
+        self.byte_budget = byte_budget
+        self._cond = threading.Condition()
+        self._heap = []                 # (size, seq, page, row, task, requeued, queued_at)
+        self._seq = itertools.count()
+        self._threads = []
+        self._in_flight_bytes = 0
+        self._pages = {}                # 页码 -> 未完成的条目数
+        self._done = []                 # 完成但尚未写出的 (页码, 记录)
+
+    def _ensure_started(self):
+        # 调用方持有 self._cond；首次提交时才启动线程，导入模块没有副作用
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"large-lane-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, page, row, task):
+        """task(row, queued_at) 返回记录或 None"""
+        with self._cond:
+            self._push(page, row, task, requeued=False)
+            self._pages[page] = self._pages.get(page, 0) + 1
+            self._ensure_started()
+
+    def _push(self, page, row, task, requeued):
+        # 调用方持有 self._cond
+        heapq.heappush(self._heap, (size_of(row), next(self._seq), page, row, task, requeued, tracing.now()))
+        self._cond.notify_all()
+
+    def _fits(self, size):
+        return self._in_flight_bytes == 0 or self._in_flight_bytes + size <= self.byte_budget
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                # 最小的任务放不进预算时，更大的也放不进，等正在下载的完成
+                while not self._heap or not self._fits(self._heap[0][0]):
+                    self._cond.wait()
+                size, _, page, row, task, requeued, queued_at = heapq.heappop(self._heap)
+                self._in_flight_bytes += size
+            try:
+                self._run(size, page, row, task, requeued, queued_at)
+            finally:
+                with self._cond:
+                    self._in_flight_bytes -= size
+                    self._cond.notify_all()
+
+    def _run(self, size, page, row, task, requeued, queued_at):
+        ref = row["ref"]
+        record = None
+        try:
+            logger.info(f"[大文件通道] 开始 {ref} ({size / GB:.1f}GB，第 {page} 页)")
+            record = task(row, queued_at)
+        except deadline.DeadlineExceeded as e:
+            if not requeued:
+                logger.warning(f"{ref} 超时，重新排队: {e}")
+                metrics.inc("kaggle_requeued_total", reason="deadline")
+                with self._cond:
+                    self._push(page, row, task, requeued=True)
+                return
+            logger.error(f"{ref} 重新排队后仍然超时: {e}")
+        except Exception as e:
+            kind = errors.classify(e)
+            if kind in errors.PERMANENT:
+                logger.warning(f"跳过 {ref}: {errors.LABELS[kind]} ({e})")
+            else:
+                logger.error(f"处理 {ref} 时发生未知错误: {e}")
+        with self._cond:
+            if record:
+                self._done.append((page, record))
+            self._pages[page] -= 1
+            if not self._pages[page]:
+                del self._pages[page]
+            self._cond.notify_all()
+
+    def collect(self):
+        """取出已完成、尚未写出的 (页码, 记录)"""
+        with self._cond:
+            done, self._done = self._done, []
+        return done
+
+    def outstanding_pages(self):
+        """仍有大条目未完成的页码"""
+        with self._cond:
+            return set(self._pages)
+
+    def wait_all(self):
+        """等待所有已提交的大条目完成"""
+        with self._cond:
+            while self._pages:
+                self._cond.wait()
+
+
+LARGE = LargeLane(LARGE_WORKERS, BYTE_BUDGET)
+
+
+def configure(large_size=None, byte_budget=None):
+    """修改大文件通道的分流阈值与字节预算 (字节数)，为空时保持默认"""
+    global LARGE_SIZE
+    if large_size is not None:
+        LARGE_SIZE = large_size
+    if byte_budget is not None:
+        with LARGE._cond:
+            LARGE.byte_budget = byte_budget
+            LARGE._cond.notify_all()
@@ -0,0 +1,26 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# 处理器内的模块按同目录的模块名互相导入 (import staging)，测试时同样把处理器目录加入搜索路径
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    """moto 模拟的对象存储；upload 的配置与客户端都指向它，工作目录切到 tmp_path"""
+    moto = pytest.importorskip("moto")
+    import boto3
+    import upload
+    monkeypatch.chdir(tmp_path)
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="a", aws_secret_access_key="b")
+        client.create_bucket(Bucket=BUCKET)
+        monkeypatch.setattr(upload, "get_oss_config",
+                            lambda: {"BUCKET_NAME": BUCKET, "OSS_PREFIX": "t", "ENDPOINT_URL": None})
+        monkeypatch.setattr(upload, "oss_client", lambda: client)
+        yield client
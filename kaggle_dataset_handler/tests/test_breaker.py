@@ -0,0 +1,42 @@
+import pytest
+
+import breaker
+import deadline
+import errors
+
+
+@pytest.fixture(autouse=True)
+def closed_breaker(monkeypatch):
+    """每个测试使用关闭状态的熔断器，阈值为 2"""
+    monkeypatch.setattr(breaker, "_threshold", 2)
+    breaker._state.update(state=breaker.CLOSED, failures=0, opened_at=None, probing=False)
+    yield
+    breaker._state.update(state=breaker.CLOSED, failures=0, opened_at=None, probing=False)
+
+
+def _fail(error):
+    return breaker.record_failure(errors.classify(error), error)
+
+
+def test_download_deadline_does_not_open_breaker():
+    for _ in range(5):
+        assert not _fail(deadline.DeadlineExceeded("下载超时", op="download"))
+    assert not breaker.is_open()
+
+    # 下载超时也不清零其他网络错误的连续计数
+    assert not _fail(ConnectionError("Connection reset by peer"))
+    assert not _fail(deadline.DeadlineExceeded("下载超时", op="download"))
+    assert _fail(ConnectionError("Connection reset by peer"))
+    assert breaker.is_open()
+
+
+def test_api_deadline_counts_as_network_error():
+    assert not _fail(deadline.DeadlineExceeded("请求超时", op="api"))
+    assert _fail(deadline.DeadlineExceeded("请求超时", op="api"))
+    assert breaker.is_open()
+
+
+def test_timeout_carries_operation():
+    error = deadline._timeout("download", "kaggle datasets download a/b", 1, "已终止")
+    assert isinstance(error, errors.TransientError)
+    assert error.op == "download"
@@ -0,0 +1,104 @@
+import io
+import random
+
+import pytest
+
+import chunking
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    """缩小块长与掩码，几百 KB 的数据即可切出几十个块"""
+    monkeypatch.setattr(chunking, "MIN_CHUNK", 1024)
+    monkeypatch.setattr(chunking, "MAX_CHUNK", 16 * 1024)
+    monkeypatch.setattr(chunking, "MASK_BITS", 12)
+    monkeypatch.setattr(chunking, "MASK", ((1 << 12) - 1) << (32 - 12))
+
+
+def _data(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def _write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def test_cut_points_do_not_depend_on_segment(tmp_path, monkeypatch):
+    data = _data(300_000)
+    path = _write(tmp_path, "a.bin", data)
+    results = []
+    for segment in (1000, 4096, 65_537, 1 << 20):
+        monkeypatch.setattr(chunking, "SEGMENT", segment)
+        results.append(chunking.cut_points(str(path), len(data)))
+    assert all(r == results[0] for r in results)
+    chunks = results[0]
+    assert len(chunks) > 10
+    assert sum(length for _, length in chunks) == len(data)
+    assert all(length <= chunking.MAX_CHUNK for _, length in chunks)
+    assert all(length >= chunking.MIN_CHUNK for _, length in chunks[:-1])
+
+
+def test_insertion_only_changes_nearby_chunks(tmp_path):
+    data = _data(300_000)
+    edited = data[:150_000] + b"inserted bytes" * 10 + data[150_000:]
+    before = chunking.chunk_file(_write(tmp_path, "a.bin", data))
+    after = chunking.chunk_file(_write(tmp_path, "b.bin", edited))
+
+    # 插入点之前的块不变；之后的块重新同步，只有附近的一两个块不同
+    offset = 0
+    for (digest, length), new in zip(before, after):
+        if offset + length > 150_000:
+            break
+        assert new == [digest, length]
+        offset += length
+    old_digests = {d for d, _ in before}
+    changed = [c for c in after if c[0] not in old_digests]
+    assert 1 <= len(changed) <= 3
+    assert after[-1] == before[-1]
+
+
+def _store(path):
+    data = path.read_bytes()
+    chunks = chunking.chunk_file(path)
+    store, offset = {}, 0
+    for digest, length in chunks:
+        store[digest] = data[offset:offset + length]
+        offset += length
+    return data, chunks, store
+
+
+def test_chunk_reader_reassembles_with_seek(tmp_path):
+    data, chunks, store = _store(_write(tmp_path, "a.bin", _data(100_000)))
+    fetched = []
+
+    def fetch(digest):
+        fetched.append(digest)
+        return store[digest]
+
+    reader = chunking.ChunkReader(chunks, fetch)
+    assert reader.read() == data
+
+    buffered = io.BufferedReader(chunking.ChunkReader(chunks, store.__getitem__), buffer_size=777)
+    rng = random.Random(1)
+    for _ in range(50):
+        start = rng.randrange(len(data))
+        length = rng.randrange(1, 20_000)
+        buffered.seek(start)
+        assert buffered.read(length) == data[start:start + length]
+    buffered.seek(-10, io.SEEK_END)
+    assert buffered.read() == data[-10:]
+    assert buffered.read() == b""
+    # 顺序读取时每个块只取回一次
+    assert len(fetched) == len(chunks)
+
+
+def test_chunk_reader_detects_digest_mismatch(tmp_path):
+    data, chunks, store = _store(_write(tmp_path, "a.bin", _data(100_000)))
+    digest, length = chunks[1]
+    store[digest] = bytes(length)
+    reader = chunking.ChunkReader(chunks, store.__getitem__)
+    assert reader.read(chunks[0][1]) == data[:chunks[0][1]]
+    with pytest.raises(IOError, match=digest):
+        reader.read(1)
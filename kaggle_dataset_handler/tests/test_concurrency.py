@@ -0,0 +1,95 @@
+import pytest
+
+import concurrency
+
+
+class _Clock:
+    """替换 concurrency 中的 time，测试里手动推进"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(concurrency, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def limiter(clock):
+    # 按工作量计吞吐，测试可以控制每个窗口的吞吐
+    work = {"done": 0}
+    limiter = concurrency.AdaptiveLimiter("test", initial=8, floor=1, ceiling=10,
+                                          throughput=lambda: work["done"])
+    limiter.work = work
+    return limiter
+
+
+def _ok(limiter, clock, work=0):
+    with limiter.slot():
+        clock.now += 1
+        limiter.work["done"] += work
+
+
+def _rate_limited(limiter, clock):
+    with pytest.raises(RuntimeError):
+        with limiter.slot():
+            clock.now += 1
+            raise RuntimeError("429 Client Error: Too Many Requests")
+
+
+def _window(limiter, clock, work):
+    # 一个完整的观测窗口：足够的完成次数与时长
+    for _ in range(max(concurrency.WINDOW_MIN_OPS, limiter.limit, concurrency.WINDOW_MIN_SECONDS)):
+        _ok(limiter, clock, work)
+
+
+def test_rate_limit_halves_once_per_cooldown(limiter, clock):
+    _rate_limited(limiter, clock)
+    assert limiter.limit == 4
+
+    # 冷却期内的 429 不再减半
+    _rate_limited(limiter, clock)
+    assert limiter.limit == 4
+
+    clock.now += concurrency.COOLDOWN
+    _rate_limited(limiter, clock)
+    assert limiter.limit == 2
+
+    for _ in range(5):
+        clock.now += concurrency.COOLDOWN
+        _rate_limited(limiter, clock)
+    assert limiter.limit == limiter.floor
+
+
+def test_recovers_after_rate_limit(limiter, clock):
+    _rate_limited(limiter, clock)
+    assert limiter.limit == 4
+
+    # 429 之后响应正常的窗口逐个加 1
+    _window(limiter, clock, work=100)
+    assert limiter.limit == 5
+
+    # 吞吐继续提升时继续加
+    _window(limiter, clock, work=200)
+    assert limiter.limit == 6
+
+    # 加并发后吞吐没有提升，保持一个窗口
+    _window(limiter, clock, work=200)
+    assert limiter.limit == 6
+    _window(limiter, clock, work=200)
+    assert limiter.limit == 7
+
+
+def test_network_errors_shrink_window(limiter, clock):
+    for _ in range(concurrency.WINDOW_MIN_SECONDS):
+        with pytest.raises(ConnectionError):
+            with limiter.slot():
+                clock.now += 1
+                raise ConnectionError("Connection reset by peer")
+    assert limiter.limit == 6
@@ -0,0 +1,101 @@
+import base64
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import range_download
+
+DATA = bytes(range(256)) * 4096     # 1MB
+ETAG = '"v1"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """/api/<名称> 重定向到 /files/<名称>，/files 支持 Range，并在 x-goog-hash 中给出 md5"""
+
+    def do_GET(self):
+        server = self.server
+        if self.path.startswith("/api/"):
+            self.send_response(302)
+            self.send_header("Location", "/files/" + self.path[len("/api/"):])
+            self.end_headers()
+            return
+        server.ranges.append(self.headers.get("Range"))
+        start, end = 0, len(DATA) - 1
+        if self.headers.get("Range"):
+            first, last = self.headers["Range"][len("bytes="):].split("-")
+            start, end = int(first), min(int(last), end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", ETAG)
+        self.send_header("x-goog-hash", "crc32c=AAAAAA==, md5=" + base64.b64encode(server.md5).decode())
+        self.end_headers()
+        self.wfile.write(DATA[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """本地的 Range 下载服务；默认给出正确的 md5"""
+    monkeypatch.setenv("KAGGLE_API_TOKEN", "token")
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.ranges = []
+    httpd.md5 = hashlib.md5(DATA).digest()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}/api/data.zip"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_resume_from_progress_file(server, tmp_path):
+    dest = tmp_path / "data.zip"
+    state_file = tmp_path / "data.zip.progress.json"
+    done = 300_000
+    # 上次运行写了前 done 字节后中断，其余部分是未写入的空洞
+    dest.write_bytes(DATA[:done] + b"\0" * (len(DATA) - done))
+    state_file.write_text(json.dumps({
+        "url": server.url, "size": len(DATA), "etag": ETAG, "md5": hashlib.md5(DATA).hexdigest(),
+        "segments": [[0, len(DATA) - 1, done]],
+    }), encoding="utf-8")
+
+    range_download.download_file(server.url, dest)
+
+    # 探测之后只请求剩余的部分
+    assert server.ranges == ["bytes=0-0", f"bytes={done}-{len(DATA) - 1}"]
+    assert dest.read_bytes() == DATA
+    assert not state_file.exists()
+
+
+def test_changed_etag_restarts_from_zero(server, tmp_path):
+    dest = tmp_path / "data.zip"
+    dest.write_bytes(b"\0" * len(DATA))
+    (tmp_path / "data.zip.progress.json").write_text(json.dumps({
+        "url": server.url, "size": len(DATA), "etag": '"v0"', "md5": None,
+        "segments": [[0, len(DATA) - 1, 500_000]],
+    }), encoding="utf-8")
+
+    range_download.download_file(server.url, dest)
+
+    assert server.ranges == ["bytes=0-0", f"bytes=0-{len(DATA) - 1}"]
+    assert dest.read_bytes() == DATA
+
+
+def test_md5_mismatch_discards_download(server, tmp_path):
+    server.md5 = hashlib.md5(b"other").digest()
+    dest = tmp_path / "data.zip"
+
+    with pytest.raises(range_download.DownloadError, match="md5"):
+        range_download.download_file(server.url, dest)
+
+    # 文件与进度都删除，下次从头下载而不是在损坏的文件上续传
+    assert not dest.exists()
+    assert not (tmp_path / "data.zip.progress.json").exists()
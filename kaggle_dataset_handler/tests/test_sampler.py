@@ -0,0 +1,83 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+import sampler
+
+
+def _csv(rows):
+    # 定宽的行，按平均行长估算的行数应接近精确值
+    lines = ["Id,Name,Score"] + [f"{i:05d},name {i:05d},{i % 10 * 0.5}" for i in range(rows)]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def test_truncated_csv_drops_partial_line(monkeypatch):
+    full = _csv(1000)
+    monkeypatch.setattr(sampler, "HEAD_BYTES", 4000)
+    monkeypatch.setattr(sampler, "SAMPLE_ROWS", 1000)
+    head = full[:4000]
+    assert not head.endswith(b"\n")
+
+    entry = sampler.parse_file("a.csv", "csv", len(full), head, len(full))
+    # 只解析完整的行，被截断的最后一行丢弃
+    complete_rows = head[:head.rfind(b"\n") + 1].count(b"\n") - 1
+    assert entry["Columns"] == ["Id", "Name", "Score"]
+    assert entry["Dtypes"]["Id"] == "int64"
+    assert len(entry["Rows"]) == complete_rows
+    assert entry["Rows"][0] == [0, "name 00000", 0.0]
+    assert entry["Rows"][-1][0] == complete_rows - 1
+    assert entry["BytesRead"] == 4000
+    assert entry["RowCountEstimated"] is True
+    assert abs(entry["RowCount"] - 1000) <= 1
+
+
+def test_complete_csv_has_exact_row_count():
+    full = _csv(30)
+    entry = sampler.parse_file("a.csv", "csv", len(full), full, len(full))
+    assert entry["RowCount"] == 30
+    assert entry["RowCountEstimated"] is False
+
+
+def test_truncated_deflated_zip_head(monkeypatch):
+    full = _csv(5000)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("a.csv", full)
+    archive = buf.getvalue()
+    monkeypatch.setattr(sampler, "HEAD_BYTES", 2000)
+    head = archive[:2000]
+
+    entry = sampler.parse_file("a.csv", "csv", len(full), head, len(archive))
+    assert entry["Columns"] == ["Id", "Name", "Score"]
+    assert entry["Rows"][:2] == [[0, "name 00000", 0.0], [1, "name 00001", 0.5]]
+    assert entry["RowCountEstimated"] is True
+    assert entry["RowCount"] > 0
+
+
+def test_json_over_whole_file_max(monkeypatch):
+    data = json.dumps([{"Id": i, "Text": "x" * 20} for i in range(100)]).encode("utf-8")
+    monkeypatch.setattr(sampler, "WHOLE_FILE_MAX", 500)
+    with pytest.raises(ValueError):
+        sampler.parse_file("a.json", "json", len(data), data[:500], len(data))
+
+    # 不超过上限时整文件解析，行数为精确值
+    monkeypatch.setattr(sampler, "WHOLE_FILE_MAX", len(data) + 1)
+    entry = sampler.parse_file("a.json", "json", len(data), data, len(data))
+    assert entry["RowCount"] == 100
+    assert entry["Columns"] == ["Id", "Text"]
+
+
+def test_sample_dataset_records_parse_errors(monkeypatch):
+    data = json.dumps({"k": "v" * 1000}).encode("utf-8")
+    monkeypatch.setattr(sampler, "WHOLE_FILE_MAX", 500)
+    files = [{"FileName": "a.json", "Size": "400 B"}, {"FileName": "img.png", "Size": "1 KB"}]
+
+    def fetch(name, limit, size):
+        return data[:limit], len(data)
+
+    result = sampler.sample_dataset("owner/ds", files, fetch)
+    assert result["Unsampled"] == ["img.png"]
+    [entry] = result["Files"]
+    assert entry["FileName"] == "a.json" and "Error" in entry
@@ -0,0 +1,79 @@
+import staging
+import upload
+from conftest import BUCKET
+
+
+def _keys(s3):
+    return sorted(o["Key"] for o in s3.list_objects_v2(Bucket=BUCKET).get("Contents", []))
+
+
+def _stage_item(out, name, files, extra=None):
+    item_dir = out / name
+    work_dir = staging.partial_path(item_dir)
+    work_dir.mkdir(parents=True)
+    for rel, data in files.items():
+        (work_dir / rel).write_bytes(data)
+    staging.finalize(work_dir, item_dir, extra or {"ref": name})
+    return item_dir
+
+
+def test_sentinel_is_uploaded_once(s3, tmp_path):
+    out = tmp_path / "out"
+    item_dir = _stage_item(out / "datasets", "a-1", {"train.csv": b"x" * 100})
+
+    upload.upload_files_from_folder(str(out))
+    sentinel_key = f"t/datasets/a-1/{staging.SENTINEL_NAME}"
+    assert _keys(s3) == [sentinel_key, "t/datasets/a-1/train.csv"]
+    assert staging.load_sentinel(item_dir)["uploaded"] is True
+    assert not (item_dir / "train.csv").exists()
+
+    # 之后的调用不再上传已上传过的哨兵，新完成的条目照常上传
+    s3.delete_object(Bucket=BUCKET, Key=sentinel_key)
+    _stage_item(out / "datasets", "b-2", {"test.csv": b"y" * 10})
+    upload.upload_files_from_folder(str(out))
+    assert _keys(s3) == ["t/datasets/a-1/train.csv",
+                         f"t/datasets/b-2/{staging.SENTINEL_NAME}", "t/datasets/b-2/test.csv"]
+    assert staging.is_complete(item_dir)
+
+
+def test_manifest_retry_keeps_chunk_lists(s3, tmp_path, monkeypatch):
+    import random
+    import cas_store
+    import chunking
+    monkeypatch.setattr(cas_store, "_known", None)
+    monkeypatch.setattr(chunking, "CHUNK_THRESHOLD", 50_000)
+    monkeypatch.setattr(chunking, "MIN_CHUNK", 1024)
+    monkeypatch.setattr(chunking, "MAX_CHUNK", 16 * 1024)
+    monkeypatch.setattr(chunking, "MASK_BITS", 12)
+    monkeypatch.setattr(chunking, "MASK", ((1 << 12) - 1) << (32 - 12))
+
+    files = {"big.bin": random.Random(0).randbytes(200_000), "small.txt": b"hello"}
+    out = tmp_path / "out"
+    item_dir = _stage_item(out / "models", "m-1", files)
+
+    # 第一次清单上传失败：本地文件已删除，摘要与分块列表保留在哨兵中
+    put_manifest = cas_store.put_manifest
+
+    def fail(*args, **kwargs):
+        raise ConnectionError("manifest upload failed")
+
+    monkeypatch.setattr(cas_store, "put_manifest", fail)
+    upload.upload_files_from_folder(str(out), dedup=True, chunked=True)
+    assert sorted(p.name for p in item_dir.iterdir()) == [staging.SENTINEL_NAME]
+    sentinel = staging.load_sentinel(item_dir)
+    assert not sentinel.get("manifest_uploaded")
+    assert sentinel["files"]["big.bin"]["chunks"]
+    assert not any(k.startswith("t/manifests/") for k in _keys(s3))
+
+    # 重试只凭哨兵上传清单，之后可以完整还原
+    monkeypatch.setattr(cas_store, "put_manifest", put_manifest)
+    upload.upload_files_from_folder(str(out), dedup=True, chunked=True)
+    assert staging.load_sentinel(item_dir)["manifest_uploaded"] is True
+    manifest = cas_store.get_manifest(s3, BUCKET, "t", "models/m-1")
+    assert len(manifest["files"]["big.bin"]["chunks"]) > 1
+    assert "chunks" not in manifest["files"]["small.txt"]
+
+    restored = tmp_path / "restored"
+    assert cas_store.restore_item(s3, BUCKET, "t", "models/m-1", restored) == 2
+    for rel, data in files.items():
+        assert (restored / rel).read_bytes() == data
@@ -0,0 +1,208 @@
+"""
+自适应并发 (AIMD)：按观测到的吞吐、延迟与 429 调整同时进行的 API 请求数与下载数
+
+- API：同时进行的元数据请求 (list / metadata / files / get / pull)，吞吐按完成次数计
+- DOWNLOADS：同时进行的下载，吞吐按下载字节数 (metrics 的 kaggle_bytes_total) 计
+
+每个限流器在 [floor, ceiling] 之间调整:
+- 出现 429 立即减半 (COOLDOWN 秒内最多一次)
+- 每个观测窗口 (至少 WINDOW_MIN_OPS 次完成且至少 WINDOW_MIN_SECONDS 秒) 结束时:
+  网络错误比例过高，或 (仅 API) 延迟中位数超过基线的 LATENCY_FACTOR 倍时减小；
+  上次加并发后吞吐没有提升时保持一个窗口；否则加 1
+- 下载的耗时取决于压缩包大小，不能反映拥塞，DOWNLOADS 只按网络错误与字节吞吐调整
+- 基线为各窗口延迟中位数的最小值，每个窗口最多上调到原来的 BASELINE_DRIFT 倍，避免早期偶然的低值一直压低基线
+每次调整都打印原因与当时的统计，方便调整上下限；可通过 main.py 的 --api-concurrency / --download-concurrency 设置
+
+同一线程内嵌套获取同一个限流器 (如下载时回退到 kaggle cli) 不会重复占用名额
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import errors
+import metrics
+import tracing
+import deadline
+
+logger = logging.getLogger("main.concurrency")
+
+WINDOW_MIN_OPS = 5
+WINDOW_MIN_SECONDS = 10
+COOLDOWN = 10               # 两次因 429 减半之间的最短间隔
+LATENCY_FACTOR = 2.0        # 延迟中位数超过基线的倍数时视为拥塞
+BASELINE_DRIFT = 1.1        # 每个窗口基线最多上调的倍数
+ERROR_RATIO = 0.2           # 窗口内网络错误比例超过该值时减小
+IMPROVEMENT = 1.05          # 加并发后吞吐至少提升 5% 才继续加
+
+
+class AdaptiveLimiter:
+    def __init__(self, name, initial, floor, ceiling, throughput=None):
+        """throughput 为返回累计工作量的函数 (如已下载字节数)，为空时按完成次数计算吞吐"""
+        self.name = name
+        self.floor = floor
+        self.ceiling = ceiling
+        self.limit = max(floor, min(initial, ceiling))
+        self._throughput = throughput
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._in_flight = 0
+        self._baseline = None           # 各窗口延迟中位数的最小值 (逐窗口衰减)；只用于按次数计吞吐的限流器
+        self._last_change = None        # 上一个窗口的动作: "up" / "hold" / "down"
+        self._last_rate = None
+        self._last_decrease = 0.0
+        self._reset_window()
+
+    def configure(self, floor=None, ceiling=None):
+        with self._cond:
+            if floor is not None:
+                self.floor = floor
+            if ceiling is not None:
+                self.ceiling = ceiling
+            self.floor = min(self.floor, self.ceiling)
+            self.limit = max(self.floor, min(self.limit, self.ceiling))
+            self._cond.notify_all()
+
+    # ================= 名额 =================
+
+    @contextmanager
+    def slot(self):
+        """占用一个名额直到退出；异常按 errors.classify 分类参与调整"""
+        depth = getattr(self._local, "depth", 0)
+        if depth:
+            # 同一线程已持有名额
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+
+        waiting = tracing.now()
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+        tracing.record_wait(f"{self.name}_slot_wait", waiting)
+        self._local.depth = 1
+        started = time.time()
+        kind = None
+        try:
+            yield
+        except Exception as e:
+            kind = errors.classify(e)
+            raise
+        finally:
+            self._local.depth = 0
+            with self._cond:
+                self._in_flight -= 1
+                self._record(time.time() - started, kind)
+                self._cond.notify_all()
+
+    # ================= 调整 =================
+
+    def _work_done(self):
+        return self._throughput() if self._throughput else self._window["ops"]
+
+    def _reset_window(self):
+        self._window = {"started": time.time(), "ops": 0, "errors": 0, "rate_limited": 0, "latencies": []}
+        self._window["work_start"] = self._throughput() if self._throughput else 0
+
+    def _set_limit(self, new, reason, stats=""):
+        old, self.limit = self.limit, max(self.floor, min(new, self.ceiling))
+        if self.limit == old:
+            return
+        direction = "up" if self.limit > old else "down"
+        metrics.inc("kaggle_concurrency_changes_total", limiter=self.name, direction=direction)
+        logger.info(f"[并发] {self.name}: {old} -> {self.limit}，{reason}{stats}")
+
+    def _record(self, latency, kind):
+        # 调用方持有 self._cond
+        window = self._window
+        window["ops"] += 1
+        if kind == errors.RATE_LIMITED:
+            window["rate_limited"] += 1
+            now = time.time()
+            if now - self._last_decrease >= COOLDOWN:
+                self._last_decrease = now
+                self._set_limit(self.limit // 2, "出现 429，减半")
+                self._last_change = "down"
+                self._reset_window()
+            return
+        if kind == errors.TRANSIENT:
+            window["errors"] += 1
+        elif kind is None:
+            window["latencies"].append(latency)
+
+        elapsed = time.time() - window["started"]
+        if window["ops"] < max(WINDOW_MIN_OPS, self.limit) or elapsed < WINDOW_MIN_SECONDS:
+            return
+        self._evaluate(elapsed)
+        self._reset_window()
+
+    def _evaluate(self, elapsed):
+        window = self._window
+        latencies = sorted(window["latencies"])
+        p50 = latencies[len(latencies) // 2] if latencies else None
+        rate = (self._work_done() - window["work_start"]) / elapsed
+        # 与本窗口之前的基线比较，之后再更新基线
+        baseline = self._baseline
+        if p50 is not None and not self._throughput:
+            self._baseline = p50 if baseline is None else min(baseline * BASELINE_DRIFT, p50)
+        unit = "B/s" if self._throughput else "次/s"
+        shown = "" if baseline is None else f"基线 {round(baseline, 2)}s，"
+        stats = (f" (窗口 {window['ops']} 次，p50 {p50 if p50 is None else round(p50, 2)}s，{shown}"
+                 f"吞吐 {rate:.1f}{unit}，网络错误 {window['errors']})")
+
+        if window["errors"] / window["ops"] > ERROR_RATIO:
+            self._set_limit(int(self.limit * 0.75), "网络错误比例过高，减小", stats)
+            self._last_change = "down"
+        elif p50 is not None and baseline is not None and p50 > baseline * LATENCY_FACTOR:
+            self._set_limit(self.limit - 1, "延迟明显上升，减 1", stats)
+            self._last_change = "down"
+        elif (self._last_change == "up" and self._last_rate is not None
+              and rate < self._last_rate * IMPROVEMENT):
+            # 上次加并发没有带来吞吐提升，保持一个窗口再试
+            logger.debug(f"[并发] {self.name}: 保持 {self.limit}，加并发后吞吐没有提升{stats}")
+            self._last_change = "hold"
+        elif self.limit < self.ceiling:
+            self._set_limit(self.limit + 1, "响应正常，加 1", stats)
+            self._last_change = "up"
+        else:
+            self._last_change = "hold"
+        self._last_rate = rate
+
+
+def _downloaded_bytes():
+    return metrics.total("kaggle_bytes_total", stage="download", direction="down")
+
+
+API = AdaptiveLimiter("api", initial=4, floor=1, ceiling=12)
+DOWNLOADS = AdaptiveLimiter("download", initial=2, floor=1, ceiling=6, throughput=_downloaded_bytes)
+
+
+def configure(api=None, download=None):
+    """api / download 为 (下限, 上限)，为空时保持默认"""
+    if api:
+        API.configure(*api)
+    if download:
+        DOWNLOADS.configure(*download)
+
+
+def parse_bounds(text):
+    """解析命令行的 "下限:上限"，如 1:12"""
+    floor, _, ceiling = text.partition(":")
+    floor, ceiling = int(floor), int(ceiling or floor)
+    if not 1 <= floor <= ceiling:
+        raise ValueError(f"并发范围无效: {text}")
+    return floor, ceiling
+
+
+def for_cmd(cmd):
+    """kaggle 命令对应的限流器：下载类命令 (download / output) 用 DOWNLOADS，其余用 API"""
+    return DOWNLOADS if deadline.op_for(cmd) == "download" else API
+
+
+def pool_size():
+    """线程池大小：足够让两类限流器都达到上限，多出的线程在名额上等待"""
+    return API.ceiling + DOWNLOADS.ceiling
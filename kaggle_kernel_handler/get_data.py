@@ -8,6 +8,16 @@ import re
 import csv
 from pathlib import Path
 from io import StringIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import staging
+import meta_listing
+import metrics
+import tracing
+import errors
+import breaker
+import deadline
+import concurrency
 
 # 获取 main.py 定义的子 Logger
 logger = logging.getLogger("main.downloader")
@@ -27,37 +37,60 @@ R_LIBRARY_RE = re.compile(r'(?:library|require)\s*\(\s*["\']?([a-zA-Z0-9_\.]+)["
 def run_cmd_with_retry(cmd, max_retries=3):
     """
     执行 Shell 命令，带有随机等待的重试机制
+    按 errors.classify 的类别决定是否重试：404 / 403 等直接抛出并记入负缓存，限流时等待更久；
+    超时 (DeadlineExceeded) 直接抛出，由 process_page 重新排队
+    熔断打开期间的失败不计入重试次数，挂起到 Kaggle 恢复后继续
     """
-    for attempt in range(1, max_retries + 1):
+    key = errors.command_key(cmd)
+    errors.check(key)
+    attempt = 0
+    while True:
+        breaker.wait()
+        attempt += 1
         try:
-            # capture_output=True 在 Python 3.7+ 可用
-            result = subprocess.run(
-                cmd, 
-                shell=True, 
-                check=True, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8' # 强制 utf-8
-            )
+            # capture_output=True 在 Python 3.7+ 可用；并发名额按命令类别 (元数据请求 / 下载) 自适应调整
+            with concurrency.for_cmd(cmd).slot(), \
+                 tracing.span(tracing.cmd_name(cmd), cat="cmd", cmd=tracing.short(cmd), attempt=attempt):
+                # 按操作 (元数据请求 / 下载) 设置时限，超时后终止整个进程组
+                result = deadline.run(
+                    cmd, 
+                    shell=True, 
+                    check=True, 
+                    encoding='utf-8' # 强制 utf-8
+                )
+            breaker.record_success()
             return result.stdout
-        except subprocess.CalledProcessError as e:
-            logger.warning(f"命令执行失败 (尝试 {attempt}/{max_retries}): {cmd}")
-            logger.warning(f"错误信息: {e.stderr.strip() if e.stderr else '无 stderr'}")
-            
-            if attempt < max_retries:
-                wait_time = random.uniform(2, 5) * attempt
-                logger.info(f"等待 {wait_time:.2f} 秒后重试...")
-                time.sleep(wait_time)
+        except Exception as e:
+            kind = errors.classify(e)
+            if breaker.record_failure(kind, e):
+                logger.warning(f"Kaggle 熔断中，挂起后重试 (不计入重试次数): {cmd}")
+                attempt -= 1
+                continue
+            if isinstance(e, deadline.DeadlineExceeded):
+                # 超时不在原地重试，由 process_page 放到页末重新排队
+                raise
+            limit, _ = errors.resolve_policy(kind, max_retries - 1, 2)
+            logger.warning(f"命令执行失败 (尝试 {attempt}/{limit + 1}, {errors.LABELS[kind]}): {cmd}")
+            if isinstance(e, subprocess.CalledProcessError):
+                logger.warning(f"错误信息: {e.stderr.strip() if e.stderr else '无 stderr'}")
             else:
+                logger.error(f"未知错误: {e}")
+
+            if limit == 0:
+                errors.record_fast_fail(" ".join(cmd.split()[1:3]), kind)
+                errors.remember(key, e)
+                raise
+            if attempt > limit:
                 logger.error(f"命令最终失败: {cmd}")
-                raise e
-        except Exception as e:
-            logger.error(f"未知错误: {e}")
-            if attempt < max_retries:
-                time.sleep(2)
+                raise
+            # 按子命令 (如 kernels pull) 统计重试原因
+            metrics.record_retry(" ".join(cmd.split()[1:3]), getattr(e, "stderr", None) or e)
+            if kind == errors.RATE_LIMITED:
+                wait_time = errors.backoff(kind, attempt - 1, 2)
             else:
-                raise e
+                wait_time = random.uniform(2, 5) * attempt
+            logger.info(f"等待 {wait_time:.2f} 秒后重试...")
+            time.sleep(wait_time)
 
 def extract_libs(content, language):
     """
@@ -107,149 +140,266 @@ def parse_notebook_content(file_path):
     
     return code_content
 
+def build_kernel_record(kernel_dir:Path, ref=None):
+    """
+    根据本地 kernel 目录 (kernel-metadata.json + 源文件 + log) 构建记录，不访问网络
+    ref 为空时从 metadata 的 id 字段 (username/slug) 推出
+    """
+    # 1. 解析 kernel-metadata.json
+    meta_file = kernel_dir / "kernel-metadata.json"
+    if not meta_file.exists():
+        logger.error(f"元数据文件缺失: {ref or kernel_dir}")
+        return None
+
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    if not ref:
+        ref = meta.get("id") or kernel_dir.name
+    slug = ref.split('/')[-1]
+
+    # 2. 寻找源文件
+    # 源文件通常不是 kernel-metadata.json，也不是 .log 文件
+    # 简单策略：遍历目录，排除特定文件
+    source_file = None
+    log_file = None
+    for p in kernel_dir.iterdir():
+        if p.name == "kernel-metadata.json":
+            continue
+
+        
+        # 假设剩下的那个主要文件就是源码 (通常只有一个源码文件)
+        # 如果有多个，优先取与 slug 同名或 main 的
+        if p.suffix == '.log':
+            log_file = p
+            continue
+        if p.is_file() and p.stem == slug and p.suffix != '.log':
+            source_file = p
+            continue
+
+    if not source_file:
+        logger.warning(f"未找到源文件: {ref}")
+        return None
+
+    # 3. 提取内容和库
+    language = meta.get('language', 'unknown')
+    kernel_type = meta.get('kernel_type', 'unknown')
+    imported_libs = []
+    
+    content = ""
+    
+    # 如果是 Notebook，需要解析 JSON
+    if kernel_type == 'notebook' or source_file.suffix == '.ipynb':
+        content = parse_notebook_content(source_file)
+        # 统一将 notebook 后缀重命名/确保识别为 json (按 Prompt 要求)
+        # 这里我们不改文件名，但在记录中标记，内容解析已完成
+    else:
+        # Script 脚本
+        try:
+            with open(source_file, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read()
+        except Exception as e:
+            logger.error(f"读取源文件失败 {source_file}: {e}")
+
+    # 提取库 (仅限 Python 和 R)
+    if language in ['python', 'r']:
+        imported_libs = extract_libs(content, language)
+    else:
+        logger.warning(f"非 Python/R 语言 ({language})，跳过库提取: {ref}")
+
+    # 4. 构建记录
+    return {
+        "id": meta.get("id"),
+        "title": meta.get("title"),
+        "kernel_type": kernel_type,
+        "language": language,
+        "log_file": log_file.name if log_file else "",
+        "imported_libs": imported_libs
+    }
+
 def process_single_kernel(ref:str, code_dir:Path, page_records):
     """
     处理单个 Kernel：下载、解析、提取信息
     """
     # ref 格式通常为 "username/slug"
     # 将 ref 转换成合法的本地目录名
-    slug = ref.split('/')[-1]
     dir_name = ref.replace('/', '_')
     kernel_dir = code_dir / dir_name
     
-    if not kernel_dir.exists():
-        kernel_dir.mkdir(parents=True)
-    else:
+    # 只有带完成哨兵的目录才跳过，中途失败的目录会重新拉取
+    if staging.is_complete(kernel_dir):
         logger.info(f"目录已存在，跳过下载: {kernel_dir}")
         return
         
     try:
-        # 1. 获取 Metadata 和 Source
-        # -m: metadata, -p: path
-        run_cmd_with_retry(f"kaggle kernels pull {ref} -p \"{kernel_dir}\" -m")
-        
-        # 2. 获取 Output (主要是为了 Log)
-        # 注意：有些 Kernel output 很大，如果只想要 log，后续可能需要清理
-        try:
-            run_cmd_with_retry(f"kaggle kernels output {ref} -p \"{kernel_dir}\"")
-        except Exception:
-            logger.warning(f"获取 Output 失败或无 Output: {ref}，继续处理源文件")
-
-        # 3. 解析 kernel-metadata.json
-        meta_file = kernel_dir / "kernel-metadata.json"
-        if not meta_file.exists():
-            logger.error(f"元数据文件缺失: {ref}")
-            return
-
-        with open(meta_file, 'r', encoding='utf-8') as f:
-            meta = json.load(f)
-
-        # 4. 寻找源文件
-        # 源文件通常不是 kernel-metadata.json，也不是 .log 文件
-        # 简单策略：遍历目录，排除特定文件
-        source_file = None
-        log_file = None
-        for p in kernel_dir.iterdir():
-            if p.name == "kernel-metadata.json":
-                continue
-
+        # 所有文件先写入 .partial 暂存目录，记录生成成功后才落位
+        with staging.staged_dir(kernel_dir, extra={"ref": ref}) as work_dir:
+            # 1. 获取 Metadata 和 Source
+            # -m: metadata, -p: path
+            with metrics.stage("download"):
+                run_cmd_with_retry(f"kaggle kernels pull {ref} -p \"{work_dir}\" -m")
             
-            # 假设剩下的那个主要文件就是源码 (通常只有一个源码文件)
-            # 如果有多个，优先取与 slug 同名或 main 的
-            if p.suffix == '.log':
-                log_file = p
-                continue
-            if p.is_file() and p.stem == slug and p.suffix != '.log':
-                source_file = p
-                continue
-
-        if not source_file:
-            logger.warning(f"未找到源文件: {ref}")
-            return
-
-        # 5. 提取内容和库
-        language = meta.get('language', 'unknown')
-        kernel_type = meta.get('kernel_type', 'unknown')
-        imported_libs = []
-        
-        content = ""
-        
-        # 如果是 Notebook，需要解析 JSON
-        if kernel_type == 'notebook' or source_file.suffix == '.ipynb':
-            content = parse_notebook_content(source_file)
-            # 统一将 notebook 后缀重命名/确保识别为 json (按 Prompt 要求)
-            # 这里我们不改文件名，但在记录中标记，内容解析已完成
-        else:
-            # Script 脚本
+            # 2. 获取 Output (主要是为了 Log)
+            # 注意：有些 Kernel output 很大，如果只想要 log，后续可能需要清理
             try:
-                with open(source_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-            except Exception as e:
-                logger.error(f"读取源文件失败 {source_file}: {e}")
-
-        # 提取库 (仅限 Python 和 R)
-        if language in ['python', 'r']:
-            imported_libs = extract_libs(content, language)
-        else:
-            logger.warning(f"非 Python/R 语言 ({language})，跳过库提取: {ref}")
-
-        # 6. 构建记录
-        record = {
-            "id": meta.get("id"),
-            "title": meta.get("title"),
-            "kernel_type": kernel_type,
-            "language": language,
-            "log_file": log_file.name if log_file else "",
-            "imported_libs": imported_libs
-        }
+                with metrics.stage("files"):
+                    run_cmd_with_retry(f"kaggle kernels output {ref} -p \"{work_dir}\"")
+            except Exception:
+                logger.warning(f"获取 Output 失败或无 Output: {ref}，继续处理源文件")
+            metrics.add_dir_bytes("download", work_dir)
+
+            # 3. 从本地文件解析记录
+            with metrics.stage("parse"), tracing.span("build_kernel_record", cat="parse"):
+                record = build_kernel_record(work_dir, ref)
+            if record is None:
+                raise RuntimeError(f"未能生成记录，丢弃暂存目录: {ref}")
         
         page_records.append(record)
-        logger.info(f"成功处理: {ref} (Libs: {len(imported_libs)})")
+        logger.info(f"成功处理: {ref} (Libs: {len(record['imported_libs'])})")
 
+    except deadline.DeadlineExceeded:
+        # 交给 process_page 重新排队
+        raise
     except Exception as e:
-        logger.error(f"处理 Kernel {ref} 时发生严重错误: {e}")
+        kind = errors.classify(e)
+        if kind in errors.PERMANENT:
+            logger.warning(f"跳过 Kernel {ref}: {errors.LABELS[kind]} ({e})")
+        else:
+            logger.error(f"处理 Kernel {ref} 时发生严重错误: {e}")
+
+def _process_kernel_task(ref, records, queued_at=None):
+    """线程池任务：queued_at 为提交时间，用于追踪排队耗时"""
+    tracing.record_wait("pool_wait", queued_at, ref=ref)
+    with tracing.bind(ref), tracing.span("kernel", cat="item"):
+        process_single_kernel(ref, CODE_DIR, records)
+
+def _reprocess_one(kernel_dir):
+    """进程池任务：单个目录重建记录，异常不向外传播"""
+    try:
+        return build_kernel_record(Path(kernel_dir))
+    except Exception as e:
+        logger.error(f"重建记录失败 {kernel_dir}: {e}")
+        return None
 
-def process_page(page_num):
+def reprocess_local(code_dir:Path=CODE_DIR, workers=None, shard_size=20):
     """
-    处理单个页面的主入口
+    离线重建模式：遍历已下载的 code 目录，多进程重新提取记录并写出新的 info 分片
+    不调用任何 Kaggle 命令，用于修改提取逻辑后在本地快速重算
     """
-    logger.info(f"正在获取第 {page_num} 页的列表...")
-    
-    if not CODE_DIR.exists():
-        CODE_DIR.mkdir(parents=True)
-    if not INFO_DIR.exists():
-        INFO_DIR.mkdir(parents=True)
+    if not code_dir.exists():
+        logger.warning(f"代码目录不存在: {code_dir}")
+        return 0
+    INFO_DIR.mkdir(parents=True, exist_ok=True)
 
-    page_records = []
-    
-    try:
+    # 暂存中的目录不完整，不参与重建
+    kernel_dirs = sorted(str(p) for p in code_dir.iterdir()
+                         if p.is_dir() and not staging.is_partial(p.name))
+    logger.info(f"离线重建: 共 {len(kernel_dirs)} 个 kernel 目录，进程数 {workers or os.cpu_count()}")
+
+    records = []
+    # 解析在子进程中进行，这里按整批统计
+    with metrics.stage("parse", items=len(kernel_dirs)), \
+         ProcessPoolExecutor(max_workers=workers) as executor:
+        # map 保持目录顺序，分片内容在多次运行之间稳定
+        for record in executor.map(_reprocess_one, kernel_dirs, chunksize=16):
+            if record:
+                records.append(record)
+
+    shard_count = 0
+    for start in range(0, len(records), shard_size):
+        shard_count += 1
+        output_jsonl = INFO_DIR / f"reprocess_{shard_count:05d}.jsonl"
+        with open(output_jsonl, 'w', encoding='utf-8') as f:
+            for record in records[start:start + shard_size]:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    logger.info(f"离线重建完成: {len(records)} 条记录，写出 {shard_count} 个分片至 {INFO_DIR}")
+    return len(records)
+
+def list_page(page_num, queue_file=None):
+    """
+    获取一页 kernel 列表，没有数据时返回空列表
+    queue_file 不为空时从 Meta Kaggle 生成的本地队列中按页取数据，不再调用列表接口
+    """
+    if queue_file:
+        # 本地队列已按勋章/语言/日期过滤
+        with metrics.stage("list"):
+            kernels = meta_listing.read_queue_page(queue_file, page_num)
+    else:
         # 获取列表，使用 CSV 格式便于解析
         # --page-size 默认为 20，可以根据需要调整
         cmd = f"kaggle kernels list -p {page_num} --page-size 20 --csv"
-        stdout = run_cmd_with_retry(cmd)
-        
+        with metrics.stage("list"):
+            stdout = run_cmd_with_retry(cmd)
+
         if not stdout:
             logger.warning(f"第 {page_num} 页没有返回数据。")
-            return False
+            return []
 
         # 解析 CSV
         f = StringIO(stdout)
         reader = csv.DictReader(f)
         kernels = list(reader)
-        
+
+    if not kernels:
+        logger.warning(f"第 {page_num} 页解析为空。")
+        return []
+    return kernels
+
+def process_page(page_num, queue_file=None):
+    """
+    处理单个页面的主入口
+    queue_file 的含义见 list_page
+    """
+    logger.info(f"正在获取第 {page_num} 页的列表...")
+    
+    if not CODE_DIR.exists():
+        CODE_DIR.mkdir(parents=True)
+    if not INFO_DIR.exists():
+        INFO_DIR.mkdir(parents=True)
+
+    page_records = []
+    
+    try:
+        kernels = list_page(page_num, queue_file)
         if not kernels:
-            logger.warning(f"第 {page_num} 页解析为空。")
             return False
 
         logger.info(f"第 {page_num} 页共找到 {len(kernels)} 个 Kernels，开始下载...")
 
+        # 各 kernel 并发处理，实际同时进行的请求与下载数由自适应限流器控制；
+        # 每个 ref 的记录单独收集，最后按列表顺序合并，输出与串行处理时一致
+        refs = []
         for row in kernels:
             # ref 通常是 CSV 中的 'ref' 字段 (格式 user/slug)
             ref = row.get('ref')
             if ref:
-                process_single_kernel(ref, CODE_DIR, page_records)
+                refs.append(ref)
             else:
                 logger.warning("无法从 CSV 行中解析 ref")
+        results = {ref: [] for ref in refs}
+
+        # 超时的 kernel 放到页末重新处理一次
+        with ThreadPoolExecutor(max_workers=concurrency.pool_size()) as executor:
+            pending = refs
+            for requeued in (False, True):
+                futures = {executor.submit(_process_kernel_task, ref, results[ref], tracing.now()): ref
+                           for ref in pending}
+                pending = []
+                for future in as_completed(futures):
+                    ref = futures[future]
+                    try:
+                        future.result()
+                    except deadline.DeadlineExceeded as e:
+                        if requeued:
+                            logger.error(f"{ref} 重新排队后仍然超时: {e}")
+                        else:
+                            logger.warning(f"{ref} 超时，页末重新排队: {e}")
+                            pending.append(ref)
+                if not pending:
+                    break
+                metrics.inc("kaggle_requeued_total", len(pending), reason="deadline")
+        page_records = [record for ref in refs for record in results[ref]]
 
         # 保存本页的汇总信息
         if page_records:
@@ -0,0 +1,272 @@
+"""
+可选的内存剖析 (--profile-memory)，用于定位 OOM 与设置容器内存上限
+
+- 每页记录 RSS 起止值、RSS 峰值与 tracemalloc 峰值
+- 通过 metrics 的阶段回调，记录每个阶段 (list / metadata / files / download / parse / upload)
+  执行期间观察到的 RSS / tracemalloc 峰值与单次执行的最大增长
+- 后台线程每 SAMPLE_INTERVAL 秒采样一次；RSS 超过阈值时把 tracemalloc 的前若干个分配位置写到日志旁边，
+  之后每再增长 10% 再写一次，最多 MAX_DUMPS 次
+- 结束时在日志旁边写出 JSON 汇总
+阶段并发执行时峰值按采样时刻处于活动状态的阶段归属，是近似值；进程池中的子进程不在统计范围内
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from pathlib import Path
+from contextlib import contextmanager
+
+import metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("main.memprof")
+
+DEFAULT_THRESHOLD_MB = 2048
+SAMPLE_INTERVAL = 1.0
+TRACE_FRAMES = 10           # 每个分配位置保留的调用栈深度
+TOP_SITES = 25
+MAX_DUMPS = 10
+DUMP_GROWTH = 1.1           # 超过阈值后，每增长 10% 再写一次快照
+
+MB = 1024 * 1024
+
+_enabled = False
+_lock = threading.Lock()
+_dump_lock = threading.Lock()
+_local = threading.local()
+_state = {}
+_pages = []
+_stages = {}                # 阶段名 -> 统计
+_active = {}                # 阶段名 -> 正在执行的数量
+_sampler = None
+
+
+def _page_size():
+    try:
+        return os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 4096
+
+
+_PAGE_SIZE = _page_size()
+
+
+def rss_bytes():
+    """当前 RSS；没有 /proc 的系统 (macOS) 退回到历史峰值"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return max_rss_bytes()
+
+
+def max_rss_bytes():
+    """进程的 RSS 历史峰值"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _mb(value):
+    return None if value is None else round(value / MB, 1)
+
+
+# ================= 采样与快照 =================
+
+def _observe(rss, traced):
+    """记录一次观测值，归属到当前活动的阶段与页"""
+    with _lock:
+        _state["rss_peak"] = max(_state["rss_peak"], rss or 0)
+        page = _state.get("page")
+        if page is not None:
+            page["rss_peak"] = max(page["rss_peak"], rss or 0)
+        for name, count in _active.items():
+            if count:
+                stats = _stages[name]
+                stats["rss_peak"] = max(stats["rss_peak"], rss or 0)
+                stats["traced_peak"] = max(stats["traced_peak"], traced)
+
+
+def _maybe_dump(rss):
+    # 采样线程与页结束时都会调用，同一次越过阈值只写一份快照
+    with _dump_lock:
+        if rss is None or rss < _state["threshold"] or len(_state["dumps"]) >= MAX_DUMPS:
+            return
+        if rss < _state["last_dump_rss"] * DUMP_GROWTH:
+            return
+        _state["last_dump_rss"] = rss
+        dump_top(reason=f"RSS {_mb(rss)} MB 超过阈值 {_mb(_state['threshold'])} MB")
+
+
+def dump_top(reason="手动"):
+    """把 tracemalloc 当前的前 TOP_SITES 个分配位置写到日志旁边"""
+    if not _enabled:
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    stats = snapshot.statistics("traceback")[:TOP_SITES]
+    base = _state["summary_file"]
+    path = base.with_name(f"{base.stem}_top{len(_state['dumps']) + 1}.txt")
+
+    with _lock:
+        active = sorted(name for name, count in _active.items() if count)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} {reason}\n")
+        f.write(f"# 当前页: {(_state.get('page') or {}).get('page')}，活动阶段: {', '.join(active) or '-'}\n\n")
+        for i, stat in enumerate(stats, 1):
+            f.write(f"#{i}: {stat.size / 1024:.1f} KB，{stat.count} 个对象\n")
+            for line in stat.traceback.format(most_recent_first=True):
+                f.write(f"    {line}\n")
+            f.write("\n")
+    _state["dumps"].append(str(path))
+    logger.warning(f"[内存] {reason}，已写出分配位置: {path}")
+    return path
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(daemon=True, name="memprof-sampler")
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                rss = rss_bytes()
+                _observe(rss, tracemalloc.get_traced_memory()[0])
+                _maybe_dump(rss)
+            except Exception as e:
+                logger.warning(f"内存采样失败: {e}")
+
+
+# ================= 阶段与页 =================
+
+def _on_stage(stage_name, entering):
+    """metrics.stage 的回调：记录阶段进入时的内存，退出时计算增长"""
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    rss = rss_bytes()
+    traced = tracemalloc.get_traced_memory()[0]
+    if entering:
+        with _lock:
+            _active[stage_name] = _active.get(stage_name, 0) + 1
+            _stages.setdefault(stage_name, {"count": 0, "rss_peak": 0, "traced_peak": 0,
+                                            "max_rss_growth": 0, "max_traced_growth": 0})
+        stack.append((stage_name, rss, traced))
+        return
+
+    _observe(rss, traced)
+    with _lock:
+        _active[stage_name] = max(0, _active.get(stage_name, 0) - 1)
+        if stack and stack[-1][0] == stage_name:
+            _, rss_start, traced_start = stack.pop()
+            stats = _stages[stage_name]
+            stats["count"] += 1
+            stats["max_rss_growth"] = max(stats["max_rss_growth"], (rss or 0) - (rss_start or 0))
+            stats["max_traced_growth"] = max(stats["max_traced_growth"], traced - traced_start)
+
+
+@contextmanager
+def page(page_id):
+    """统计一页的内存：RSS 起止与峰值、tracemalloc 峰值；未启用时不做任何事"""
+    if not _enabled:
+        yield
+        return
+    tracemalloc.reset_peak()
+    rss = rss_bytes()
+    record = {"page": page_id, "rss_start": rss, "rss_peak": rss or 0, "started": time.time()}
+    with _lock:
+        _state["page"] = record
+    try:
+        yield
+    finally:
+        rss_end = rss_bytes()
+        _observe(rss_end, tracemalloc.get_traced_memory()[0])
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        with _lock:
+            _state["page"] = None
+            _state["traced_peak"] = max(_state["traced_peak"], traced_peak)
+        entry = {
+            "page": page_id,
+            "seconds": round(time.time() - record["started"], 1),
+            "rss_start_mb": _mb(record["rss_start"]),
+            "rss_end_mb": _mb(rss_end),
+            "rss_peak_mb": _mb(record["rss_peak"]),
+            "traced_peak_mb": _mb(traced_peak),
+        }
+        _pages.append(entry)
+        logger.info(f"[内存] 第 {page_id} 页: RSS {entry['rss_start_mb']} -> {entry['rss_end_mb']} MB，"
+                    f"峰值 {entry['rss_peak_mb']} MB，tracemalloc 峰值 {entry['traced_peak_mb']} MB")
+        _maybe_dump(record["rss_peak"])
+
+
+# ================= 启停 =================
+
+def enable(summary_file, threshold_mb=DEFAULT_THRESHOLD_MB, interval=SAMPLE_INTERVAL):
+    """
+    开始内存剖析；summary_file 为 JSON 汇总路径，分配位置快照写在其旁边
+    tracemalloc 会使分配变慢数倍，只在排查内存问题时使用
+    """
+    global _enabled, _sampler
+    summary_file = Path(summary_file)
+    summary_file.parent.mkdir(parents=True, exist_ok=True)
+    _state.update(summary_file=summary_file, threshold=threshold_mb * MB, last_dump_rss=0,
+                  rss_peak=rss_bytes() or 0, traced_peak=0, page=None, dumps=[])
+    tracemalloc.start(TRACE_FRAMES)
+    _enabled = True
+    metrics.add_stage_hook(_on_stage)
+    _sampler = _Sampler(interval)
+    _sampler.start()
+    logger.info(f"[内存] 已开启内存剖析，阈值 {threshold_mb} MB，汇总: {summary_file}")
+
+
+def summary():
+    with _lock:
+        stages = {
+            name: {
+                "count": s["count"],
+                "rss_peak_mb": _mb(s["rss_peak"]),
+                "traced_peak_mb": _mb(s["traced_peak"]),
+                "max_rss_growth_mb": _mb(s["max_rss_growth"]),
+                "max_traced_growth_mb": _mb(s["max_traced_growth"]),
+            }
+            for name, s in sorted(_stages.items())
+        }
+        return {
+            "threshold_mb": _mb(_state["threshold"]),
+            "rss_peak_mb": _mb(max(_state["rss_peak"], max_rss_bytes() or 0)),
+            "traced_peak_mb": _mb(max(_state["traced_peak"], tracemalloc.get_traced_memory()[1])),
+            "pages": list(_pages),
+            "stages": stages,
+            "dumps": list(_state["dumps"]),
+        }
+
+
+def close():
+    """停止采样，写出 JSON 汇总"""
+    global _enabled, _sampler
+    if not _enabled:
+        return
+    if _sampler is not None:
+        _sampler.stopped.set()
+        _sampler = None
+    metrics.remove_stage_hook(_on_stage)
+    data = summary()
+    _enabled = False
+    tracemalloc.stop()
+    with open(_state["summary_file"], "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    logger.info(f"[内存] RSS 峰值 {data['rss_peak_mb']} MB，tracemalloc 峰值 {data['traced_peak_mb']} MB，"
+                f"汇总已写入: {_state['summary_file']}")
@@ -0,0 +1,100 @@
+import re
+import csv
+import logging
+from pathlib import Path
+
+# pandas 只在生成队列时导入，按页读取队列只用 csv 模块
+import meta_store
+
+logger = logging.getLogger("main.meta_listing")
+
+# 与 kaggle kernels list --page-size 20 一致，页码含义保持不变
+PAGE_SIZE = 20
+QUEUE_FILE = Path("./list/meta_kernels.csv")
+# 写出的队列字段与 kaggle kernels list --csv 的列名一致，下游处理不需要区分来源
+QUEUE_COLUMNS = ["ref", "title", "author", "lastRunTime", "totalVotes", "medal", "language"]
+
+
+def build_kernel_queue(meta_dir, out_file=QUEUE_FILE, medal_only=True, language=None,
+                       since=None, until=None):
+    """
+    基于本地 Meta Kaggle CSV 生成待处理的 kernel 队列，替代逐页调用 kaggle kernels list
+    需要 Kernels.csv、KernelVersions.csv、Users.csv；按语言过滤时还需要 KernelLanguages.csv
+    目录下有 meta_store.py 生成的索引库时直接查库
+    过滤条件全部向量化执行；按 TotalVotes 降序写出，返回条目数
+    """
+    import pandas as pd
+    meta_dir = Path(meta_dir)
+
+    kernels = meta_store.read_table(meta_dir, "Kernels", columns=[
+        "Id", "AuthorUserId", "CurrentKernelVersionId", "CurrentUrlSlug",
+        "CreationDate", "MadePublicDate", "Medal", "TotalVotes"
+    ])
+    logger.info(f"Meta Kaggle kernel 总数: {len(kernels)}")
+
+    # 1. 过滤：勋章、公开日期
+    kernels = kernels[kernels["CurrentUrlSlug"].notna() & kernels["CurrentKernelVersionId"].notna()]
+    if medal_only:
+        kernels = kernels[kernels["Medal"].notna()]
+    public_date = pd.to_datetime(kernels["MadePublicDate"].fillna(kernels["CreationDate"]),
+                                 errors="coerce", format="mixed")
+    kernels = kernels.assign(PublicDate=public_date)
+    if since:
+        kernels = kernels[kernels["PublicDate"] >= pd.Timestamp(since)]
+    if until:
+        kernels = kernels[kernels["PublicDate"] <= pd.Timestamp(until)]
+
+    # 2. 当前版本：标题、语言 (KernelVersions 有数 GB，分块读取)
+    versions = meta_store.read_rows_by_ids(meta_dir, "KernelVersions", ["Id", "Title", "ScriptLanguageId"], "Id",
+                                           kernels["CurrentKernelVersionId"])
+    versions = versions.rename(columns={"Id": "CurrentKernelVersionId"})
+    kernels = kernels.merge(versions, on="CurrentKernelVersionId", how="inner")
+
+    has_languages = meta_store.has_source(meta_dir, "KernelLanguages")
+    if has_languages:
+        languages = meta_store.read_table(meta_dir, "KernelLanguages", columns=["Id", "Name"]).set_index("Id")["Name"]
+        kernels["Language"] = kernels["ScriptLanguageId"].map(languages).fillna("").str.lower()
+    else:
+        kernels["Language"] = ""
+    if language:
+        if not has_languages:
+            logger.warning("缺少 KernelLanguages.csv，跳过语言过滤")
+        else:
+            # KernelLanguages 中 notebook 与 script 是不同条目 (Python / IPython Notebook、R / RMarkdown)，
+            # 按词首匹配，避免单字母的 r 命中其他语言
+            pattern = rf"(?:\b|i){re.escape(language.lower())}"
+            kernels = kernels[kernels["Language"].str.contains(pattern, regex=True)]
+
+    # 3. 拼出 ref = 作者用户名/slug
+    users = meta_store.read_rows_by_ids(meta_dir, "Users", ["Id", "UserName"], "Id", kernels["AuthorUserId"])
+    author = kernels["AuthorUserId"].map(users.set_index("Id")["UserName"])
+
+    queue = pd.DataFrame({
+        "ref": author + "/" + kernels["CurrentUrlSlug"],
+        "title": kernels["Title"],
+        "author": author,
+        "lastRunTime": kernels["PublicDate"].dt.strftime("%Y-%m-%d %H:%M:%S"),
+        "totalVotes": kernels["TotalVotes"].fillna(0).astype("int64"),
+        "medal": kernels["Medal"].astype("Int64"),
+        "language": kernels["Language"],
+    })
+    queue = queue[queue["ref"].notna()].sort_values("totalVotes", ascending=False, kind="stable")
+
+    out_file = Path(out_file)
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    queue[QUEUE_COLUMNS].to_csv(out_file, index=False)
+    logger.info(f"Meta Kaggle 队列生成完成: {len(queue)} 条 -> {out_file}")
+    return len(queue)
+
+
+def read_queue_page(queue_file, page_num, page_size=PAGE_SIZE):
+    """按页读取队列文件，返回与 kaggle kernels list --csv 相同结构的行"""
+    start = (page_num - 1) * page_size
+    rows = []
+    with open(queue_file, 'r', encoding='utf-8') as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            if i >= start + page_size:
+                break
+            if i >= start:
+                rows.append(row)
+    return rows
@@ -1,12 +1,13 @@
-﻿import boto3
-from botocore.exceptions import NoCredentialsError
-import os
+﻿import os
 import json
 from pathlib import Path
 import threading
 import atexit
 import sys
 import logging
+import staging
+import metrics
+import tracing
 # ACCESS_KEY = ''
 # SECRET_KEY = ''
 
@@ -35,6 +36,8 @@ atexit.register(cleanup_threads)
 
 
 def oss_client():
+    # boto3 / botocore 导入需要数百毫秒，只在真正连接对象存储时导入
+    import boto3
     config = get_oss_config()
     s3 = boto3.client(
         's3',
@@ -60,6 +63,20 @@ def delete():
     s3 = oss_client()  # 创建OSS客户端连接对象，用于与阿里云对象存储服务进行交互
     resp = s3.delete_object(Bucket="您的已经存在的 bucket 名", Key="您要删除的文件名")  # 调用删除对象方法，从指定的存储桶中删除指定的文件对象
 
+def _item_sentinel(file, folder_path, cache):
+    """
+    向上查找文件所属条目的哨兵，返回 (条目目录, 哨兵内容)
+    不属于任何条目的文件 (例如页级 jsonl) 返回 (None, None)
+    """
+    for parent in file.parents:
+        if parent == folder_path or folder_path not in parent.parents:
+            break
+        if parent not in cache:
+            cache[parent] = staging.load_sentinel(parent) if staging.is_complete(parent) else None
+        if cache[parent] is not None:
+            return parent, cache[parent]
+    return None, None
+
 def upload_files_from_folder(folder_path, bucket_name=None, oss_prefix=None):
     """
     递归遍历指定文件夹及其所有子文件夹中的所有文件并上传到 OSS
@@ -89,7 +106,9 @@ def upload_files_from_folder(folder_path, bucket_name=None, oss_prefix=None):
     # 递归遍历所有子文件夹中的所有文件
     dir_and_files = sorted(folder_path.rglob("*"), key=lambda x: x)
     # 过滤掉目录，只保留文件
-    all_files = [f for f in dir_and_files if f.is_file()]
+    # 同时跳过仍在暂存 (.partial) 中的条目，避免上传写了一半的数据
+    all_files = [f for f in dir_and_files
+                 if f.is_file() and not staging.is_partial(f.relative_to(folder_path))]
 
     # 只取 part-00101_split_0000.json 之后的文件
     # cutoff_file = "part-00201_split_0000.json"
@@ -108,11 +127,24 @@ def upload_files_from_folder(folder_path, bucket_name=None, oss_prefix=None):
 
     success_count = 0
     error_count = 0
+    sentinel_cache = {}
 
     for file in all_files:
         try:
             # 获取相对于根文件夹的路径，保持目录结构
             relative_path = file.relative_to(folder_path)
+
+            # 条目内的文件必须与哨兵记录的大小一致，否则视为损坏，不上传
+            item_dir, sentinel = _item_sentinel(file, folder_path, sentinel_cache)
+            if sentinel is not None and file.name != staging.SENTINEL_NAME:
+                entry = sentinel.get("files", {}).get(file.relative_to(item_dir).as_posix())
+                if entry is None or entry.get("size") != file.stat().st_size:
+                    logger.error(f"✗ 与完成哨兵不一致，跳过: {relative_path}")
+                    error_count += 1
+                    continue
+            # 哨兵一直保留在本地，已上传过的不再重复上传，否则每次调用都会重新上传全部历史条目的哨兵
+            if file.name == staging.SENTINEL_NAME and sentinel is not None and sentinel.get("uploaded"):
+                continue
             oss_path = relative_path.as_posix()
             # 构建 OSS 对象键，保持原有的目录结构
             if oss_prefix:
@@ -122,9 +154,20 @@ def upload_files_from_folder(folder_path, bucket_name=None, oss_prefix=None):
 
             # 上传文件
             logger.info(f"正在上传: {relative_path} -> {object_key}")
-            s3.upload_file(str(file), bucket_name, object_key)
+            size = file.stat().st_size
+            with metrics.stage("upload"), \
+                 tracing.span("s3.upload_file", cat="upload", key=object_key, bytes=size):
+                s3.upload_file(str(file), bucket_name, object_key)
+            metrics.add_bytes("upload", size, direction="up")
             logger.info(f"✓ 成功上传: {relative_path}")
 
+            # 哨兵保留在本地，作为下次运行时断点续传的完成标记，并记下已上传
+            if file.name == staging.SENTINEL_NAME:
+                if sentinel is not None:
+                    sentinel_cache[item_dir] = staging.mark_sentinel(item_dir, uploaded=True)
+                success_count += 1
+                continue
+
             # 上传成功后永久删除本地文件（不放到废纸篓）
             try:
                 os.remove(str(file))
@@ -144,6 +187,7 @@ def upload_files_from_folder(folder_path, bucket_name=None, oss_prefix=None):
     cleanup_threads()
 
 def generate_presigned_url(bucket_name, object_key, expiration=3600):
+    from botocore.exceptions import NoCredentialsError
     try:
         s3 = oss_client()
 
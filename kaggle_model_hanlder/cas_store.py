@@ -0,0 +1,190 @@
+"""
+内容寻址存储 (上传时去重)，由 upload.upload_files_from_folder(dedup=True) 使用
+
+Kaggle 上大量数据集是同一批 CSV 的复制 (Titanic、MNIST、Iris 的 fork)，同一模型的相邻版本也大多共用权重文件。
+开启后条目 (带完成哨兵的目录) 内的文件不再按原路径上传:
+- 每个文件按内容摘要 (哨兵中的 blake2b，见 staging.HASH_ALGORITHM) 上传到 <前缀>/blobs/<摘要前两位>/<摘要>，
+  同样内容的文件只上传一次
+- 每个条目另外上传一份清单 <前缀>/manifests/<条目路径>.json，记录条目内每个相对路径对应的摘要与大小，
+  按清单即可还原出原始目录 (restore_item / open_file)
+- 分块模式 (chunked=True) 下大文件按内容切块 (见 chunking)，每块同样存为 blob，清单中该文件另有 chunks 列表
+页级 JSONL 等不属于任何条目的文件仍按原路径上传
+
+已上传的摘要记在本地索引 (BLOB_INDEX_FILE) 中；不在索引中的先用 HEAD 查询对象存储，其他机器上传过的也不会重复上传
+"""
+import io
+import json
+import shutil
+import logging
+import threading
+import itertools
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import staging
+import metrics
+
+logger = logging.getLogger("main.cas")
+
+BLOB_INDEX_FILE = Path("./local_workspace/cas_blobs.txt")
+CHUNK_UPLOAD_WORKERS = 8
+
+_lock = threading.Lock()
+_known = None           # 已确认存在于对象存储中的摘要；首次使用时从索引文件加载
+
+
+def _load():
+    global _known
+    if _known is None:
+        _known = set()
+        if BLOB_INDEX_FILE.exists():
+            with open(BLOB_INDEX_FILE, "r", encoding="utf-8") as f:
+                _known.update(line.strip() for line in f if line.strip())
+    return _known
+
+
+def _remember(digest):
+    with _lock:
+        known = _load()
+        if digest in known:
+            return
+        known.add(digest)
+        BLOB_INDEX_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(BLOB_INDEX_FILE, "a", encoding="utf-8") as f:
+            f.write(digest + "\n")
+
+
+def blob_key(prefix, digest):
+    return f"{prefix.rstrip('/')}/blobs/{digest[:2]}/{digest}" if prefix else f"blobs/{digest[:2]}/{digest}"
+
+
+def manifest_key(prefix, item_rel):
+    key = f"manifests/{Path(item_rel).as_posix()}.json"
+    return f"{prefix.rstrip('/')}/{key}" if prefix else key
+
+
+def file_digest(file, item_dir, sentinel):
+    """文件的摘要：优先使用哨兵中记录的值，旧版哨兵 (只有 sha256) 时重新计算"""
+    entry = sentinel.get("files", {}).get(Path(file).relative_to(item_dir).as_posix(), {})
+    return entry.get(staging.HASH_ALGORITHM) or staging.file_checksum(file)
+
+
+def _blob_exists(s3, bucket_name, key):
+    from botocore.exceptions import ClientError
+    try:
+        s3.head_object(Bucket=bucket_name, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def _put(s3, bucket_name, prefix, digest, size, upload):
+    key = blob_key(prefix, digest)
+    with _lock:
+        known = digest in _load()
+    if known or _blob_exists(s3, bucket_name, key):
+        _remember(digest)
+        metrics.inc("kaggle_cas_blobs_total", result="deduplicated")
+        metrics.inc("kaggle_cas_saved_bytes_total", size)
+        return key, False
+    upload(key)
+    _remember(digest)
+    metrics.inc("kaggle_cas_blobs_total", result="uploaded")
+    return key, True
+
+
+def put_blob(s3, bucket_name, prefix, file, digest):
+    """
+    上传一个 blob，已存在时跳过；返回 (对象键, 是否实际上传)
+    """
+    return _put(s3, bucket_name, prefix, digest, Path(file).stat().st_size,
+                lambda key: s3.upload_file(str(file), bucket_name, key))
+
+
+def put_chunks(s3, bucket_name, prefix, file, chunks):
+    """
+    上传分块文件的各块 (chunks 为 chunking.chunk_file 的结果)，已存在的块跳过，多个块并行上传
+    返回 (新上传的字节数, 已存在而跳过的字节数)
+    """
+    offsets = list(itertools.accumulate([length for _, length in chunks], initial=0))
+
+    def put(index):
+        digest, length = chunks[index]
+
+        def upload(key):
+            with open(file, "rb") as f:
+                f.seek(offsets[index])
+                s3.put_object(Bucket=bucket_name, Key=key, Body=f.read(length))
+
+        _, uploaded = _put(s3, bucket_name, prefix, digest, length, upload)
+        return length if uploaded else 0
+
+    with ThreadPoolExecutor(max_workers=CHUNK_UPLOAD_WORKERS) as executor:
+        uploaded = sum(executor.map(put, range(len(chunks))))
+    return uploaded, offsets[-1] - uploaded
+
+
+def build_manifest(item_rel, sentinel):
+    """
+    条目清单：相对路径 -> 摘要与大小 (分块存储的文件另有 chunks)，另带哨兵中的 ref 等附加信息
+    摘要与分块列表在删除本地文件之前已写入哨兵 (见 upload)，清单只凭哨兵即可生成
+    """
+    files = {}
+    for rel, entry in sentinel.get("files", {}).items():
+        files[rel] = {"size": entry["size"], staging.HASH_ALGORITHM: entry.get(staging.HASH_ALGORITHM)}
+        if entry.get("chunks"):
+            files[rel]["chunks"] = entry["chunks"]
+    manifest = {k: v for k, v in sentinel.items() if k != "files"}
+    manifest.update(item=Path(item_rel).as_posix(), algorithm=staging.HASH_ALGORITHM, files=files)
+    return manifest
+
+
+def put_manifest(s3, bucket_name, prefix, item_rel, sentinel):
+    """上传条目清单，返回对象键"""
+    manifest = build_manifest(item_rel, sentinel)
+    key = manifest_key(prefix, item_rel)
+    s3.put_object(Bucket=bucket_name, Key=key,
+                  Body=json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"),
+                  ContentType="application/json")
+    return key
+
+
+# ================= 还原 =================
+
+def get_manifest(s3, bucket_name, prefix, item_rel):
+    body = s3.get_object(Bucket=bucket_name, Key=manifest_key(prefix, item_rel))["Body"]
+    return json.loads(body.read().decode("utf-8"))
+
+
+def _get_blob(s3, bucket_name, prefix, digest):
+    return s3.get_object(Bucket=bucket_name, Key=blob_key(prefix, digest))["Body"].read()
+
+
+def open_file(s3, bucket_name, prefix, entry):
+    """
+    清单中一个文件的只读文件对象；分块文件按需逐块取回 (支持 seek)，整文件 blob 直接返回对象的数据流
+    """
+    if entry.get("chunks"):
+        import chunking
+        return io.BufferedReader(chunking.ChunkReader(
+            entry["chunks"], lambda digest: _get_blob(s3, bucket_name, prefix, digest)))
+    return s3.get_object(Bucket=bucket_name, Key=blob_key(prefix, entry[staging.HASH_ALGORITHM]))["Body"]
+
+
+def restore_item(s3, bucket_name, prefix, item_rel, dest_dir):
+    """
+    按清单把条目还原到 dest_dir，逐个文件校验大小与整文件摘要；返回还原的文件数
+    """
+    manifest = get_manifest(s3, bucket_name, prefix, item_rel)
+    dest_dir = Path(dest_dir)
+    for rel, entry in manifest["files"].items():
+        target = dest_dir / rel
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open_file(s3, bucket_name, prefix, entry) as src, open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst, 4 * 1024 * 1024)
+        if target.stat().st_size != entry["size"] or staging.file_checksum(target) != entry[staging.HASH_ALGORITHM]:
+            raise IOError(f"还原后的文件与清单不一致: {rel}")
+        logger.info(f"已还原: {rel}")
+    return len(manifest["files"])
@@ -0,0 +1,160 @@
+"""
+内容定义分块 (CDC)，由 upload.upload_files_from_folder(dedup=True, chunked=True) 使用
+
+整文件去重对版本间只改动了几个百分点的大文件 (checkpoint、追加数据的 CSV) 没有帮助。
+不小于 CHUNK_THRESHOLD 的文件按内容切成 MIN_CHUNK ~ MAX_CHUNK 的块，每块按摘要存为一个 blob (见 cas_store)，
+插入或修改只影响附近的一两个块，其余块与上一版本相同，不再上传
+
+切分点:
+- 滚动哈希为 gear hash：h = sum(GEAR[b[i-k]] << k)，k < WINDOW，只取决于最近 WINDOW 个字节
+- h & MASK == 0 的位置为候选切分点，平均间隔 2^MASK_BITS 字节
+- 从上一个切分点起，跳过前 MIN_CHUNK 字节内的候选；超过 MAX_CHUNK 仍没有候选时强制切分
+哈希按 SEGMENT 大小分段，在线程池中用 numpy 向量化计算 (numpy 运算与 hashlib 都会释放 GIL，可以用满多核)；
+选取切分点只需遍历候选位置，开销可以忽略。块的摘要同样并行计算
+numpy 随 pandas 安装，只在分块时导入
+"""
+import io
+import bisect
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import staging
+import metrics
+
+logger = logging.getLogger("main.chunking")
+
+CHUNK_THRESHOLD = 64 * 1024 ** 2    # 不小于该大小的文件才分块
+MIN_CHUNK = 1024 ** 2
+MAX_CHUNK = 16 * 1024 ** 2
+MASK_BITS = 22                      # 候选切分点平均间隔 4MB
+WINDOW = 32
+SEGMENT = 4 * 1024 ** 2             # 每个任务计算哈希的字节数；numpy 数组约为其 8 倍
+# uint32 哈希中第 j 位只取决于 k <= j 的字节，掩码取高位，使切分点取决于完整的窗口
+MASK = ((1 << MASK_BITS) - 1) << (32 - MASK_BITS)
+
+_gear = None
+
+
+def _gear_table():
+    """256 个 32 位随机数；由 blake2b 生成，不依赖 numpy 随机数实现，不同机器上的切分点一致"""
+    global _gear
+    if _gear is None:
+        import numpy as np
+        _gear = np.array([int.from_bytes(hashlib.blake2b(bytes([i]), digest_size=4).digest(), "little")
+                          for i in range(256)], dtype=np.uint32)
+    return _gear
+
+
+def _read(path, offset, size):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _candidates(path, start, end):
+    """[start, end) 内的候选位置 p (在 p 之后切分)；向前多读 WINDOW - 1 字节，保证窗口完整"""
+    import numpy as np
+    lo = max(0, start - (WINDOW - 1))
+    data = np.frombuffer(_read(path, lo, end - lo), dtype=np.uint8)
+    h = _gear_table().take(data)
+    shifted = np.empty_like(h)
+    # 窗口倍增：h_2w[i] = h_w[i] + (h_w[i - w] << w)，log2(WINDOW) 次向量运算，原地计算避免分配临时数组
+    width = 1
+    while width < WINDOW:
+        np.left_shift(h[:-width], width, out=shifted[:-width])
+        np.add(h[width:], shifted[:-width], out=h[width:])
+        width *= 2
+    np.bitwise_and(h, np.uint32(MASK), out=h)
+    return np.flatnonzero(h[start - lo:] == 0) + start
+
+
+def cut_points(path, size):
+    """文件的分块 [(偏移, 长度), ...]；各段的候选位置互不依赖，分段大小不影响结果"""
+    import numpy as np
+    segments = [(start, min(start + SEGMENT, size)) for start in range(0, size, SEGMENT)]
+    with ThreadPoolExecutor(max_workers=staging.HASH_WORKERS) as executor:
+        parts = list(executor.map(lambda seg: _candidates(path, *seg), segments))
+    candidates = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    chunks = []
+    start = 0
+    while start < size:
+        # 第一个使块长不小于 MIN_CHUNK 的候选
+        i = int(np.searchsorted(candidates, start + MIN_CHUNK - 1))
+        end = int(candidates[i]) + 1 if i < len(candidates) else size
+        end = min(end, start + MAX_CHUNK, size)
+        chunks.append((start, end - start))
+        start = end
+    return chunks
+
+
+def chunk_file(path):
+    """
+    切分并计算每块的摘要，返回 [[摘要, 长度], ...] (按文件顺序)，即清单中 files.<路径>.chunks 的内容
+    """
+    path = str(path)
+    with open(path, "rb") as f:
+        size = f.seek(0, io.SEEK_END)
+    with metrics.stage("chunk"):
+        chunks = cut_points(path, size)
+
+        def digest(chunk):
+            return hashlib.blake2b(_read(path, *chunk), digest_size=32).hexdigest()
+
+        with ThreadPoolExecutor(max_workers=staging.HASH_WORKERS) as executor:
+            digests = list(executor.map(digest, chunks))
+    return [[dg, length] for dg, (_, length) in zip(digests, chunks)]
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    按清单还原分块文件的只读文件对象，支持 seek；每次只缓存当前块，取回的块校验摘要后才返回数据
+    fetch(digest) 返回该块的内容，由调用方决定从哪里读取 (见 cas_store.open_file)
+    """
+
+    def __init__(self, chunks, fetch):
+        self._chunks = chunks
+        self._fetch = fetch
+        self._offsets = []
+        total = 0
+        for _, length in chunks:
+            self._offsets.append(total)
+            total += length
+        self._size = total
+        self._pos = 0
+        self._current = (None, b"")       # (块序号, 内容)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def _chunk(self, index):
+        if self._current[0] != index:
+            digest, length = self._chunks[index]
+            data = self._fetch(digest)
+            if len(data) != length or hashlib.blake2b(data, digest_size=32).hexdigest() != digest:
+                raise IOError(f"分块内容与摘要不一致: {digest}")
+            self._current = (index, data)
+        return self._current[1]
+
+    def readinto(self, buffer):
+        if self._pos >= self._size:
+            return 0
+        index = bisect.bisect_right(self._offsets, self._pos) - 1
+        data = self._chunk(index)
+        start = self._pos - self._offsets[index]
+        n = min(len(buffer), len(data) - start)
+        buffer[:n] = data[start:start + n]
+        self._pos += n
+        return n
@@ -0,0 +1,282 @@
+"""
+错误分类与按类别的重试策略，各处理器共用
+
+- transient     网络抖动、超时、连接中断、5xx，以及 408 / 409 / 425 (请求超时、冲突、过早)：按调用方原有的次数与退避重试
+- rate_limited  429：重试次数更多、等待更长
+- not_found     404 / 410：不重试，记入负缓存
+- forbidden     403 (私有数据集、未接受竞赛规则等)：不重试，记入负缓存
+- bad_input     400 等其余 4xx、参数不合法：不重试，记入负缓存
+- bug           本地缺陷 (AttributeError 等代码错误、CLI 不存在、凭证缺失 / 401)：不重试，也不记入负缓存，
+                修复之后应当重新处理
+
+负缓存 (negative cache) 为追加写的 JSONL，按命令目标 (如 `datasets files owner/slug`) 记录确定失败的请求，
+之后的运行直接跳过，不再调用 Kaggle；删除文件或其中的行即可重新尝试
+无法识别的错误按 transient 处理，与原先一律重试的行为一致
+"""
+import re
+import json
+import time
+import random
+import logging
+import threading
+from pathlib import Path
+from collections import namedtuple
+
+import metrics
+
+logger = logging.getLogger("main.errors")
+
+TRANSIENT = "transient"
+RATE_LIMITED = "rate_limited"
+NOT_FOUND = "not_found"
+FORBIDDEN = "forbidden"
+BAD_INPUT = "bad_input"
+BUG = "bug"
+
+LABELS = {
+    TRANSIENT: "网络错误",
+    RATE_LIMITED: "触发限流",
+    NOT_FOUND: "资源不存在",
+    FORBIDDEN: "无权访问",
+    BAD_INPUT: "请求参数无效",
+    BUG: "本地错误",
+}
+
+# retries / base_delay 为 None 时沿用调用方的参数
+Policy = namedtuple("Policy", ["retries", "base_delay"])
+RETRY_POLICY = {
+    TRANSIENT: Policy(None, None),
+    RATE_LIMITED: Policy(5, 30),
+    NOT_FOUND: Policy(0, 0),
+    FORBIDDEN: Policy(0, 0),
+    BAD_INPUT: Policy(0, 0),
+    BUG: Policy(0, 0),
+}
+# 这些类别说明请求本身注定失败，记入负缓存
+PERMANENT = (NOT_FOUND, FORBIDDEN, BAD_INPUT)
+
+NEGATIVE_CACHE_FILE = Path("./local_workspace/negative_cache.jsonl")
+
+
+class KaggleError(RuntimeError):
+    kind = TRANSIENT
+
+
+class TransientError(KaggleError):
+    kind = TRANSIENT
+
+
+class RateLimitedError(KaggleError):
+    kind = RATE_LIMITED
+
+
+class NotFoundError(KaggleError):
+    kind = NOT_FOUND
+
+
+class ForbiddenError(KaggleError):
+    kind = FORBIDDEN
+
+
+class BadInputError(KaggleError):
+    kind = BAD_INPUT
+
+
+class LocalBugError(KaggleError):
+    kind = BUG
+
+
+_CLASSES = {cls.kind: cls for cls in (TransientError, RateLimitedError, NotFoundError,
+                                      ForbiddenError, BadInputError, LocalBugError)}
+
+# 代码缺陷与本地环境问题，重试不会有不同结果
+_BUG_TYPES = (AttributeError, TypeError, NameError, KeyError, IndexError, AssertionError,
+              ImportError, NotImplementedError, ZeroDivisionError,
+              FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError)
+
+# kaggle-cli / requests 的状态码写法: "404 - Not Found"、"429 Client Error: ..."、"(403)\nReason: Forbidden"
+_STATUS_RE = re.compile(r"(?<![\w/.-])\(?([45]\d\d)\)?(?:\s*-\s|\s+client error|\s+server error|\s*reason)",
+                        re.IGNORECASE)
+# 没有状态码时按关键词判断，依次匹配
+_TEXT_RULES = (
+    (BUG, ("command not found", "no such file or directory: 'kaggle'", "could not find kaggle.json",
+           "unauthorized", "you must authenticate")),
+    (RATE_LIMITED, ("too many requests", "rate limit")),
+    (NOT_FOUND, ("not found", "does not exist", "no longer available")),
+    (FORBIDDEN, ("forbidden", "was denied", "must accept")),
+    (BAD_INPUT, ("bad request",)),
+)
+
+
+# 4xx 中重试可能成功的状态码：请求超时、冲突 (如资源正在处理)、请求过早
+_RETRYABLE_4XX = (408, 409, 425)
+
+
+def _status_kind(status):
+    if status == 429:
+        return RATE_LIMITED
+    if status in _RETRYABLE_4XX:
+        return TRANSIENT
+    if status in (404, 410):
+        return NOT_FOUND
+    if status == 403:
+        return FORBIDDEN
+    if status == 401:
+        return BUG
+    if 400 <= status < 500:
+        return BAD_INPUT
+    return TRANSIENT
+
+
+def _error_text(error):
+    """异常的文本；CalledProcessError 的状态码等信息在 stderr / stdout 中"""
+    parts = [getattr(error, "stderr", None), getattr(error, "stdout", None), str(error)]
+    return "\n".join(p if isinstance(p, str) else p.decode("utf-8", "replace")
+                     for p in parts if p)
+
+
+def _response_status(error):
+    """requests.HTTPError、kagglehub 的 HTTP 异常带 response；botocore ClientError 带 response 字典"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    if isinstance(response, dict):
+        return response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return getattr(response, "status_code", None)
+
+
+def classify_text(text):
+    """按命令输出判断类别，无法判断时返回 None"""
+    match = _STATUS_RE.search(text or "")
+    if match:
+        return _status_kind(int(match.group(1)))
+    lowered = (text or "").lower()
+    for kind, keywords in _TEXT_RULES:
+        if any(k in lowered for k in keywords):
+            return kind
+    return None
+
+
+def classify(error):
+    """返回异常的类别 (TRANSIENT / RATE_LIMITED / NOT_FOUND / FORBIDDEN / BAD_INPUT / BUG)"""
+    if isinstance(error, KaggleError):
+        return error.kind
+    if isinstance(error, _BUG_TYPES):
+        return BUG
+    status = _response_status(error)
+    if status:
+        return _status_kind(status)
+    return classify_text(_error_text(error)) or TRANSIENT
+
+
+def from_output(output, message):
+    """根据命令输出构造对应类别的异常；无法判断类别时为 TransientError"""
+    kind = classify_text(output) or TRANSIENT
+    return _CLASSES[kind](message)
+
+
+def is_permanent(error):
+    return classify(error) in PERMANENT
+
+
+def resolve_policy(kind, max_retries, base_delay):
+    """返回该类别实际使用的 (最大重试次数, 基础等待秒数)"""
+    policy = RETRY_POLICY[kind]
+    return (max_retries if policy.retries is None else policy.retries,
+            base_delay if policy.base_delay is None else policy.base_delay)
+
+
+def backoff(kind, attempt, base_delay, backoff_factor=2):
+    """第 attempt 次重试 (从 0 计) 前的等待秒数；限流时改用更长的基础等待"""
+    _, delay = resolve_policy(kind, None, base_delay)
+    return delay * (backoff_factor ** attempt) + random.uniform(1, 3)
+
+
+def record_fast_fail(op, kind):
+    """记录一次未重试即放弃的失败"""
+    metrics.inc("kaggle_fast_fail_total", op=op, kind=kind)
+
+
+# ================= 负缓存 =================
+
+_lock = threading.Lock()
+_cache = None           # key -> 记录；首次使用时从文件加载
+_cache_file = NEGATIVE_CACHE_FILE
+
+
+def configure(cache_file):
+    """修改负缓存文件位置 (竞赛处理器没有 local_workspace)"""
+    global _cache_file, _cache
+    with _lock:
+        _cache_file = Path(cache_file)
+        _cache = None
+
+
+def _load():
+    global _cache
+    if _cache is not None:
+        return _cache
+    _cache = {}
+    if _cache_file.exists():
+        with open(_cache_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    _cache[entry["key"]] = entry
+                except (ValueError, KeyError):
+                    continue    # 中途被杀时可能留下半行
+    return _cache
+
+
+def command_key(cmd):
+    """
+    命令的缓存键：kaggle 子命令加目标，如 `datasets files owner/slug`
+    没有目标的命令 (list 等) 返回 None，不参与负缓存
+    """
+    words = cmd.split() if isinstance(cmd, str) else [str(w) for w in cmd]
+    if len(words) < 4 or words[0] != "kaggle":
+        return None
+    # models 的子命令可能有多层: models variations versions download <ref>
+    depth = 2
+    if words[1] == "models" and words[2] == "variations":
+        depth = 4 if words[3] == "versions" else 3
+    if len(words) <= depth + 1 or words[depth + 1].startswith("-"):
+        return None
+    return " ".join(words[1:depth + 2])
+
+
+def known_failure(key):
+    """负缓存中的记录；不存在时返回 None"""
+    if key is None:
+        return None
+    with _lock:
+        entry = _load().get(key)
+    if entry:
+        metrics.inc("kaggle_negative_cache_hits_total", kind=entry["kind"])
+    return entry
+
+
+def check(key):
+    """命中负缓存时抛出与当初相同类别的异常"""
+    entry = known_failure(key)
+    if entry:
+        raise _CLASSES[entry["kind"]](f"{LABELS[entry['kind']]} (负缓存 {entry['time']}): {key}")
+
+
+def remember(key, error):
+    """确定失败的请求写入负缓存；返回是否写入"""
+    kind = classify(error)
+    if key is None or kind not in PERMANENT:
+        return False
+    entry = {"key": key, "kind": kind, "error": _error_text(error).strip()[-300:],
+             "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+    with _lock:
+        cache = _load()
+        if key in cache:
+            return False
+        cache[key] = entry
+        _cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(_cache_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    logger.info(f"[负缓存] {key}: {LABELS[kind]}，之后不再请求")
+    return True
@@ -1,11 +1,19 @@
-import subprocess
+import os
 import json
 import logging
 import time
 from pathlib import Path
 import csv
+import queue
+import threading
 from io import StringIO
 from variation_processor import process_variations
+import metrics
+import tracing
+import errors
+import breaker
+import deadline
+import concurrency
 
 logger = logging.getLogger("main.get_data")
 
@@ -14,23 +22,53 @@ OUTPUT_DIR = Path("./local_workspace/output/info")
 
 
 def safe_run(cmd, retry=3):
-    for i in range(retry):
+    """
+    执行 kaggle 命令，失败时返回 None
+    按 errors.classify 的类别决定是否重试：404 / 403 等不重试并记入负缓存，之后直接返回 None；限流时重试更多次、等待更久
+    熔断打开期间的失败不计入重试次数，挂起到 Kaggle 恢复后继续
+    """
+    key = errors.command_key(cmd)
+    if errors.known_failure(key):
+        logger.info(f"负缓存命中，跳过: {key}")
+        return None
+    i = 0
+    while True:
+        breaker.wait()
         try:
             logger.info(f"执行命令: {' '.join(cmd)}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            # 并发名额按命令类别 (元数据请求 / 下载) 自适应调整
+            with concurrency.for_cmd(cmd).slot(), \
+                 tracing.span(tracing.cmd_name(cmd), cat="cmd", cmd=tracing.short(cmd), attempt=i + 1):
+                # 按操作 (元数据请求 / 下载) 设置时限，超时后终止整个进程组
+                result = deadline.run(cmd, check=True)
+            breaker.record_success()
             return result.stdout
         except Exception as e:
+            kind = errors.classify(e)
+            if breaker.record_failure(kind, e):
+                logger.warning(f"Kaggle 熔断中，挂起后重试 (不计入重试次数): {' '.join(cmd)}")
+                continue
+            limit, _ = errors.resolve_policy(kind, retry - 1, 1)
+            if limit == 0:
+                logger.warning(f"{errors.LABELS[kind]}，不再重试: {getattr(e, 'stderr', None) or e}")
+                errors.record_fast_fail(" ".join(cmd[1:3]), kind)
+                errors.remember(key, e)
+                break
+            if i >= limit:
+                break
             logger.warning(f"失败重试 {i+1}: {e}")
-            time.sleep(2 ** i)
+            # 按子命令 (如 models list) 统计重试原因，stderr 中才有 429 等信息
+            metrics.record_retry(" ".join(cmd[1:3]), getattr(e, "stderr", None) or e)
+            time.sleep(errors.backoff(kind, i, 1) if kind == errors.RATE_LIMITED else 2 ** i)
+            i += 1
     return None
 
 
-def process_one_page(token):
+def list_models_page(token):
+    """
+    获取一页模型列表
+    返回 (models, next_token)，失败时返回 None；最后一页的 next_token 为空字符串
+    """
     cmd = [
         "kaggle",
         "models",
@@ -43,7 +81,8 @@ def process_one_page(token):
     if token:
         cmd += ["--page-token", token]
 
-    output = safe_run(cmd)
+    with metrics.stage("list"):
+        output = safe_run(cmd)
     if not output:
         return None
 
@@ -54,8 +93,8 @@ def process_one_page(token):
 
     if first_line.startswith("Next Page Token"):
         next_token = first_line.split("=", 1)[1].strip()
-        header = lines[1].split(",")
-        data_lines = lines[2:]
+        # 第二行是 CSV 表头
+        data_lines = lines[1:]
     else:
         logger.error("未检测到 Next Page Token，格式异常")
         return None
@@ -78,60 +117,158 @@ def process_one_page(token):
             "variations":[]
         })
 
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    return models, next_token
 
-    token_prefix = token[:6] if token else "start"
 
-    output_file = OUTPUT_DIR / f"page_{token_prefix}.json"
+class PagePrefetcher(threading.Thread):
+    """
+    后台线程沿 token 链预取列表，最多领先 depth 页
+    列表返回后立即请求下一页，不必等待当前页的模型下载完成
+    队列元素为 (token, listing)，listing 为 None 表示获取失败；队列以 None 结束
+    """
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(models, f, indent=2)
+    def __init__(self, start_token, count, depth=2):
+        super().__init__(daemon=True)
+        self.start_token = start_token
+        self.count = count
+        self.pages = queue.Queue(maxsize=depth)
 
-    logger.info(f"保存完成: {output_file}")
+    def run(self):
+        token = self.start_token
+        try:
+            for _ in range(self.count):
+                listing = list_models_page(token)
+                self.pages.put((token, listing))
+                if listing is None or not listing[1]:
+                    break
+                token = listing[1]
+                logger.info(f"已预取列表，下一页 token: {token}")
+        finally:
+            self.pages.put(None)
 
-    # 遍历 variation
-    for m in models:
-        logger.info(f"获取模型{m["ref"]}的metadata,并提取description")
-        cmd = ["kaggle", "models", "get", m["ref"], "-p", str(TEMP_DIR)]
+    def __iter__(self):
+        while True:
+            item = self.pages.get()
+            if item is None:
+                return
+            yield item
+
+
+def fetch_model_card(m):
+    """获取模型 metadata，并记录 description 为 modelCard"""
+    logger.info(f"获取模型{m['ref']}的metadata,并提取description")
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    cmd = ["kaggle", "models", "get", m["ref"], "-p", str(TEMP_DIR)]
+    with metrics.stage("metadata"):
         output = safe_run(cmd)
-        
-        if output is None:
-            logger.error(f"无法获取模型 {m["ref"]} 的元数据，跳过。")
-            continue
+    
+    if output is None:
+        logger.error(f"无法获取模型 {m['ref']} 的元数据，跳过。")
+        return False
+
+    # 2. 定位唯一的 JSON 文件
+    json_files = list(TEMP_DIR.glob("*.json"))
+    
+    if len(json_files) != 1:
+        logger.error(f"文件夹状态异常：期望 1 个 JSON，实际找到 {len(json_files)} 个。")
+        # 清理残留文件防止影响下一次循环
+        for f in json_files: f.unlink()
+        return False
+
+    json_path = json_files[0]
+
+    try:
+        # 3. 读取并处理数据
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        # 字段重映射逻辑
+
+        m["modelCard"] = data.get("description","")
+        logger.info(f"成功记录模型: {m['modelSlug']}")
+
+    except Exception as e:
+        logger.error(f"解析 JSON 出错: {e}")
+    finally:
+        # 4. 无论成功失败，删除该文件以保证下次循环时文件夹唯一
+        if json_path.exists():
+            json_path.unlink()
+            logger.debug(f"已清理临时文件: {json_path.name}")
+    return True
 
-        # 2. 定位唯一的 JSON 文件
-        json_files = list(TEMP_DIR.glob("*.json"))
-        
-        if len(json_files) != 1:
-            logger.error(f"文件夹状态异常：期望 1 个 JSON，实际找到 {len(json_files)} 个。")
-            # 清理残留文件防止影响下一次循环
-            for f in json_files: f.unlink()
-            continue
 
-        json_path = json_files[0]
+def append_record(output_file, record):
+    """逐条追加到页级 JSONL 并立即落盘，崩溃时最多丢失正在处理的那个模型"""
+    with open(output_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
 
+
+def load_written_refs(output_file):
+    """
+    页级 JSONL 中已写入的模型 ref；崩溃时写了一半的最后一行截掉，避免之后追加的记录与它连在一起
+    """
+    output_file = Path(output_file)
+    if not output_file.exists():
+        return set()
+    with open(output_file, "rb+") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            logger.warning(f"{output_file.name} 末尾有不完整的记录，已截掉 {len(data) - complete} 字节")
+            f.truncate(complete)
+    refs = set()
+    for line in data[:complete].decode("utf-8").splitlines():
         try:
-            # 3. 读取并处理数据
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            refs.add(json.loads(line)["ref"])
+        except (ValueError, KeyError, TypeError):
+            continue
+    return refs
 
-            # 字段重映射逻辑
 
-            m["modelCard"] = data.get("description","")
-            logger.info(f"成功记录模型: {m['modelSlug']}")
+def process_one_page(token, stream_to_oss=False, listing=None, done_refs=None, on_model_done=None):
+    """
+    处理一页模型列表
+    stream_to_oss 为 True 时模型文件边下载边上传，不落本地磁盘
+    listing 为预取到的 (models, next_token)，为空时在这里请求
+    done_refs 中的模型在上次运行中已完成，直接跳过；页级 JSONL 中已有记录的模型同样跳过，
+    不续跑时重新处理同一页也不会追加重复记录
+    on_model_done(ref) 在每个模型记录落盘后调用，用于记录页内进度
+    """
+    if listing is None:
+        listing = list_models_page(token)
+    if listing is None:
+        return None
 
-        except Exception as e:
-            logger.error(f"解析 JSON 出错: {e}")
-        finally:
-            # 4. 无论成功失败，删除该文件以保证下次循环时文件夹唯一
-            if json_path.exists():
-                json_path.unlink()
-                logger.debug(f"已清理临时文件: {json_path.name}")
-        
-        logger.info(f"处理 model: {m['ref']} 的所有variations")
-        process_variations(m, token_prefix)
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(models, f, indent=2)
+    models, next_token = listing
+    done_refs = set(done_refs or [])
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    token_prefix = token[:6] if token else "start"
+
+    output_file = OUTPUT_DIR / f"page_{token_prefix}.jsonl"
+    done_refs |= load_written_refs(output_file)
+
+    if done_refs:
+        logger.info(f"本页已完成 {len(done_refs)} 个模型，从断点继续")
+
+    # 遍历 variation
+    for m in models:
+        if m["ref"] in done_refs:
+            continue
+
+        # metadata 获取失败的模型只保留列表中的基本信息
+        with tracing.bind(m["ref"]), tracing.span("model", cat="item"):
+            if fetch_model_card(m):
+                logger.info(f"处理 model: {m['ref']} 的所有variations")
+                process_variations(m, token_prefix, stream_to_oss=stream_to_oss)
+
+        append_record(output_file, m)
+        if on_model_done:
+            on_model_done(m["ref"])
+
+    logger.info(f"保存完成: {output_file}")
 
     return {"next_token": next_token}
@@ -4,9 +4,17 @@ import logging
 import json
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import get_data
 import upload
+import metrics
+import tracing
+import memprof
+import deadline
+import concurrency
+import planner
+from variations_get import get_all_variation_version_slugs
 
 SETTING_DIR = Path("setting")
 TOKEN_RECORD_FILE = SETTING_DIR / "page_now.json"
@@ -14,7 +22,7 @@ LOG_DIR = Path("logs")
 DATASET_INFO_DIR = Path("./local_workspace/output")
 
 
-def setup_logging(token_info):
+def setup_logging(token_info, profile_memory=None):
     if not LOG_DIR.exists():
         LOG_DIR.mkdir(parents=True)
 
@@ -39,50 +47,125 @@ def setup_logging(token_info):
     root_logger.addHandler(console_handler)
 
     print(f"日志已初始化: {log_path}")
+
+    # 指标：textfile 定期重写，运行汇总与日志同名放在一起
+    metrics.configure("model", textfile=LOG_DIR / "metrics_model.prom",
+                      summary_file=log_path.with_name(log_path.stem + "_metrics.json"))
+    # 内存剖析：汇总与超过阈值时的分配位置快照同样放在日志旁边
+    if profile_memory:
+        memprof.enable(log_path.with_name(log_path.stem + "_memory.json"), threshold_mb=profile_memory)
     return root_logger
 
 
 def load_token_record():
+    """
+    返回 (token, 该页已完成的模型 ref 列表)
+    token 为正在处理或下一个待处理的页
+    """
     if not TOKEN_RECORD_FILE.exists():
-        return None
+        return None, []
     try:
         with open(TOKEN_RECORD_FILE, 'r') as f:
             data = json.load(f)
-            return data.get("last_token")
+            return data.get("last_token"), data.get("done_refs", [])
     except:
-        return None
+        return None, []
 
 
-def update_token_record(token):
+def update_token_record(token, done_refs=None):
     if not SETTING_DIR.exists():
         SETTING_DIR.mkdir()
-    with open(TOKEN_RECORD_FILE, 'w') as f:
-        json.dump({"last_token": token}, f)
+    tmp_file = TOKEN_RECORD_FILE.with_suffix(".tmp")
+    with open(tmp_file, 'w') as f:
+        json.dump({"last_token": token, "done_refs": done_refs or []}, f)
+    tmp_file.replace(TOKEN_RECORD_FILE)
 
 
-def run_workflow(start_token, count, do_upload):
+def run_workflow(start_token, count, do_upload, stream=False, done_refs=None,
+                 prefetch=2, dedup=False, chunked=False):
     logger = logging.getLogger("main")
 
-    current_token = start_token
+    # 后台沿 token 链预取列表，下载慢时列表请求不再被阻塞
+    prefetcher = get_data.PagePrefetcher(start_token, count, depth=prefetch)
+    prefetcher.start()
 
-    for i in range(count):
+    for i, (current_token, listing) in enumerate(prefetcher):
         logger.info(f"====== 处理批次 {i+1} ======")
         logger.info(f"当前 token: {current_token}")
 
-        result = get_data.process_one_page(current_token)
-
-        if not result:
-            logger.error("本页处理失败")
+        if listing is None:
+            logger.error("获取模型列表失败")
             return
 
+        # 只有第一页可能是上次中断的页
+        page_done = list(done_refs or []) if i == 0 else []
+
+        def on_model_done(ref):
+            page_done.append(ref)
+            update_token_record(current_token, page_done)
+
+        with memprof.page(current_token or "start"):
+            result = get_data.process_one_page(current_token, stream_to_oss=stream, listing=listing,
+                                               done_refs=page_done, on_model_done=on_model_done)
+
+            if not result:
+                logger.error("本页处理失败")
+                return
+
+            if do_upload:
+                logger.info("开始上传当前批次数据")
+                upload.upload_files_from_folder(str(DATASET_INFO_DIR), dedup=dedup, chunked=chunked)
+
         next_token = result["next_token"]
 
-        if do_upload:
-            logger.info("开始上传当前批次数据")
-            upload.upload_files_from_folder(str(DATASET_INFO_DIR))
+        if not next_token:
+            # 保留最后一页及其已完成列表，接续时只会补充新出现的模型
+            logger.info("已到达最后一页")
+            return
 
         update_token_record(next_token)
-        current_token = next_token
+
+
+def run_plan(start_token, count, done_refs=None, byte_budget=None, time_budget=None):
+    """
+    --plan：沿 token 链获取 count 页模型列表及每个模型的 variation 列表，估算 API 调用、下载量与耗时，不下载任何内容
+    列表中没有大小，按历史运行中每次下载的平均字节数估算；列表按投票数排序，给出预算时按排名选择放得下的模型
+    """
+    logger = logging.getLogger("main")
+    models, token, list_calls = [], start_token, 0
+    done_refs = set(done_refs or [])
+    for _ in range(count):
+        listing = get_data.list_models_page(token)
+        list_calls += 1
+        if listing is None:
+            logger.error("获取模型列表失败，只预估已获取的部分")
+            break
+        models.extend(m for m in listing[0] if m["ref"] not in done_refs)
+        token = listing[1]
+        if not token:
+            break
+
+    # variation 列表受 concurrency.API 限制，多个模型并发获取
+    with ThreadPoolExecutor(max_workers=concurrency.API.ceiling) as executor:
+        variations = list(executor.map(lambda m: get_all_variation_version_slugs(m["ref"]) or [], models))
+
+    items = []
+    for rank, (m, slugs) in enumerate(zip(models, variations)):
+        # 每个模型: models get、variations list 各一次；每个 variation: variations get 与下载各一次
+        items.append(planner.make_item(m["ref"], calls=2 + 2 * len(slugs), downloads=len(slugs), value=-rank))
+    list_calls += len(models)
+
+    rates = planner.measured_rates("model")
+    calls_note = (f"模型列表 {list_calls - len(models)} 次 + variation 列表 {len(models)} 次 + "
+                  f"每个模型 get 1 次、每个 variation get 与下载各 1 次；共 {sum(map(len, variations))} 个 variation")
+    page_info = start_token[:6] if start_token else "start"
+    planner.report(f"模型 {count} 批 (从 {page_info} 开始)", planner.estimate(items, list_calls, rates), rates,
+                   calls_note)
+
+    if byte_budget is not None or time_budget is not None:
+        items = planner.select(items, rates, byte_budget=byte_budget, time_budget=time_budget)
+        planner.report("预算内选中的模型", planner.estimate(items, list_calls, rates), rates, calls_note)
+    planner.write_selection(planner.PLAN_DIR / f"plan_model_{page_info}_{count}.csv", items, rates)
 
 
 def main():
@@ -99,11 +182,45 @@ def main():
     parser.add_argument('-c', type=int,
                         help='接续模式，仅配合 --upload')
 
+    parser.add_argument('--stream', action='store_true',
+                        help='流式模式，仅配合 --upload：模型压缩包边下载边解包上传，不占用本地磁盘')
+
+    parser.add_argument('--dedup', action='store_true',
+                        help='配合 --upload：模型文件按内容去重上传到 blobs/<摘要>，相邻版本共用的权重只传一次，每个 variation 另传一份清单 (manifests/)')
+    parser.add_argument('--chunked', action='store_true',
+                        help='配合 --dedup：不小于 64MB 的文件按内容分块，新版本只上传改动的块')
+
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help='列表预取深度：最多提前获取多少页模型列表，默认 2')
+
+    parser.add_argument('--trace', metavar='FILE',
+                        help='记录每次 Kaggle 调用、下载、上传的 span，输出 Chrome trace 格式 (可用 Perfetto 打开)')
+    parser.add_argument('--profile-memory', type=int, nargs='?', const=memprof.DEFAULT_THRESHOLD_MB, metavar='MB',
+                        help='内存剖析：按页和阶段记录 RSS 与 tracemalloc 峰值，RSS 超过阈值 (默认 2048MB) 时写出分配位置')
+    parser.add_argument('--api-timeout', type=int, metavar='SECONDS',
+                        help=f'单次元数据请求 (list / metadata / files 等) 的时限，默认 {deadline.DEADLINES["api"]} 秒')
+    parser.add_argument('--download-timeout', type=int, metavar='SECONDS',
+                        help=f'单次下载的时限，默认 {deadline.DEADLINES["download"]} 秒；超时后终止并重试')
+    parser.add_argument('--api-concurrency', type=concurrency.parse_bounds, metavar='MIN:MAX',
+                        help=f'同时进行的元数据请求数范围，按吞吐、延迟与 429 自动调整，默认 {concurrency.API.floor}:{concurrency.API.ceiling}')
+    parser.add_argument('--download-concurrency', type=concurrency.parse_bounds, metavar='MIN:MAX',
+                        help=f'同时进行的下载数范围，按下载速度与错误自动调整，默认 {concurrency.DOWNLOADS.floor}:{concurrency.DOWNLOADS.ceiling}')
+    parser.add_argument('--plan', action='store_true',
+                        help='只获取模型与 variation 列表，预估 API 调用次数、下载量与耗时，不下载；选中的模型写入 list/plan_model_*.csv')
+    parser.add_argument('--budget-bytes', type=planner.parse_size, metavar='SIZE',
+                        help='配合 --plan：下载量预算，如 2TB，按列表排名 (投票数) 选择放得下的模型')
+    parser.add_argument('--budget-hours', type=float, metavar='HOURS',
+                        help='配合 --plan：耗时预算 (小时)，按当前实测速率选择放得下的模型')
+
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(1)
 
     args = parser.parse_args()
+    deadline.configure(api=args.api_timeout, download=args.download_timeout)
+    concurrency.configure(api=args.api_concurrency, download=args.download_concurrency)
+
+    done_refs = []
 
     if args.local:
         count = args.local
@@ -112,7 +229,7 @@ def main():
     elif args.upload is not None:
 
         if args.c:
-            start_token = load_token_record()
+            start_token, done_refs = load_token_record()
             count = args.c
         else:
             start_token = None
@@ -122,8 +239,32 @@ def main():
         print("参数错误")
         return
 
-    setup_logging(start_token if start_token else "start")
-    run_workflow(start_token, count, do_upload=(args.upload is not None))
+    if args.stream and args.upload is None:
+        print("错误：参数 --stream 只能配合 --upload 使用")
+        sys.exit(1)
+
+    if args.dedup and (args.upload is None or args.stream):
+        print("错误：参数 --dedup 只能配合 --upload 使用，且不能与 --stream 同时使用")
+        sys.exit(1)
+
+    if args.chunked and not args.dedup:
+        print("错误：参数 --chunked 只能配合 --dedup 使用")
+        sys.exit(1)
+
+    setup_logging(start_token if start_token else "start", profile_memory=args.profile_memory)
+    if args.trace:
+        tracing.enable(args.trace)
+    try:
+        if args.plan:
+            run_plan(start_token, count, done_refs=done_refs, byte_budget=args.budget_bytes,
+                     time_budget=args.budget_hours * 3600 if args.budget_hours else None)
+            return
+        run_workflow(start_token, count, do_upload=(args.upload is not None), stream=args.stream,
+                     done_refs=done_refs, prefetch=args.prefetch, dedup=args.dedup, chunked=args.chunked)
+    finally:
+        metrics.shutdown()
+        tracing.close()
+        memprof.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,206 @@
+"""
+运行前的预估 (--plan)：只调用列表接口 (或读取 Meta Kaggle 队列)，不下载任何内容
+
+对每个条目估算 API 调用次数与下载字节数，按最近几次运行实测的速率换算成耗时:
+- API 速率   = 运行中各阶段 (list / metadata / files / download) 的调用次数 / 运行时长
+- 下载速率   = kaggle_bytes_total{stage=download} / 运行时长
+- 预计耗时   = max(API 调用数 / API 速率, 字节数 / 下载速率)；两者在运行中并行，取瓶颈一方
+实测速率已经包含了当时的并发、重试与上传耗时；没有运行记录时使用 DEFAULT_RATES 并在报告中注明
+列表中没有大小的条目 (代码、模型) 按历史运行中每次下载的平均字节数估算
+
+给出字节或时间预算时，按价值 (投票数 / 可用性评分 / 列表排名) 从高到低贪心选择放得下的条目，
+选中的条目写入 CSV，方便按预算拆分任务、估算需要多少台机器
+"""
+import re
+import csv
+import json
+import logging
+from pathlib import Path
+
+logger = logging.getLogger("main.planner")
+
+LOG_DIR = Path("logs")
+PLAN_DIR = Path("list")
+HISTORY_RUNS = 5
+# 没有运行记录时的保守估计
+DEFAULT_RATES = {"calls_per_second": 0.5, "bytes_per_second": 10 * 1024 ** 2, "bytes_per_download": 50 * 1024 ** 2}
+# 只有调用次数足够多的运行才参与估算，过短的运行启动开销占比太大
+MIN_CALLS = 20
+
+_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+_SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?B?)\s*$", re.IGNORECASE)
+
+
+def parse_size(text):
+    """解析 "500GB"、"1.5 TB"、"123456" 等写法，返回字节数；无法解析时抛出 ValueError"""
+    match = _SIZE_RE.match(str(text))
+    if not match:
+        raise ValueError(f"无法解析的大小: {text}")
+    unit = match.group(2).upper()
+    if unit and not unit.endswith("B"):
+        unit += "B"
+    return int(float(match.group(1)) * _UNITS[unit])
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n < 1024 or unit == "TB":
+            return f"{n:.1f}{unit}" if unit != "B" else f"{int(n)}B"
+        n /= 1024
+
+
+def format_duration(seconds):
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} 分钟"
+    if seconds < 86400 * 2:
+        return f"{seconds / 3600:.1f} 小时"
+    return f"{seconds / 86400:.1f} 天"
+
+
+# ================= 实测速率 =================
+
+def _run_totals(summary):
+    """一次运行汇总中的 (调用次数, 下载次数, 下载字节数)"""
+    calls = downloads = 0
+    for stage_name, by_status in summary.get("stages", {}).items():
+        count = sum(s.get("count", 0) for s in by_status.values())
+        if stage_name in ("list", "metadata", "files", "download"):
+            calls += count
+        if stage_name == "download":
+            downloads += by_status.get("ok", {}).get("count", 0)
+    down_bytes = sum(c["value"] for c in summary.get("counters", [])
+                     if c["name"] == "kaggle_bytes_total"
+                     and c["labels"].get("stage") == "download" and c["labels"].get("direction") == "down")
+    return calls, downloads, down_bytes
+
+
+def measured_rates(handler, log_dir=LOG_DIR, runs=HISTORY_RUNS):
+    """
+    最近 runs 次 (有下载的) 运行的速率，返回 DEFAULT_RATES 同结构的字典，另带 "runs" 为参与计算的运行数
+    运行汇总由 metrics.shutdown 写在日志旁边 (logs/run_*_metrics.json)
+    """
+    totals = {"elapsed": 0.0, "calls": 0, "downloads": 0, "bytes": 0}
+    used = 0
+    files = sorted(Path(log_dir).glob("run_*_metrics.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in files:
+        if used >= runs:
+            break
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if summary.get("handler") != handler:
+            continue
+        calls, downloads, down_bytes = _run_totals(summary)
+        # 只列出计划、没有下载的运行不代表实际速率
+        if downloads == 0 or calls < MIN_CALLS:
+            continue
+        totals["elapsed"] += summary.get("elapsed_seconds", 0)
+        totals["calls"] += calls
+        totals["downloads"] += downloads
+        totals["bytes"] += down_bytes
+        used += 1
+
+    if not used or totals["elapsed"] <= 0:
+        return dict(DEFAULT_RATES, runs=0)
+    return {
+        "calls_per_second": totals["calls"] / totals["elapsed"],
+        "bytes_per_second": totals["bytes"] / totals["elapsed"] or DEFAULT_RATES["bytes_per_second"],
+        "bytes_per_download": totals["bytes"] / totals["downloads"] or DEFAULT_RATES["bytes_per_download"],
+        "runs": used,
+    }
+
+
+# ================= 估算与选择 =================
+
+def make_item(ref, calls, downloads=1, size=None, value=0):
+    """
+    一个计划条目：calls 为该条目需要的 API 调用数 (含下载)，downloads 为下载次数，
+    size 为已知的字节数 (未知时为 None，按历史平均估算)，value 为选择时的价值
+    """
+    return {"ref": ref, "calls": calls, "downloads": downloads, "size": size, "value": value}
+
+
+def _item_bytes(item, rates):
+    """条目的 (字节数, 是否为估计值)"""
+    if item["size"] is None:
+        return item["downloads"] * rates["bytes_per_download"], True
+    return item["size"], False
+
+
+def _seconds(calls, n_bytes, rates):
+    return max(calls / rates["calls_per_second"], n_bytes / rates["bytes_per_second"])
+
+
+def estimate(items, list_calls, rates):
+    """汇总：条目数、调用次数、字节数 (其中估计的部分) 与预计耗时"""
+    calls = list_calls + sum(item["calls"] for item in items)
+    total = estimated = 0
+    for item in items:
+        size, is_estimate = _item_bytes(item, rates)
+        total += size
+        if is_estimate:
+            estimated += size
+    return {
+        "items": len(items),
+        "api_calls": calls,
+        "bytes": total,
+        "estimated_bytes": estimated,
+        "api_seconds": calls / rates["calls_per_second"],
+        "download_seconds": total / rates["bytes_per_second"],
+        "wall_seconds": _seconds(calls, total, rates),
+    }
+
+
+def select(items, rates, byte_budget=None, time_budget=None):
+    """
+    按价值从高到低贪心选择：放不进预算的条目跳过，继续尝试后面更小的条目
+    time_budget 为秒数，与 estimate 一样按累计的调用数与字节数计算；返回选中的条目 (保持价值顺序)
+    """
+    chosen, used_calls, used_bytes = [], 0, 0
+    for item in sorted(items, key=lambda it: it["value"], reverse=True):
+        size, _ = _item_bytes(item, rates)
+        if byte_budget is not None and used_bytes + size > byte_budget:
+            continue
+        if time_budget is not None and _seconds(used_calls + item["calls"], used_bytes + size, rates) > time_budget:
+            continue
+        chosen.append(item)
+        used_calls += item["calls"]
+        used_bytes += size
+    return chosen
+
+
+def report(title, plan, rates, calls_per_item):
+    """打印预估结果；calls_per_item 为说明每类条目调用构成的文字"""
+    source = (f"最近 {rates['runs']} 次运行实测" if rates["runs"]
+              else "默认值，logs 中还没有可用的运行记录，结果仅供参考")
+    lines = [
+        f"========== 运行预估: {title} ==========",
+        f"条目数: {plan['items']}",
+        f"API 调用: {plan['api_calls']} 次 ({calls_per_item})",
+        f"下载量: {format_bytes(plan['bytes'])}"
+        + (f" (其中 {format_bytes(plan['estimated_bytes'])} 按平均大小估计)" if plan["estimated_bytes"] else ""),
+        f"速率 ({source}): {rates['calls_per_second']:.2f} 次/秒，{format_bytes(rates['bytes_per_second'])}/秒",
+        f"预计耗时: {format_duration(plan['wall_seconds'])} "
+        f"(API {format_duration(plan['api_seconds'])}，下载 {format_duration(plan['download_seconds'])})",
+    ]
+    for line in lines:
+        logger.info(line)
+
+
+def write_selection(path, items, rates):
+    """选中的条目写入 CSV：ref、字节数、价值、累计字节与累计耗时"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cum_calls, cum_bytes = 0, 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ref", "bytes", "estimated", "value", "cumulative_bytes", "cumulative_hours"])
+        for item in items:
+            size, estimated = _item_bytes(item, rates)
+            cum_calls += item["calls"]
+            cum_bytes += size
+            writer.writerow([item["ref"], int(size), int(estimated), item["value"], int(cum_bytes),
+                             round(_seconds(cum_calls, cum_bytes, rates) / 3600, 3)])
+    logger.info(f"选中的 {len(items)} 个条目已写入: {path}")
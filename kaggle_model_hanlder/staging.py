@@ -0,0 +1,141 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from contextlib import contextmanager
+
+logger = logging.getLogger("main.staging")
+
+# 每个条目 (数据集 / kernel / variation) 完成后写入的哨兵文件
+SENTINEL_NAME = "_COMPLETE.json"
+# 下载过程中的暂存目录后缀，全部步骤成功后才原子重命名为正式目录
+PARTIAL_SUFFIX = ".partial"
+# 哨兵中的文件摘要：blake2b 比 sha256 快，同时作为内容寻址存储 (cas_store) 的键
+HASH_ALGORITHM = "blake2b"
+# 计算摘要的线程数；hashlib 处理大块数据时释放 GIL，多个文件可以并行
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def partial_path(item_dir):
+    item_dir = Path(item_dir)
+    return item_dir.with_name(item_dir.name + PARTIAL_SUFFIX)
+
+
+def is_partial(path):
+    """路径本身或任一上级目录处于暂存状态"""
+    return any(part.endswith(PARTIAL_SUFFIX) for part in Path(path).parts)
+
+
+def is_complete(item_dir):
+    """只有带哨兵文件的目录才算下载完成"""
+    return (Path(item_dir) / SENTINEL_NAME).is_file()
+
+
+def file_checksum(path, chunk_size=4 * 1024 * 1024):
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_sentinel(item_dir, extra=None):
+    """统计目录下所有文件的大小与摘要，多个文件并行计算 (刚写完的文件还在页缓存中，基本不产生额外读盘)"""
+    item_dir = Path(item_dir)
+    paths = [p for p in sorted(item_dir.rglob("*")) if p.is_file() and p.name != SENTINEL_NAME]
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        digests = list(executor.map(file_checksum, paths))
+    files = {}
+    for p, digest in zip(paths, digests):
+        rel = p.relative_to(item_dir).as_posix()
+        files[rel] = {"size": p.stat().st_size, HASH_ALGORITHM: digest}
+
+    sentinel = {
+        "completed_at": datetime.now().isoformat(timespec="seconds"),
+        "file_count": len(files),
+        "total_size": sum(v["size"] for v in files.values()),
+        "files": files,
+    }
+    if extra:
+        sentinel.update(extra)
+    return sentinel
+
+
+def load_sentinel(item_dir):
+    try:
+        with open(Path(item_dir) / SENTINEL_NAME, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _write_sentinel(item_dir, sentinel):
+    tmp_file = Path(item_dir) / (SENTINEL_NAME + ".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(sentinel, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, Path(item_dir) / SENTINEL_NAME)
+
+
+def mark_sentinel(item_dir, **fields):
+    """在已完成条目的哨兵中追加字段 (如 manifest_uploaded)，原子替换，返回更新后的哨兵"""
+    sentinel = load_sentinel(item_dir)
+    if sentinel is None:
+        raise FileNotFoundError(f"条目没有完成哨兵: {item_dir}")
+    sentinel.update(fields)
+    _write_sentinel(item_dir, sentinel)
+    return sentinel
+
+
+def mark_sentinel_file(item_dir, rel, **fields):
+    """在哨兵中某个文件的记录里追加字段 (如去重上传时的摘要与分块列表)，原子替换，返回更新后的哨兵"""
+    sentinel = load_sentinel(item_dir)
+    if sentinel is None:
+        raise FileNotFoundError(f"条目没有完成哨兵: {item_dir}")
+    sentinel.setdefault("files", {}).setdefault(rel, {}).update(fields)
+    _write_sentinel(item_dir, sentinel)
+    return sentinel
+
+
+def finalize(partial_dir, item_dir, extra=None):
+    """写入哨兵并将暂存目录原子重命名为正式目录"""
+    partial_dir, item_dir = Path(partial_dir), Path(item_dir)
+    sentinel = build_sentinel(partial_dir, extra)
+    _write_sentinel(partial_dir, sentinel)
+
+    # 旧版本遗留的、没有哨兵的半成品目录直接丢弃
+    if item_dir.exists():
+        shutil.rmtree(item_dir, ignore_errors=True)
+    os.replace(partial_dir, item_dir)
+    return sentinel
+
+
+@contextmanager
+def staged_dir(item_dir, extra=None):
+    """
+    用法:
+        with staged_dir(target) as work_dir:
+            ...  # 所有下载都写入 work_dir
+    正常退出时写哨兵并原子落位；抛出异常时删除暂存目录，异常继续向上传递
+    extra 为字典时，其内容会在落位前合并进哨兵
+    """
+    item_dir = Path(item_dir)
+    work_dir = partial_path(item_dir)
+    # 上一次中断留下的暂存目录不可信，重新开始
+    if work_dir.exists():
+        logger.info(f"清理上次未完成的暂存目录: {work_dir}")
+        shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+
+    try:
+        yield work_dir
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    finalize(work_dir, item_dir, extra)
@@ -0,0 +1,120 @@
+import time
+import logging
+import tarfile
+import posixpath
+
+import upload
+import range_download
+import metrics
+import tracing
+
+logger = logging.getLogger("main.stream_upload")
+
+# 单个 member 按 64MB 分片上传，最多 4 个分片并发，内存占用约 256MB
+# (首次流式上传时才构造 TransferConfig，避免导入本模块就加载 boto3)
+TRANSFER_OPTIONS = dict(
+    multipart_threshold=64 * 1024 * 1024,
+    multipart_chunksize=64 * 1024 * 1024,
+    max_concurrency=4,
+)
+MAX_ATTEMPTS = 3
+
+
+class NotStreamable(RuntimeError):
+    """压缩包不是 tar (例如 zip 需要读取文件末尾的目录)，只能落盘后再处理"""
+    pass
+
+
+class _MemberReader:
+    """
+    流式 tar 的 member 对象无法 seek (seekable() 本身也会报错)，
+    包一层只暴露 read，让 boto3 按不可 seek 的流做分片上传
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def read(self, size=-1):
+        return self._fileobj.read(size)
+
+    def seekable(self):
+        return False
+
+
+def _safe_member_name(name):
+    name = posixpath.normpath(name.lstrip("/"))
+    if name in (".", "") or name.startswith(".."):
+        return None
+    return name
+
+
+def _stream_once(session, url, s3, bucket, key_prefix, uploaded, transfer_config):
+    target, _, _, _, _, (headers, auth) = range_download._resolve(session, url)
+
+    with session.get(target, headers=headers, auth=auth, stream=True,
+                     timeout=(range_download.CONNECT_TIMEOUT, range_download.STALL_TIMEOUT)) as resp:
+        if resp.status_code != 200:
+            raise range_download.DownloadError(f"下载请求失败 ({resp.status_code}): {url}")
+        resp.raw.decode_content = True
+
+        try:
+            tar = tarfile.open(fileobj=resp.raw, mode="r|*")
+        except tarfile.ReadError:
+            raise NotStreamable(f"不是 tar 格式，无法流式上传: {url}")
+
+        with tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                name = _safe_member_name(member.name)
+                if name is None:
+                    logger.warning(f"跳过非法路径: {member.name}")
+                    continue
+
+                key = f"{key_prefix}/{name}"
+                # 重试时跳过本次调用中上一轮已经完整上传的 member (tar 流会自动越过未读取的数据)；
+                # 不按对象存储中同名对象的大小判断，同大小的旧版本文件会被误认为已上传
+                if uploaded.get(name) == member.size:
+                    continue
+
+                logger.info(f"流式上传: {name} ({member.size} 字节) -> {key}")
+                with tracing.span("s3.upload_fileobj", cat="upload", key=key, bytes=member.size):
+                    s3.upload_fileobj(_MemberReader(tar.extractfile(member)), bucket, key, Config=transfer_config)
+                uploaded[name] = member.size
+                metrics.add_bytes("upload", member.size, direction="up")
+
+
+def stream_version_to_oss(model_ref, variation_ref, version_number, relative_dir):
+    """
+    边下载边解包：从下载流中逐个读取 tar member，直接以分片上传写入对象存储，不落本地磁盘
+    relative_dir 为相对 output 目录的路径 (model/owner_model/framework/instance)，
+    与 upload_files_from_folder 生成的对象键保持一致
+    返回 {member 路径: 大小}
+    """
+    config = upload.get_oss_config()
+    bucket = config["BUCKET_NAME"]
+    prefix = config.get("OSS_PREFIX") or ""
+    key_prefix = "/".join(p for p in [prefix.rstrip("/"), relative_dir.strip("/")] if p)
+
+    import requests
+    from boto3.s3.transfer import TransferConfig
+
+    s3 = upload.oss_client()
+    transfer_config = TransferConfig(**TRANSFER_OPTIONS)
+    session = requests.Session()
+    url = range_download.model_version_url(model_ref, variation_ref, version_number)
+
+    uploaded = {}
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            _stream_once(session, url, s3, bucket, key_prefix, uploaded, transfer_config)
+            logger.info(f"流式上传完成: {model_ref}/{variation_ref}/{version_number}，共 {len(uploaded)} 个文件")
+            return uploaded
+        except (NotStreamable, range_download.ResolveError):
+            raise
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            metrics.record_retry("stream_upload", e)
+            logger.warning(f"流式上传中断 (第 {attempt} 次): {e}，已完成 {len(uploaded)} 个文件，重新开始并跳过已上传部分")
+            time.sleep(2 ** attempt)
@@ -0,0 +1,192 @@
+"""
+可选的 span 追踪，输出 Chrome trace-event 格式 (可直接用 Perfetto / chrome://tracing 打开)
+
+- enable(path) 之后，span() 记录一个完整事件：名称、类别、线程、起止时间，以及条目 ref、字节数等参数
+- bind(ref) 把当前线程正在处理的条目绑定到之后的所有 span 上
+- 事件放在固定长度的环形缓冲区中，只保留最近 MAX_EVENTS 个，多日运行时文件大小不变；
+  后台线程定期整体重写文件，进程异常退出也只丢失最后一个周期
+- 未启用时 span() 直接返回共享的空对象，开销只有一次全局变量判断
+"""
+import os
+import json
+import time
+import threading
+import collections
+from pathlib import Path
+
+MAX_EVENTS = 200_000
+FLUSH_INTERVAL = 60
+# 命令行参数只保留前若干字符，避免单个事件过大
+MAX_ARG_LENGTH = 200
+
+_enabled = False
+_path = None
+_events = collections.deque(maxlen=MAX_EVENTS)
+_lock = threading.Lock()
+_thread_names = {}
+_local = threading.local()
+_origin_ns = time.perf_counter_ns()
+_flusher = None
+_pid = os.getpid()
+
+
+def _now_us():
+    return (time.perf_counter_ns() - _origin_ns) / 1000
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "start")
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"[:MAX_ARG_LENGTH]
+        _record(self.name, self.cat, self.start, _now_us() - self.start, self.args)
+        return False
+
+    def set(self, **args):
+        """span 结束前补充参数，例如下载完成后的字节数"""
+        self.args.update(args)
+
+
+def _record(name, cat, start, dur, args):
+    thread = threading.current_thread()
+    tid = thread.ident
+    if tid not in _thread_names:
+        _thread_names[tid] = thread.name
+    ref = getattr(_local, "ref", None)
+    if ref is not None and "ref" not in args:
+        args["ref"] = ref
+    event = {"name": name, "cat": cat, "ph": "X", "ts": start, "dur": dur,
+             "pid": _pid, "tid": tid, "args": args}
+    with _lock:
+        _events.append(event)
+
+
+def span(name, cat="stage", **args):
+    """记录一个 span；用法: with tracing.span("kaggle datasets files", cat="cmd", ref=ref) as s: ..."""
+    if not _enabled:
+        return _NOOP
+    return _Span(name, cat, args)
+
+
+def record_wait(name, since_us, cat="queue", **args):
+    """记录从 since_us (now() 的返回值) 到现在的等待，例如在线程池或信号量上排队的时间"""
+    if _enabled and since_us is not None:
+        now = _now_us()
+        _record(name, cat, since_us, now - since_us, args)
+
+
+def now():
+    """当前时间戳 (微秒)，未启用时返回 None"""
+    return _now_us() if _enabled else None
+
+
+class bind:
+    """把条目 ref 绑定到当前线程，期间的 span 自动带上 ref 参数"""
+
+    def __init__(self, ref):
+        self.ref = ref
+
+    def __enter__(self):
+        self.previous = getattr(_local, "ref", None)
+        _local.ref = self.ref
+        return self
+
+    def __exit__(self, *exc):
+        _local.ref = self.previous
+        return False
+
+
+def current_ref():
+    """当前线程绑定的条目，用于把 ref 传递给新开的工作线程"""
+    return getattr(_local, "ref", None)
+
+
+def cmd_name(cmd):
+    """命令的子命令部分作为 span 名称，如 kaggle models variations get"""
+    words = cmd.split() if isinstance(cmd, str) else [str(w) for w in cmd]
+    name = words[:1]
+    for word in words[1:]:
+        if word.startswith("-") or "/" in word or "\\" in word:
+            break
+        name.append(word)
+    return " ".join(name)
+
+
+def short(cmd):
+    """命令截断后作为 span 参数"""
+    text = cmd if isinstance(cmd, str) else " ".join(map(str, cmd))
+    return text[:MAX_ARG_LENGTH]
+
+
+def flush():
+    if not _path:
+        return
+    with _lock:
+        events = list(_events)
+    meta = [{"name": "thread_name", "ph": "M", "pid": _pid, "tid": tid, "args": {"name": name}}
+            for tid, name in list(_thread_names.items())]
+    tmp = _path.with_name(_path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": meta + events, "displayTimeUnit": "ms",
+                   "otherData": {"dropped_oldest": len(events) >= MAX_EVENTS}}, f, ensure_ascii=False, default=str)
+    os.replace(tmp, _path)
+
+
+class _Flusher(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(daemon=True, name="trace-flusher")
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                flush()
+            except Exception:
+                pass
+
+
+def enable(path, interval=FLUSH_INTERVAL):
+    global _enabled, _path, _flusher
+    _path = Path(path)
+    _path.parent.mkdir(parents=True, exist_ok=True)
+    _enabled = True
+    if _flusher is None:
+        _flusher = _Flusher(interval)
+        _flusher.start()
+
+
+def close():
+    """停止记录并写出最终文件"""
+    global _enabled, _flusher
+    if not _enabled:
+        return
+    _enabled = False
+    if _flusher is not None:
+        _flusher.stopped.set()
+        _flusher = None
+    flush()
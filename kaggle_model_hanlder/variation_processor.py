@@ -1,91 +1,194 @@
-import subprocess
 import json
 import logging
 import time
+import shutil
+import tempfile
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger("main.variation")
 from variations_get import get_all_variation_version_slugs
+import staging
+import range_download
+import stream_upload
+import metrics
+import tracing
+import errors
+import breaker
+import deadline
+import concurrency
 TEMP_META_DIR = Path("./local_workspace/temp_meta")
 MODEL_OUTPUT_DIR = Path("./local_workspace/output/model")
 
 
 def safe_run(cmd, retry=3):
-    for i in range(retry):
+    """
+    执行 kaggle 命令，失败时返回 None
+    按 errors.classify 的类别决定是否重试：404 / 403 等不重试并记入负缓存，之后直接返回 None；限流时重试更多次、等待更久
+    熔断打开期间的失败不计入重试次数，挂起到 Kaggle 恢复后继续
+    """
+    key = errors.command_key(cmd)
+    if errors.known_failure(key):
+        logger.info(f"负缓存命中，跳过: {key}")
+        return None
+    i = 0
+    while True:
+        breaker.wait()
         try:
             logger.info(f"执行命令: {' '.join(cmd)}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            # 并发名额按命令类别 (元数据请求 / 下载) 自适应调整
+            with concurrency.for_cmd(cmd).slot(), \
+                 tracing.span(tracing.cmd_name(cmd), cat="cmd", cmd=tracing.short(cmd), attempt=i + 1):
+                # 按操作 (元数据请求 / 下载) 设置时限，超时后终止整个进程组
+                result = deadline.run(cmd, check=True)
+            breaker.record_success()
             return result.stdout
         except Exception as e:
-            logger.warning(f"失败重试 {i+1}/{retry}: {e}")
-            time.sleep(2 ** i)
+            kind = errors.classify(e)
+            if breaker.record_failure(kind, e):
+                logger.warning(f"Kaggle 熔断中，挂起后重试 (不计入重试次数): {' '.join(cmd)}")
+                continue
+            limit, _ = errors.resolve_policy(kind, retry - 1, 1)
+            if limit == 0:
+                logger.warning(f"{errors.LABELS[kind]}，不再重试: {getattr(e, 'stderr', None) or e}")
+                errors.record_fast_fail(" ".join(cmd[1:3]), kind)
+                errors.remember(key, e)
+                break
+            if i >= limit:
+                break
+            logger.warning(f"失败重试 {i+1}/{limit + 1}: {e}")
+            # 按子命令 (如 models list) 统计重试原因，stderr 中才有 429 等信息
+            metrics.record_retry(" ".join(cmd[1:3]), getattr(e, "stderr", None) or e)
+            time.sleep(errors.backoff(kind, i, 1) if kind == errors.RATE_LIMITED else 2 ** i)
+            i += 1
     logger.error("命令最终失败")
     return None
 
 
-def process_variations(model_info, page_token_prefix):
+@metrics.timed("download")
+def download_version(model_ref, variation_ref, version_number, target_dir):
     """
-    处理单个 model 的所有 variation
+    下载并解压指定版本的模型文件
+    优先使用可续传的分段下载器，凭证缺失或无法解析下载地址时回退到 kaggle cli
     """
+    version_ref = f"{model_ref}/{variation_ref}/{version_number}"
+    try:
+        range_download.download_and_extract(
+            range_download.model_version_url(model_ref, variation_ref, version_number),
+            version_ref.replace("/", "_") + ".archive",
+            target_dir
+        )
+        return
+    except range_download.ResolveError as e:
+        logger.warning(f"无法使用断点续传下载 {version_ref}，回退到 kaggle cli: {e}")
 
-    owner = model_info["ownerSlug"]
-    model_slug = model_info["modelSlug"]
-    model_ref = model_info["ref"]
+    download_cmd = [
+        "kaggle",
+        "models",
+        "variations",
+        "versions",
+        "download",
+        version_ref,
+        "-p",
+        str(target_dir),
+        "--untar",
+        "--unzip"
+    ]
 
-    # 1️⃣ 获取 variation 列表
-    variation_slugs = get_all_variation_version_slugs(model_ref)
+    if safe_run(download_cmd) is None:
+        raise RuntimeError(f"模型文件下载失败: {version_ref}")
+    metrics.add_dir_bytes("download", target_dir)
 
 
-    # 2️⃣ 遍历 variation
-    for variation_ref in variation_slugs:
+def stream_version(model_ref, variation_ref, version_number, target_dir, work_dir):
+    """
+    流式模式：模型文件不落盘，直接从下载流上传到对象存储
+    压缩包不是 tar 或无法解析下载地址时回退到普通下载
+    返回已上传的 {文件: 大小}，回退时返回 None
+    """
+    relative_dir = target_dir.relative_to(MODEL_OUTPUT_DIR.parent).as_posix()
+    try:
+        with metrics.stage("upload"):
+            return stream_upload.stream_version_to_oss(model_ref, variation_ref, version_number, relative_dir)
+    except (stream_upload.NotStreamable, range_download.ResolveError) as e:
+        logger.warning(f"无法流式上传，回退到本地下载: {e}")
+    download_version(model_ref, variation_ref, version_number, work_dir)
+    return None
 
-        # 下载 metadata
-        TEMP_META_DIR.mkdir(parents=True, exist_ok=True)
 
-        meta_cmd = [
-            "kaggle",
-            "models",
-            "variations",
-            "get",
-            f"{model_ref}/{variation_ref}",
-            "-p",
-            str(TEMP_META_DIR)
-        ]
+def _fetch_variation_metadata(model_ref, variation_ref):
+    """
+    在独立的临时目录中下载 variation metadata，避免并发任务之间互相干扰
+    返回 (metadata 字典, metadata 文件路径, 临时目录)，失败时 metadata 为 None
+    """
+    TEMP_META_DIR.mkdir(parents=True, exist_ok=True)
+    scratch_dir = Path(tempfile.mkdtemp(prefix="variation_", dir=TEMP_META_DIR))
 
+    meta_cmd = [
+        "kaggle",
+        "models",
+        "variations",
+        "get",
+        f"{model_ref}/{variation_ref}",
+        "-p",
+        str(scratch_dir)
+    ]
+
+    # 名额由 safe_run 按 concurrency.API 占用
+    with metrics.stage("metadata"):
         safe_run(meta_cmd)
 
-        # metadata 文件名就是 slug.json
-        json_files= list(TEMP_META_DIR.glob("*.json"))
-    
-        count = len(json_files)
-    
-        if count == 1:
-            meta_file = json_files[0]
-        elif count == 0:
-            logger.error(f"错误：在 {TEMP_META_DIR} 中未找到任何 .json 文件。")
-        else:
-            logger.error(f"错误：在 {TEMP_META_DIR} 中找到了 {count} 个 .json 文件，预期仅有 1 个。")
-
-        with open(meta_file, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
+    # metadata 文件名就是 slug.json
+    json_files = list(scratch_dir.glob("*.json"))
+
+    count = len(json_files)
+    if count == 0:
+        logger.error(f"错误：在 {scratch_dir} 中未找到任何 .json 文件。")
+        return None, None, scratch_dir
+    if count > 1:
+        logger.error(f"错误：在 {scratch_dir} 中找到了 {count} 个 .json 文件，预期仅有 1 个。")
+        return None, None, scratch_dir
+
+    meta_file = json_files[0]
+    with open(meta_file, "r", encoding="utf-8") as f:
+        return json.load(f), meta_file, scratch_dir
+
+
+def process_single_variation(model_info, variation_ref, stream_to_oss=False, queued_at=None):
+    """
+    处理单个 variation：获取 metadata、下载对应版本
+    stream_to_oss 为 True 时模型文件直接流式上传，本地只保留 metadata 与哨兵
+    返回该 variation 的记录，metadata 获取失败时返回 None
+    queued_at 为提交到线程池的时间，用于追踪排队耗时
+    """
+    ref = f"{model_info['ref']}/{variation_ref}"
+    tracing.record_wait("pool_wait", queued_at, ref=ref)
+    with tracing.bind(ref), tracing.span("variation", cat="item"):
+        return _process_single_variation(model_info, variation_ref, stream_to_oss)
+
+
+def _process_single_variation(model_info, variation_ref, stream_to_oss):
+    owner = model_info["ownerSlug"]
+    model_slug = model_info["modelSlug"]
+    model_ref = model_info["ref"]
+
+    scratch_dir = None
+    try:
+        metadata, meta_file, scratch_dir = _fetch_variation_metadata(model_ref, variation_ref)
+        if metadata is None:
+            return None
 
         framework = metadata.get("framework", "unknown")
         instance_slug = metadata.get("instanceSlug", "unknown")
         usage = metadata.get("usage", "")
         version_number = metadata.get("versionNumber")
 
-        # 记录到 model_info
-        model_info["variations"].append({
+        record = {
             "framework": framework,
             "instanceSlug": instance_slug,
             "usage": usage,
             "versionNumber": version_number
-        })
+        }
 
         # 创建目录
         target_dir = (
@@ -95,28 +198,72 @@ def process_variations(model_info, page_token_prefix):
             / instance_slug
         )
 
-        target_dir.mkdir(parents=True, exist_ok=True)
-
-        # 移动 metadata
-        meta_target = target_dir / "metadata.json"
-        meta_file.replace(meta_target)
-
-        # 下载模型文件
-        if version_number is not None:
-
-            download_cmd = [
-                "kaggle",
-                "models",
-                "variations",
-                "versions",
-                "download",
-                f"{model_ref}/{variation_ref}/{version_number}",
-                "-p",
-                str(target_dir),
-                "--untar",
-                "--unzip"
-            ]
-
-            safe_run(download_cmd)
+        # 目录不含版本号，只有哨兵记录的版本与当前版本一致时才跳过；发布了新版本时重新下载并替换
+        sentinel = staging.load_sentinel(target_dir) if staging.is_complete(target_dir) else None
+        if sentinel is not None:
+            if sentinel.get("versionNumber") == version_number:
+                logger.info(f"variation 已完整下载，跳过: {target_dir}")
+                return record
+            logger.info(f"variation 有新版本 ({sentinel.get('versionNumber')} -> {version_number})，"
+                        f"重新下载: {target_dir}")
+
+        # metadata 与模型文件都先写入 .partial 暂存目录，全部成功后才落位
+        extra = {"ref": f"{model_ref}/{variation_ref}", "versionNumber": version_number}
+        try:
+            with staging.staged_dir(target_dir, extra=extra) as work_dir:
+                # 移动 metadata
+                meta_target = work_dir / "metadata.json"
+                meta_file.replace(meta_target)
+
+                # 下载模型文件
+                if version_number is not None:
+                    # 整个下载 (含分段下载、回退 kaggle cli) 占用一个下载名额
+                    with concurrency.DOWNLOADS.slot():
+                        if stream_to_oss:
+                            streamed = stream_version(model_ref, variation_ref, version_number,
+                                                      target_dir, work_dir)
+                            if streamed is not None:
+                                # 已上传的文件清单一并写入哨兵
+                                extra["streamed_files"] = streamed
+                        else:
+                            download_version(model_ref, variation_ref, version_number, work_dir)
+        except Exception as e:
+            logger.error(f"variation {variation_ref} 未完成，已丢弃暂存目录: {e}")
+
+        return record
+    finally:
+        if scratch_dir is not None:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def process_variations(model_info, page_token_prefix, max_workers=None, stream_to_oss=False):
+    """
+    处理单个 model 的所有 variation
+    各 variation 并发执行，metadata 获取与模型下载分别受 concurrency.API / DOWNLOADS 的自适应并发上限约束
+    """
+
+    model_ref = model_info["ref"]
+
+    # 1️⃣ 获取 variation 列表
+    variation_slugs = get_all_variation_version_slugs(model_ref)
+    if not variation_slugs:
+        return model_info["variations"]
+
+    # 2️⃣ 并发处理 variation，结果按列表顺序记录
+    with ThreadPoolExecutor(max_workers=max_workers or concurrency.pool_size()) as executor:
+        futures = [
+            executor.submit(process_single_variation, model_info, variation_ref, stream_to_oss, tracing.now())
+            for variation_ref in variation_slugs
+        ]
+
+        for variation_ref, future in zip(variation_slugs, futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                logger.error(f"处理 variation {model_ref}/{variation_ref} 时发生错误: {e}")
+                continue
+            # 记录到 model_info
+            if record:
+                model_info["variations"].append(record)
 
     return model_info["variations"]
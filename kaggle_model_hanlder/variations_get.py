@@ -1,46 +1,130 @@
-import subprocess
 import json
 import logging
 import time
+import csv
+from io import StringIO
+
+import metrics
+import tracing
+import errors
+import breaker
+import deadline
+import concurrency
 
 logger = logging.getLogger("main.variation")
 
 
 def safe_run(cmd, retry=3):
-    for i in range(retry):
+    """
+    执行 kaggle 命令，失败时返回 None
+    按 errors.classify 的类别决定是否重试：404 / 403 等不重试并记入负缓存，之后直接返回 None；限流时重试更多次、等待更久
+    熔断打开期间的失败不计入重试次数，挂起到 Kaggle 恢复后继续
+    """
+    key = errors.command_key(cmd)
+    if errors.known_failure(key):
+        logger.info(f"负缓存命中，跳过: {key}")
+        return None
+    i = 0
+    while True:
+        breaker.wait()
         try:
             logger.info(f"执行命令: {' '.join(cmd)}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            # 并发名额按命令类别 (元数据请求 / 下载) 自适应调整
+            with concurrency.for_cmd(cmd).slot(), \
+                 tracing.span(tracing.cmd_name(cmd), cat="cmd", cmd=tracing.short(cmd), attempt=i + 1):
+                # 按操作 (元数据请求 / 下载) 设置时限，超时后终止整个进程组
+                result = deadline.run(cmd, check=True)
+            breaker.record_success()
             return result.stdout
         except Exception as e:
+            kind = errors.classify(e)
+            if breaker.record_failure(kind, e):
+                logger.warning(f"Kaggle 熔断中，挂起后重试 (不计入重试次数): {' '.join(cmd)}")
+                continue
+            limit, _ = errors.resolve_policy(kind, retry - 1, 1)
+            if limit == 0:
+                logger.warning(f"{errors.LABELS[kind]}，不再重试: {getattr(e, 'stderr', None) or e}")
+                errors.record_fast_fail(" ".join(cmd[1:3]), kind)
+                errors.remember(key, e)
+                break
+            if i >= limit:
+                break
             logger.warning(f"执行失败，第 {i+1} 次重试: {e}")
-            time.sleep(2 ** i)
-
+            # 按子命令 (如 models list) 统计重试原因，stderr 中才有 429 等信息
+            metrics.record_retry(" ".join(cmd[1:3]), getattr(e, "stderr", None) or e)
+            time.sleep(errors.backoff(kind, i, 1) if kind == errors.RATE_LIMITED else 2 ** i)
+            i += 1
     logger.error("命令执行最终失败")
     return None
 
 
-def get_all_variation_version_slugs(model_ref):
+def _parse_variation_page(output):
+    """
+    解析 `kaggle models variations list -v` 的一页输出
+    返回 (variation 列表, 下一页 token)
+    格式与 models list 相同：可能以 Next Page Token 开头，之后是 CSV
+    """
+    lines = [l for l in output.strip().split("\n") if l.strip()]
+    next_token = None
+
+    if lines and lines[0].strip().startswith("Next Page Token"):
+        next_token = lines[0].split("=", 1)[1].strip() or None
+        lines = lines[1:]
+
+    variations = []
+    for row in csv.DictReader(StringIO("\n".join(lines))):
+        framework = (row.get("framework") or "").strip()
+        instance_slug = (row.get("instanceSlug") or row.get("slug") or "").strip()
+
+        # 部分版本只返回完整 ref: owner/model/framework/instance
+        ref = (row.get("ref") or "").strip()
+        if (not framework or not instance_slug) and ref.count("/") >= 3:
+            framework, instance_slug = ref.split("/")[-2:]
+
+        if framework and instance_slug:
+            variations.append(f"{framework}/{instance_slug}")
+        else:
+            logger.warning(f"无法解析 variation 行: {row}")
+
+    return variations, next_token
+
+
+@metrics.timed("list")
+def get_all_variation_version_slugs(model_ref, page_size=50):
     """
     遍历单个 model 的所有 variation
-    返回所有 version slug 列表
+    返回 variation slug 列表，格式为 framework/instanceSlug，
+    可直接拼接为 {model_ref}/{framework}/{instanceSlug}
     """
+    slugs = []
+    token = None
+
+    while True:
+        cmd = [
+            "kaggle",
+            "models",
+            "variations",
+            "list",
+            model_ref,
+            "--page-size",
+            str(page_size),
+            "-v"
+        ]
+        if token:
+            cmd += ["--page-token", token]
+
+        output = safe_run(cmd)
+        if output is None:
+            logger.error(f"获取 {model_ref} 的 variation 列表失败")
+            break
+
+        page, token = _parse_variation_page(output)
+        for slug in page:
+            if slug not in slugs:
+                slugs.append(slug)
+
+        if not token or not page:
+            break
 
-    cmd = [
-        "kaggle",
-        "models",
-        "variations",
-        "list",
-        model_ref,
-        "-v"
-    ]
-
-    output = safe_run(cmd)
-    # 需要补全
-    
-    return ""
+    logger.info(f"{model_ref} 共找到 {len(slugs)} 个 variation")
+    return slugs